@@ -1,6 +1,8 @@
-from dataclasses import dataclass, field
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass, field, fields
 from datetime import datetime, timezone
-from typing import Literal
+from typing import Any, Literal
 
 from loguru import logger
 from reader import Reader, TagNotFoundError
@@ -25,6 +27,9 @@ class Group:
     send_as_text: bool = False
     send_as_text_username: bool = True
 
+    # Send the embeds of tweets that are posted close together in as few messages as possible, see outbox.py
+    batch_embeds: bool = False
+
     # Translate settings
     translate: bool = False
     translate_to: str = "en-GB"
@@ -50,15 +55,21 @@ class Group:
     created_at: str = field(default_factory=lambda: datetime.now(tz=timezone.utc).isoformat())
 
 
+# The settings a group has, used to ignore keys in group tags that are not settings
+_group_fields: frozenset[str] = frozenset(group_field.name for group_field in fields(Group))
+
+
 @dataclass
 class ApplicationSettings:
     """Settings for the application."""
 
-    # TODO: Grab every instance from https://github.com/zedeus/nitter/wiki/Instances and use a different one each
-    #  time we check for new tweets.
-    # The Nitter instance where we will get the RSS feed from
+    # The Nitter instance where we will get the RSS feed from. Feeds and tweets are always saved with this instance's
+    # URL, even when they are fetched from one of the extra instances.
     nitter_instance: str = "https://nitter.lovinator.space"
 
+    # More Nitter instances to spread the feed updates over, see nitter.py
+    extra_nitter_instances: list[str] = field(default_factory=list)
+
     # DeepL API key used for translating tweets
     deepl_auth_key: str = ""
 
@@ -71,62 +82,129 @@ class ApplicationSettings:
     # Delay between checking for new tweets in minutes
     delay: int = 10
 
+    # How many webhooks we send to at the same time
+    webhook_concurrency: int = 8
+
+    # How many processes check for new tweets, see workers.py. 0 checks in the web server's process.
+    worker_processes: int = 0
+
     def __post_init__(self: "ApplicationSettings") -> None:
         """Don't allow trailing slashes."""
         self.nitter_instance = self.nitter_instance.rstrip("/")
+        self.extra_nitter_instances = [
+            instance.strip().rstrip("/") for instance in self.extra_nitter_instances if instance.strip()
+        ]
         self.piped_instance = self.piped_instance.rstrip("/")
         self.teddit_instance = self.teddit_instance.rstrip("/")
 
 
+# The application settings we loaded last and the reader they came from, see get_app_settings().
+# The tuple is replaced as a whole when the settings change, so readers never see half of an update.
+_app_settings_snapshot: tuple[Reader, ApplicationSettings] | None = None
+_app_settings_lock = threading.Lock()
+
+# Functions that are called with the new settings when they change
+_app_settings_listeners: list[Callable[[ApplicationSettings], None]] = []
+
+
 def get_app_settings(reader: Reader) -> ApplicationSettings:
-    """Get the application settings."""
+    """Get the application settings.
+
+    The settings are only read from the database the first time, after that the same object is returned until
+    set_app_settings() replaces it. Don't modify the returned object, use set_app_settings() instead.
+    """
+    snapshot: tuple[Reader, ApplicationSettings] | None = _app_settings_snapshot
+    if snapshot is not None and snapshot[0] is reader:
+        return snapshot[1]
+
+    return reload_app_settings(reader)
+
+
+def reload_app_settings(reader: Reader) -> ApplicationSettings:
+    """Read the application settings from the database and replace the ones we have in memory."""
+    global _app_settings_snapshot  # noqa: PLW0603
+
     try:
         app_settings = reader.get_tag((), "app_settings")
     except TagNotFoundError:
         logger.info("Applying default application settings. You can change these in the Settings menu.")
         set_app_settings(reader, ApplicationSettings())
         return ApplicationSettings()
-    return ApplicationSettings(**app_settings)
+
+    with _app_settings_lock:
+        _app_settings_snapshot = (reader, ApplicationSettings(**app_settings))
+        return _app_settings_snapshot[1]
 
 
 def set_app_settings(reader: Reader, app_settings: ApplicationSettings) -> None:
     """Set the application settings."""
-    reader.set_tag((), "app_settings", app_settings.__dict__)
+    global _app_settings_snapshot  # noqa: PLW0603
+
+    with _app_settings_lock:
+        reader.set_tag((), "app_settings", app_settings.__dict__)
+        _app_settings_snapshot = (reader, app_settings)
     logger.debug("Saved application settings: {}", app_settings)
 
+    for listener in list(_app_settings_listeners):
+        try:
+            listener(app_settings)
+        except Exception:  # noqa: BLE001
+            logger.exception("Failed to apply the new application settings")
+
+
+def on_app_settings_change(listener: Callable[[ApplicationSettings], None]) -> Callable[[ApplicationSettings], None]:
+    """Call a function with the new settings every time the application settings are changed.
+
+    Can be used as a decorator.
+
+    Args:
+        listener: The function to call.
+
+    Returns:
+        The function.
+    """
+    _app_settings_listeners.append(listener)
+    return listener
+
+
+def group_from_tag(uuid: str, tag: dict[str, Any]) -> Group:
+    """Create a group from its tag. Settings that are missing from the tag get their default value.
+
+    Args:
+        uuid: The uuid of the group, used if the tag doesn't have one.
+        tag: The tag the group is saved in.
+
+    Returns:
+        The group.
+    """
+    return Group(**{"uuid": uuid, **{key: value for key, value in tag.items() if key in _group_fields}})
+
 
 def get_group(reader: Reader, uuid: str) -> Group:
     """Get the group."""
     try:
-        group = reader.get_tag((), uuid)
-        return Group(
-            uuid=group.get("uuid", uuid),
-            name=group.get("name", Group.name),
-            usernames=group.get("usernames", []),
-            webhooks=group.get("webhooks", []),
-            rss_feeds=group.get("rss_feeds", []),
-            send_retweets=group.get("send_retweets", Group.send_retweets),
-            send_replies=group.get("send_replies", Group.send_replies),
-            only_send_if_media=group.get("only_send_if_media", Group.only_send_if_media),
-            send_as_embed=group.get("send_as_embed", Group.send_as_embed),
-            send_as_link=group.get("send_as_link", Group.send_as_link),
-            send_as_text=group.get("send_as_text", Group.send_as_text),
-            send_as_text_username=group.get("send_as_text_username", Group.send_as_text_username),
-            translate=group.get("translate", Group.translate),
-            translate_to=group.get("translate_to", Group.translate_to),
-            translate_from=group.get("translate_from", Group.translate_from),
-            unescape_html=group.get("unescape_html", Group.unescape_html),
-            remove_copyright=group.get("remove_copyright", Group.remove_copyright),
-            link_destination=group.get("link_destination", Group.link_destination),
-            whitelist_enabled=group.get("whitelist_enabled", Group.whitelist_enabled),
-            whitelist=group.get("whitelist", []),
-            whitelist_regex=group.get("whitelist_regex", []),
-            blacklist_enabled=group.get("blacklist_enabled", Group.blacklist_enabled),
-            blacklist=group.get("blacklist", []),
-            blacklist_regex=group.get("blacklist_regex", []),
-            replace_reddit=group.get("replace_reddit", Group.replace_reddit),
-            replace_youtube=group.get("replace_youtube", Group.replace_youtube),
-            created_at=group.get("created_at", datetime.now(tz=timezone.utc).isoformat()),
-        )
+        return group_from_tag(uuid, reader.get_tag((), uuid))
     except TagNotFoundError:
         logger.info("Group {} not found.", uuid)
+
+
+def get_groups(reader: Reader) -> list[Group]:
+    """Get every group in the groups tag.
+
+    Args:
+        reader: The reader to get the groups from.
+
+    Returns:
+        A list of groups. Groups that could not be found are skipped.
+    """
+    # Every group is a global tag, so get them all at once instead of one at a time
+    tags: dict[str, Any] = dict(reader.get_tags(()))
+
+    groups: list[Group] = []
+    for uuid in tags.get("groups", []):
+        tag: Any = tags.get(str(uuid))
+        if not isinstance(tag, dict):
+            logger.error("Group {} not found", uuid)
+            continue
+        groups.append(group_from_tag(str(uuid), tag))
+    return groups
@@ -0,0 +1,140 @@
+import html
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+
+import requests
+from defusedxml import ElementTree
+from loguru import logger
+from reader import Reader
+
+if TYPE_CHECKING:
+    from xml.etree.ElementTree import Element
+
+    from requests import Response
+
+DEFAULT_AVATAR: str = "https://pbs.twimg.com/profile_images/1354479643882004483/Btnfm47p_400x400.jpg"
+
+# How long an avatar is used before we download the feed again to check if it has changed.
+# The avatar is also updated every time the feed is updated, so this is only used for feeds that don't change.
+AVATAR_TTL: timedelta = timedelta(days=7)
+
+# The <image><url> of the channel. Nitter puts it before the first <item>.
+_image_url = re.compile(rb"<image>.*?<url>\s*(.*?)\s*</url>", re.DOTALL)
+
+# Avatars found while parsing feeds, by feed URL. They are saved when the update of the feed is done.
+_found_avatars: dict[str, str] = {}
+_found_avatars_lock = threading.Lock()
+
+
+def remember_avatar(feed_url: str, data: bytes) -> None:
+    """Remember the avatar in a feed we are parsing. It is saved when the update of the feed is done.
+
+    Args:
+        feed_url: The URL of the feed.
+        data: The feed.
+    """
+    channel: bytes = data.split(b"<item>", 1)[0]
+    if (found := _image_url.search(channel)) and found.group(1):
+        with _found_avatars_lock:
+            # The URL is XML, so a & in the query string is &amp;
+            _found_avatars[feed_url] = html.unescape(found.group(1).decode("utf-8", errors="replace"))
+
+
+def save_avatar(reader: Reader, feed_url: str, avatar: str) -> None:
+    """Save the avatar of a feed.
+
+    Args:
+        reader: The reader to save the tag in.
+        feed_url: The URL of the feed.
+        avatar: The URL of the avatar.
+    """
+    reader.set_tag(feed_url, "avatar", {"url": avatar, "updated": datetime.now(tz=timezone.utc).isoformat()})
+
+
+def get_age(saved: dict[str, str]) -> timedelta:
+    """Get how long ago a saved avatar was saved."""
+    return datetime.now(tz=timezone.utc) - datetime.fromisoformat(saved["updated"])
+
+
+def save_found_avatar(reader: Reader, feed_url: str, *args: object) -> None:
+    """Save the avatar we found when the feed was parsed. This is called by reader after a feed is updated."""
+    with _found_avatars_lock:
+        avatar: str | None = _found_avatars.pop(feed_url, None)
+
+    if not avatar:
+        return
+
+    saved: dict[str, str] = reader.get_tag(feed_url, "avatar", {})
+    if saved.get("url") != avatar:
+        logger.debug("Avatar for {} is now {}", feed_url, avatar)
+    elif get_age(saved) < AVATAR_TTL / 2:
+        # Don't write to the database every time the feed is updated
+        return
+
+    save_avatar(reader, feed_url, avatar)
+
+
+def avatar_plugin(reader: Reader) -> None:
+    """Save the avatar of every feed when it is updated, so we don't have to download the feed again for it.
+
+    The avatars are found by the response hook in nitter.py.
+
+    Args:
+        reader: The reader to add the plugin to.
+    """
+    reader.after_feed_update_hooks.append(save_found_avatar)
+
+
+def fetch_avatar(rss_feed: str) -> str | None:
+    """Download the RSS feed and get the avatar from it.
+
+    Args:
+        rss_feed: The URL of the feed.
+
+    Returns:
+        The URL of the avatar, or None if we couldn't get it.
+    """
+    try:
+        response: Response = requests.get(rss_feed, timeout=5)
+    except requests.RequestException as e:
+        logger.error("Failed to get {} - {}", rss_feed, e)
+        return None
+
+    if not response.ok:
+        logger.error(f"Got {response.status_code} from {rss_feed}. Response: {response.text}")
+        return None
+
+    try:
+        root: Element = ElementTree.fromstring(response.content.decode("utf-8"))
+        found: Element | None = root.find("channel/image/url")
+    except ElementTree.ParseError:
+        logger.error("Unable to parse XML from {}", rss_feed)
+        return None
+
+    return found.text if found is not None else None
+
+
+def get_avatar(reader: Reader, feed_url: str) -> str:
+    """Get the avatar of a feed.
+
+    The avatar is saved when the feed is updated, see avatar_plugin(). The feed is only downloaded again if we don't
+    have an avatar for it or if it is older than AVATAR_TTL.
+
+    Args:
+        reader: The reader the avatar is saved in.
+        feed_url: The URL of the feed.
+
+    Returns:
+        The URL of the avatar.
+    """
+    saved: dict[str, str] = reader.get_tag(feed_url, "avatar", {})
+    if saved and get_age(saved) < AVATAR_TTL:
+        return saved["url"]
+
+    if avatar := fetch_avatar(feed_url):
+        save_avatar(reader, feed_url, avatar)
+        return avatar
+
+    return saved.get("url") or DEFAULT_AVATAR
@@ -0,0 +1,579 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from reader import Reader
+
+from discord_twitter_webhooks._dataclasses import ApplicationSettings, Group, set_app_settings
+from discord_twitter_webhooks.metrics import get_snapshot
+from discord_twitter_webhooks.outbox import get_outbox_state, get_outbox_worker
+from discord_twitter_webhooks.reader_settings import get_reader
+from discord_twitter_webhooks.send_to_discord import send_to_discord
+from discord_twitter_webhooks.storage import set_group_feeds
+
+# How many tweets the fake Nitter has in a feed, like the real one
+FEED_SIZE: int = 20
+
+# The metrics that are reported as stages, see get_stage_seconds()
+STAGES: dict[str, str] = {
+    "update_feeds": "dtw_update_feeds_seconds",
+    "update_feed": "dtw_update_feed_seconds",
+    "render": "dtw_render_seconds",
+    "translate": "dtw_translate_seconds",
+    "gif_conversion": "dtw_gif_conversion_seconds",
+    "webhook_post": "dtw_webhook_post_seconds",
+}
+
+
+@dataclass
+class BenchmarkConfig:
+    """What the fake Nitter serves and how the fake Discord behaves."""
+
+    # Feeds and how many new tweets every feed gets per round
+    accounts: int = 50
+    tweets_per_round: int = 2
+    rounds: int = 3
+
+    # Groups, every account is in one of them
+    groups: int = 2
+    webhooks_per_group: int = 2
+
+    # How many of the tweets are retweets, replies and have images or videos attached
+    retweet_rate: float = 0.2
+    reply_rate: float = 0.1
+    image_rate: float = 0.3
+    video_rate: float = 0.0
+
+    # The videos that are converted to GIFs
+    video_seconds: float = 2
+    video_width: int = 320
+    video_height: int = 240
+
+    # How many of the messages Discord answers with 429 Too Many Requests, and for how many seconds
+    rate_limit_rate: float = 0.0
+    retry_after: float = 0.1
+
+    # How many webhooks we post to at the same time, see ApplicationSettings
+    webhook_concurrency: int = 8
+
+    # The same seed gives the same tweets
+    seed: int = 0
+
+
+@dataclass
+class RoundResult:
+    """How long one check for new tweets took."""
+
+    entries: int
+    messages: int
+    dispatch_seconds: float
+    drain_seconds: float
+
+    # Seconds spent in every stage, see STAGES
+    stages: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class BenchmarkResult:
+    config: BenchmarkConfig
+    rounds: list[RoundResult]
+
+    # Messages the fake Discord accepted and answered with 429
+    delivered: int
+    rate_limited: int
+
+    # Messages still in the outbox when the benchmark ended, e.g. because they are waiting to be sent again
+    pending: int
+
+    # Kilobytes, None if the OS can't tell us
+    peak_rss_kb: int | None
+    peak_children_rss_kb: int | None
+
+    @property
+    def entries(self: "BenchmarkResult") -> int:
+        return sum(result.entries for result in self.rounds)
+
+    @property
+    def dispatch_seconds(self: "BenchmarkResult") -> float:
+        return sum(result.dispatch_seconds for result in self.rounds)
+
+    @property
+    def total_seconds(self: "BenchmarkResult") -> float:
+        return sum(result.dispatch_seconds + result.drain_seconds for result in self.rounds)
+
+    @property
+    def entries_per_second(self: "BenchmarkResult") -> float:
+        """New tweets per second of send_to_discord(), without waiting for Discord."""
+        return self.entries / self.dispatch_seconds if self.dispatch_seconds else 0.0
+
+    @property
+    def end_to_end_entries_per_second(self: "BenchmarkResult") -> float:
+        """New tweets per second until every message has been sent."""
+        return self.entries / self.total_seconds if self.total_seconds else 0.0
+
+    def to_dict(self: "BenchmarkResult") -> dict[str, Any]:
+        stages: dict[str, float] = {}
+        for result in self.rounds:
+            for stage, seconds in result.stages.items():
+                stages[stage] = stages.get(stage, 0.0) + seconds
+
+        return {
+            **asdict(self),
+            "entries": self.entries,
+            "entries_per_second": self.entries_per_second,
+            "end_to_end_entries_per_second": self.end_to_end_entries_per_second,
+            "stages": stages,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self: "_Handler", *args: object) -> None:
+        """Don't spam the output."""
+
+    def respond(self: "_Handler", status_code: int, body: bytes, headers: dict[str, str] | None = None) -> None:
+        self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self: "_Server", handler: type[BaseHTTPRequestHandler]) -> None:
+        super().__init__(("127.0.0.1", 0), handler)
+        self._thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self: "_Server") -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self: "_Server") -> "_Server":
+        self._thread.start()
+        return self
+
+    def __exit__(self: "_Server", *args: object) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _NitterHandler(_Handler):
+    server: "FakeNitter"
+
+    def do_GET(self: "_NitterHandler") -> None:  # noqa: N802
+        path: str = self.path.split("?")[0]
+        if path.startswith("/video/") and self.server.video:
+            self.respond(200, self.server.video, {"Content-Type": "video/mp4"})
+        elif path.startswith("/pic/"):
+            self.respond(200, b"", {"Content-Type": "image/jpeg"})
+        elif path.endswith("/rss") and (feed := self.server.get_feed(path.split("/")[1])):
+            self.respond(200, feed, {"Content-Type": "application/rss+xml; charset=utf-8"})
+        else:
+            self.respond(404, b"")
+
+
+class FakeNitter(_Server):
+    """A Nitter instance with made up tweets.
+
+    Every account starts without tweets, call add_tweets() to give them some.
+    """
+
+    def __init__(self: "FakeNitter", config: BenchmarkConfig, video: bytes = b"") -> None:
+        super().__init__(_NitterHandler)
+        self.config: BenchmarkConfig = config
+        self.accounts: list[str] = [f"account{number}" for number in range(config.accounts)]
+
+        # The MP4 every video tweet links to
+        self.video: bytes = video
+
+        self._random = random.Random(config.seed)  # noqa: S311
+        self._tweets: dict[str, list[str]] = {account: [] for account in self.accounts}
+        self._next_id: int = 1
+        self._lock = threading.Lock()
+
+    def get_feed_url(self: "FakeNitter", account: str) -> str:
+        return f"{self.url}/{account}/rss"
+
+    def make_tweet(self: "FakeNitter", account: str, published: datetime) -> str:
+        """Make the <item> of a tweet, with text, links and media like on Nitter."""
+        tweet_id: int = self._next_id
+        self._next_id += 1
+
+        other: str = self._random.choice(self.accounts)
+        kind: float = self._random.random()
+        if kind < self.config.retweet_rate:
+            title: str = f"RT by @{account}: Tweet {tweet_id} #benchmark"
+        elif kind < self.config.retweet_rate + self.config.reply_rate:
+            title = f"R to @{other}: Tweet {tweet_id} #benchmark"
+        else:
+            title = f"Tweet {tweet_id} by @{other} #benchmark"
+
+        description: str = (
+            f'<p>Tweet {tweet_id} by <a href="{self.url}/{other}">@{other}</a> about'
+            f' <a href="{self.url}/search?q=%23benchmark">#benchmark</a> https://example.com/{tweet_id}</p>'
+        )
+        if self._random.random() < self.config.image_rate:
+            description += f'<img src="{self.url}/pic/media%2F{tweet_id}.jpg" style="max-width:250px;" />'
+        if self.video and self._random.random() < self.config.video_rate:
+            description += (
+                f'<video poster="{self.url}/pic/video%2F{tweet_id}.jpg" controls="controls">'
+                f'<source src="{self.url}/video/{tweet_id}.mp4" type="video/mp4"></video>'
+            )
+
+        link: str = f"{self.url}/{account}/status/{tweet_id}#m"
+        return (
+            f"<item><title>{escape(title)}</title><dc:creator>@{account}</dc:creator>"
+            f"<description><![CDATA[{description}]]></description>"
+            f"<pubDate>{format_datetime(published, usegmt=True)}</pubDate>"
+            f"<guid>{link}</guid><link>{link}</link></item>"
+        )
+
+    def add_tweets(self: "FakeNitter", tweets_per_account: int) -> int:
+        """Post new tweets on every account.
+
+        Returns:
+            How many tweets were posted.
+        """
+        now: datetime = datetime.now(tz=timezone.utc)
+        with self._lock:
+            for account in self.accounts:
+                for number in range(tweets_per_account):
+                    # The newest tweet is first in the feed
+                    published: datetime = now - timedelta(seconds=tweets_per_account - number)
+                    self._tweets[account].insert(0, self.make_tweet(account, published))
+                del self._tweets[account][FEED_SIZE:]
+        return tweets_per_account * len(self.accounts)
+
+    def get_feed(self: "FakeNitter", account: str) -> bytes | None:
+        with self._lock:
+            if account not in self._tweets:
+                return None
+            items: str = "".join(self._tweets[account])
+
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<rss xmlns:atom="http://www.w3.org/2005/Atom" xmlns:dc="http://purl.org/dc/elements/1.1/" version="2.0">'
+            f'<channel><atom:link href="{self.get_feed_url(account)}" rel="self" type="application/rss+xml" />'
+            f"<title>Account {account} / @{account}</title><link>{self.url}/{account}</link>"
+            f"<description>Twitter feed for: @{account}. Generated by {self.url}</description>"
+            "<language>en-us</language><ttl>40</ttl>"
+            f"<image><title>Account {account} / @{account}</title><link>{self.url}/{account}</link>"
+            f"<url>{self.url}/pic/{account}.jpg</url><width>128</width><height>128</height></image>"
+            f"{items}</channel></rss>"
+        ).encode()
+
+
+class _DiscordHandler(_Handler):
+    server: "FakeDiscord"
+
+    def do_POST(self: "_DiscordHandler") -> None:  # noqa: N802
+        body: bytes = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.should_rate_limit():
+            retry_after: float = self.server.config.retry_after
+            message: dict[str, Any] = {"message": "You are being rate limited.", "retry_after": retry_after}
+            self.respond(
+                429,
+                json.dumps({**message, "global": False}).encode(),
+                {"Content-Type": "application/json", "Retry-After": str(retry_after), "X-RateLimit-Scope": "user"},
+            )
+            return
+
+        self.server.record(self.path, body)
+        self.respond(204, b"")
+
+
+class FakeDiscord(_Server):
+    """Discord's webhook endpoint. It remembers what was posted and answers some of the messages with a 429."""
+
+    def __init__(self: "FakeDiscord", config: BenchmarkConfig) -> None:
+        super().__init__(_DiscordHandler)
+        self.config: BenchmarkConfig = config
+
+        # The webhook and the size of every message that was accepted
+        self.messages: list[tuple[str, int]] = []
+        self.rate_limited: int = 0
+
+        self._random = random.Random(config.seed)  # noqa: S311
+        self._lock = threading.Lock()
+
+    def get_webhook_url(self: "FakeDiscord", group: int, webhook: int) -> str:
+        return f"{self.url}/api/webhooks/{group}{webhook:03}/benchmark"
+
+    def should_rate_limit(self: "FakeDiscord") -> bool:
+        with self._lock:
+            if self._random.random() < self.config.rate_limit_rate:
+                self.rate_limited += 1
+                return True
+        return False
+
+    def record(self: "FakeDiscord", path: str, body: bytes) -> None:
+        with self._lock:
+            self.messages.append((path, len(body)))
+
+
+def make_video(path: Path, seconds: float, width: int, height: int) -> bytes:
+    """Make an MP4 for the video tweets.
+
+    Returns:
+        The video.
+    """
+    # moviepy is slow to import, see video.py
+    from moviepy.editor import ColorClip
+
+    with ColorClip(size=(width, height), color=(29, 161, 242), duration=seconds) as clip:
+        clip.write_videofile(str(path), fps=24, codec="libx264", audio=False, logger=None)
+    return path.read_bytes()
+
+
+def get_peak_rss() -> tuple[int | None, int | None]:
+    """Get the most memory this process and the processes it started have used.
+
+    Returns:
+        Kilobytes for this process and for the biggest of its finished child processes, None on Windows.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+
+    # macOS uses bytes, everything else uses kilobytes
+    divisor: int = 1024 if sys.platform == "darwin" else 1
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // divisor,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // divisor,
+    )
+
+
+def get_stage_seconds(before: dict[str, list], after: dict[str, list]) -> dict[str, float]:
+    """Get how many seconds were spent in every stage between two metrics snapshots, see metrics.get_snapshot()."""
+
+    def get_sum(snapshot: dict[str, list], name: str) -> float:
+        # The last value of a histogram is the sum of everything it observed
+        return sum(counts[-1] for _, counts in snapshot.get(name, []))
+
+    return {stage: get_sum(after, name) - get_sum(before, name) for stage, name in STAGES.items()}
+
+
+@contextmanager
+def use_data_dir(data_dir: Path) -> Iterator[Reader]:
+    """Use another directory for the database and the GIFs while in the with block.
+
+    Everything calls get_reader() without a location, so the environment variable it gets its location from is
+    changed instead of only passing db_location to it.
+    """
+    variable: str = "APPDATA" if os.name == "nt" else "XDG_DATA_HOME"
+    old_value: str | None = os.environ.get(variable)
+    os.environ[variable] = str(data_dir)
+    get_reader.cache_clear()
+    try:
+        yield get_reader()
+    finally:
+        if old_value is None:
+            os.environ.pop(variable, None)
+        else:
+            os.environ[variable] = old_value
+        get_reader.cache_clear()
+
+
+def add_groups(reader: Reader, nitter: FakeNitter, discord: FakeDiscord, config: BenchmarkConfig) -> None:
+    """Split the accounts over the groups and give every group its webhooks, like main.save_group() does."""
+    uuids: list[str] = []
+    for number in range(config.groups):
+        accounts: list[str] = nitter.accounts[number :: config.groups]
+        group = Group(
+            uuid=f"benchmark-{number}",
+            name=f"Benchmark {number}",
+            usernames=accounts,
+            webhooks=[discord.get_webhook_url(number, webhook) for webhook in range(config.webhooks_per_group)],
+            rss_feeds=[nitter.get_feed_url(account) for account in accounts],
+        )
+        reader.set_tag((), group.uuid, group.__dict__)
+        set_group_feeds(reader, group.uuid, group.rss_feeds)
+        for feed_url in group.rss_feeds:
+            reader.add_feed(feed_url, exist_ok=True, allow_invalid_url=True)
+        uuids.append(group.uuid)
+
+    reader.set_tag((), "groups", uuids)
+
+
+def run_round(reader: Reader, nitter: FakeNitter, discord: FakeDiscord, tweets: int) -> RoundResult:
+    """Post new tweets and send them to Discord.
+
+    Args:
+        reader: The reader.
+        nitter: Where the feeds are.
+        discord: Where the webhooks are.
+        tweets: How many tweets every account posts.
+
+    Returns:
+        How long it took.
+    """
+    entries: int = nitter.add_tweets(tweets)
+
+    # Check every feed now instead of when polling.py thinks they are due
+    for feed in reader.get_feeds():
+        reader.delete_tag(feed, "next_update", missing_ok=True)
+
+    messages_before: int = len(discord.messages)
+    metrics_before: dict[str, list] = get_snapshot()
+
+    started: float = time.perf_counter()
+    send_to_discord(reader)
+    dispatched: float = time.perf_counter()
+    get_outbox_worker(reader).join()
+    drained: float = time.perf_counter()
+
+    return RoundResult(
+        entries=entries,
+        messages=len(discord.messages) - messages_before,
+        dispatch_seconds=dispatched - started,
+        drain_seconds=drained - dispatched,
+        stages=get_stage_seconds(metrics_before, get_snapshot()),
+    )
+
+
+def run_benchmark(config: BenchmarkConfig, data_dir: Path) -> BenchmarkResult:
+    """Send tweets from a fake Nitter to a fake Discord and time it.
+
+    The first check finds the feeds for the first time and only marks their tweets as read, so it isn't counted.
+
+    Args:
+        config: What to benchmark.
+        data_dir: An empty directory for the database and the GIFs.
+
+    Returns:
+        The timings.
+    """
+    video: bytes = b""
+    if config.video_rate > 0:
+        video = make_video(data_dir / "video.mp4", config.video_seconds, config.video_width, config.video_height)
+
+    with FakeNitter(config, video) as nitter, FakeDiscord(config) as discord, use_data_dir(data_dir) as reader:
+        set_app_settings(
+            reader,
+            ApplicationSettings(nitter_instance=nitter.url, webhook_concurrency=config.webhook_concurrency),
+        )
+        add_groups(reader, nitter, discord, config)
+
+        run_round(reader, nitter, discord, config.tweets_per_round)
+        rounds: list[RoundResult] = [
+            run_round(reader, nitter, discord, config.tweets_per_round) for _ in range(config.rounds)
+        ]
+
+        peak_rss_kb, peak_children_rss_kb = get_peak_rss()
+        return BenchmarkResult(
+            config=config,
+            rounds=rounds,
+            delivered=len(discord.messages),
+            rate_limited=discord.rate_limited,
+            pending=sum(get_outbox_state(reader)[state] for state in ("waiting", "failed")),
+            peak_rss_kb=peak_rss_kb,
+            peak_children_rss_kb=peak_children_rss_kb,
+        )
+
+
+def format_result(result: BenchmarkResult) -> str:
+    """Format the result as a table."""
+    lines: list[str] = [
+        f"{'round':>5} {'entries':>8} {'messages':>9} {'dispatch s':>11} {'drain s':>8} {'entries/s':>10}",
+    ]
+    for number, round_result in enumerate(result.rounds, start=1):
+        per_second: float = round_result.entries / round_result.dispatch_seconds if round_result.dispatch_seconds else 0
+        lines.append(
+            f"{number:>5} {round_result.entries:>8} {round_result.messages:>9}"
+            f" {round_result.dispatch_seconds:>11.3f} {round_result.drain_seconds:>8.3f} {per_second:>10.1f}",
+        )
+
+    summary: dict[str, Any] = result.to_dict()
+    lines.append("")
+    lines.append(
+        f"Entries per second: {result.entries_per_second:.1f}"
+        f" ({result.end_to_end_entries_per_second:.1f} end to end)",
+    )
+    lines.append(f"Delivered: {result.delivered}, rate limited: {result.rate_limited}, pending: {result.pending}")
+    lines.append(f"Peak RSS: {result.peak_rss_kb} kB (children: {result.peak_children_rss_kb} kB)")
+    lines.append("Seconds per stage:")
+    lines.extend(f"  {stage:<15} {seconds:.3f}" for stage, seconds in summary["stages"].items())
+    return "\n".join(lines)
+
+
+def compare(result: BenchmarkResult, baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Compare a result with a saved one.
+
+    Args:
+        result: The result of this run.
+        baseline: A result saved with --save.
+        tolerance: How much worse than the baseline is still fine, e.g. 0.2 for 20%.
+
+    Returns:
+        What got worse, empty if nothing did.
+    """
+    regressions: list[str] = []
+    if result.entries_per_second < baseline["entries_per_second"] * (1 - tolerance):
+        regressions.append(
+            f"Entries per second went from {baseline['entries_per_second']:.1f} to {result.entries_per_second:.1f}",
+        )
+    baseline_rss_kb: int | None = baseline.get("peak_rss_kb")
+    if result.peak_rss_kb and baseline_rss_kb and result.peak_rss_kb > baseline_rss_kb * (1 + tolerance):
+        regressions.append(f"Peak RSS went from {baseline['peak_rss_kb']} kB to {result.peak_rss_kb} kB")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the benchmark from the command line.
+
+    python -m discord_twitter_webhooks.benchmark --help
+
+    Returns:
+        The exit code, 1 if the result is worse than the baseline given with --compare.
+    """
+    defaults = BenchmarkConfig()
+    parser = argparse.ArgumentParser(description="Benchmark sending tweets from a fake Nitter to a fake Discord.")
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    parser.add_argument("--save", type=Path, help="Save the result as JSON, to --compare with later.")
+    parser.add_argument("--compare", type=Path, help="Fail if the result is worse than this saved result.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="How much worse than --compare is still fine.")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    config = BenchmarkConfig(**{name: getattr(args, name) for name in asdict(defaults)})
+    with tempfile.TemporaryDirectory(prefix="dtw_benchmark_") as data_dir:
+        result: BenchmarkResult = run_benchmark(config, Path(data_dir))
+
+    print(format_result(result))  # noqa: T201
+    if args.save:
+        args.save.write_text(json.dumps(result.to_dict(), indent=2), encoding="utf-8")
+
+    if args.compare:
+        regressions: list[str] = compare(result, json.loads(args.compare.read_text(encoding="utf-8")), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")  # noqa: T201
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+# How many reader calls the web app runs at the same time
+WEB_WORKERS: int = 4
+
+# How many slow calls, like sending a group's tweets again, the web app runs at the same time
+SLOW_WORKERS: int = 2
+
+
+@lru_cache(maxsize=1)
+def get_web_executor() -> ThreadPoolExecutor:
+    """Get the threads the web app reads and writes the database in."""
+    return ThreadPoolExecutor(max_workers=WEB_WORKERS, thread_name_prefix="web")
+
+
+@lru_cache(maxsize=1)
+def get_slow_executor() -> ThreadPoolExecutor:
+    """Get the threads the web app updates feeds and sends to Discord in.
+
+    These calls can take minutes, so they get their own threads and can't use up the ones the pages need.
+    """
+    return ThreadPoolExecutor(max_workers=SLOW_WORKERS, thread_name_prefix="web_slow")
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, slow: bool = False) -> T:  # noqa: ANN401
+    """Run a blocking function in another thread, so the event loop can answer other requests in the meantime.
+
+    Everything that uses the reader or sends HTTP requests has to go through here when called from a request handler.
+
+    Args:
+        func: The function to run.
+        *args: The arguments to call it with.
+        slow: Run it in the threads for calls that can take minutes.
+
+    Returns:
+        What the function returned.
+    """
+    executor: ThreadPoolExecutor = get_slow_executor() if slow else get_web_executor()
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
@@ -0,0 +1,184 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any
+
+from apscheduler.job import Job
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from loguru import logger
+from reader import Reader
+
+from discord_twitter_webhooks._dataclasses import ApplicationSettings, get_app_settings, on_app_settings_change
+from discord_twitter_webhooks.metrics import Counter, Histogram
+from discord_twitter_webhooks.profiling import profile_cycle
+from discord_twitter_webhooks.send_to_discord import send_to_discord
+from discord_twitter_webhooks.storage import get_db
+
+# The id of the job that checks for new tweets in the web server's process
+CHECK_JOB_ID: str = "check_for_new_tweets"
+
+# How much later than the delay a check can start, as a part of the delay. Spreads out the checks of the worker
+# processes and of other bots that use the same Nitter instance.
+JITTER: float = 0.1
+
+# How many checks are kept for /cycles
+MAX_CYCLES: int = 100
+
+CYCLE_SECONDS = Histogram(
+    "dtw_cycle_seconds",
+    "Time spent checking for new tweets and putting them in the outbox.",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 900, 1800, 3600),
+)
+CYCLES_SKIPPED = Counter(
+    "dtw_cycles_skipped_total",
+    "Checks for new tweets that didn't run because the previous check was still running.",
+)
+
+# Held while checking for new tweets, so two checks never run at the same time in one process
+_cycle_lock = threading.Lock()
+
+
+def get_delay(app_settings: ApplicationSettings) -> int:
+    """Get the minutes between two checks for new tweets."""
+    return app_settings.delay or 10
+
+
+def get_jitter(delay: int) -> float:
+    """Get the most seconds a check can start later than the delay, see JITTER."""
+    return delay * 60 * JITTER
+
+
+def save_cycle(reader: Reader, started: float, seconds: float, delay: int) -> None:
+    """Save how long a check for new tweets took and delete the oldest ones if there are more than MAX_CYCLES."""
+    with get_db(reader) as db:
+        db.execute(
+            "INSERT INTO cycles (process, started, seconds, delay) VALUES (?, ?, ?, ?);",
+            (f"{socket.gethostname()}:{os.getpid()}", started, seconds, delay),
+        )
+        db.execute(
+            "DELETE FROM cycles WHERE id NOT IN (SELECT id FROM cycles ORDER BY id DESC LIMIT ?);",
+            (MAX_CYCLES,),
+        )
+
+
+def get_cycles(reader: Reader) -> list[dict[str, Any]]:
+    """Get the latest checks for new tweets of every process, newest first.
+
+    Returns:
+        When every check started, how many seconds it took and the delay in minutes at the time.
+    """
+    rows = get_db(reader).execute("SELECT process, started, seconds, delay FROM cycles ORDER BY id DESC;")
+    return [
+        {
+            "process": process,
+            "started": datetime.fromtimestamp(started, tz=timezone.utc).isoformat(),
+            "seconds": round(seconds, 3),
+            "delay": delay,
+            "too_slow": seconds > delay * 60,
+        }
+        for process, started, seconds, delay in rows
+    ]
+
+
+def run_cycle(reader: Reader, feed_filter: Callable[[str], bool] | None = None) -> float | None:
+    """Check for new tweets and put them in the outbox, unless a check is already running.
+
+    Args:
+        reader: The reader which contains the entries.
+        feed_filter: Only look at the feeds this returns True for, see send_to_discord().
+
+    Returns:
+        How many seconds the check took, or None if it was skipped.
+    """
+    if not _cycle_lock.acquire(blocking=False):
+        logger.warning("Not checking for new tweets as the previous check is still running")
+        CYCLES_SKIPPED.inc()
+        return None
+
+    delay: int = get_delay(get_app_settings(reader))
+    started: float = time.time()
+    try:
+        profile_cycle(reader, send_to_discord, reader, feed_filter=feed_filter)
+    finally:
+        seconds: float = time.time() - started
+        _cycle_lock.release()
+
+        CYCLE_SECONDS.observe(seconds)
+        try:
+            save_cycle(reader, started, seconds, delay)
+        except sqlite3.Error:
+            logger.exception("Failed to save how long checking for new tweets took")
+        if seconds > delay * 60:
+            logger.warning(
+                "Checking for new tweets took {:.0f} seconds, longer than the delay of {} minutes. Increase the delay"
+                " or use more worker processes.",
+                seconds,
+                delay,
+            )
+        else:
+            logger.info("Checked for new tweets in {:.1f} seconds", seconds)
+
+    return seconds
+
+
+def get_trigger(delay: int) -> IntervalTrigger:
+    """Get the trigger that checks for new tweets every delay minutes."""
+    return IntervalTrigger(minutes=delay, jitter=get_jitter(delay))
+
+
+@lru_cache(maxsize=1)
+def get_check_scheduler() -> BackgroundScheduler:
+    """Get the scheduler that checks for new tweets in the web server's process.
+
+    A check that is still running when the next one is due makes the next one wait until the one after it, and
+    checks that were missed, e.g. because the computer was asleep, are done once instead of once per missed check.
+    """
+    return BackgroundScheduler(job_defaults={"max_instances": 1, "coalesce": True, "misfire_grace_time": None})
+
+
+def start_checking(reader: Reader, func: Callable[[], Any]) -> Job:
+    """Check for new tweets right away and then every delay minutes.
+
+    Args:
+        reader: The reader the settings are in.
+        func: The function that checks for new tweets.
+
+    Returns:
+        The job.
+    """
+    delay: int = get_delay(get_app_settings(reader))
+    logger.info("I will check for new tweets every {} minutes", delay)
+
+    scheduler: BackgroundScheduler = get_check_scheduler()
+    job: Job = scheduler.add_job(
+        func,
+        get_trigger(delay),
+        id=CHECK_JOB_ID,
+        replace_existing=True,
+        next_run_time=datetime.now(tz=timezone.utc),
+    )
+    if not scheduler.running:
+        scheduler.start()
+    return job
+
+
+@on_app_settings_change
+def reschedule(app_settings: ApplicationSettings) -> None:
+    """Use the new delay right away instead of after a restart."""
+    scheduler: BackgroundScheduler = get_check_scheduler()
+    job: Job | None = scheduler.get_job(CHECK_JOB_ID) if scheduler.running else None
+    if job is None:
+        return
+
+    delay: int = get_delay(app_settings)
+    if job.trigger.interval.total_seconds() == delay * 60:
+        return
+
+    scheduler.reschedule_job(CHECK_JOB_ID, trigger=get_trigger(delay))
+    logger.info("I will check for new tweets every {} minutes from now on", delay)
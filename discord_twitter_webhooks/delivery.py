@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from discord_twitter_webhooks.metrics import Histogram
+from discord_twitter_webhooks.rate_limit import RateLimiter
+
+# How many webhooks we post to at the same time, no matter what the settings say.
+MAX_CONCURRENCY: int = 32
+
+# How many times we retry a webhook that got rate limited.
+MAX_RATE_LIMIT_RETRIES: int = 3
+
+WEBHOOK_POST_SECONDS = Histogram(
+    "dtw_webhook_post_seconds",
+    "Time spent posting a message to a webhook, by the status code Discord responded with.",
+    labelnames=("status",),
+)
+
+
+@dataclass
+class WebhookResult:
+    """What happened when we sent a message to one webhook."""
+
+    url: str
+    status_code: int | None = None
+    text: str = ""
+    error: str = ""
+    # With lowercase names, as Discord's names don't always have the same case
+    headers: dict[str, str] = field(default_factory=dict, repr=False)
+
+    @property
+    def ok(self: "WebhookResult") -> bool:
+        """True if Discord accepted the message."""
+        return self.status_code is not None and 200 <= self.status_code < 300  # noqa: PLR2004
+
+
+@lru_cache(maxsize=1)
+def get_session() -> requests.Session:
+    """Get the session we use for every webhook.
+
+    The session keeps connections to Discord alive, so we don't have to do a new TLS handshake for every message.
+
+    Returns:
+        The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENCY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def post_webhook(url: str, payload: dict[str, Any], files: dict[str, Any], timeout: float = 10) -> WebhookResult:
+    """Post a message to a webhook.
+
+    Args:
+        url: The webhook URL.
+        payload: The JSON payload of the message.
+        files: Files to attach to the message.
+        timeout: How many seconds to wait for Discord.
+
+    Returns:
+        What Discord responded with.
+    """
+    session: requests.Session = get_session()
+    started: float = time.perf_counter()
+    try:
+        if files:
+            response = session.post(
+                url,
+                files={**files, "payload_json": (None, json.dumps(payload))},
+                timeout=timeout,
+            )
+        else:
+            response = session.post(url, json=payload, timeout=timeout)
+    except requests.RequestException as e:
+        WEBHOOK_POST_SECONDS.observe(time.perf_counter() - started, status="error")
+        return WebhookResult(url=url, error=str(e))
+
+    WEBHOOK_POST_SECONDS.observe(time.perf_counter() - started, status=response.status_code)
+
+    return WebhookResult(
+        url=url,
+        status_code=response.status_code,
+        text=response.text,
+        headers={name.lower(): value for name, value in response.headers.items()},
+    )
+
+
+@dataclass
+class _Job:
+    url: str
+    payload: dict[str, Any]
+    files: dict[str, Any]
+    future: Future[WebhookResult] = field(default_factory=Future)
+    attempts: int = 0
+
+
+class DeliveryScheduler:
+    """Send messages to webhooks without letting a rate limited webhook hold up the others.
+
+    Every webhook has its own queue. Messages to the same webhook are sent one at a time and in the order they were
+    submitted, while different webhooks are sent to in parallel. When a webhook's rate limit bucket is used up, only
+    the webhooks in that bucket wait, and a 429 puts the message back at the front of its queue.
+    """
+
+    def __init__(self: "DeliveryScheduler", concurrency: int = 8, rate_limiter: RateLimiter | None = None) -> None:
+        self.rate_limiter: RateLimiter = rate_limiter or RateLimiter()
+        self.concurrency: int = concurrency
+
+        self._queues: dict[str, deque[_Job]] = {}
+        self._in_flight: set[str] = set()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="webhook")
+        self._thread: threading.Thread | None = None
+
+    @property
+    def concurrency(self: "DeliveryScheduler") -> int:
+        """How many webhooks we post to at the same time."""
+        return self._concurrency
+
+    @concurrency.setter
+    def concurrency(self: "DeliveryScheduler", value: int) -> None:
+        self._concurrency = max(1, min(value, MAX_CONCURRENCY))
+
+    def submit(self: "DeliveryScheduler", url: str, payload: dict[str, Any], files: dict[str, Any]) -> Future:
+        """Queue a message for a webhook.
+
+        Args:
+            url: The webhook URL.
+            payload: The JSON payload of the message.
+            files: Files to attach to the message.
+
+        Returns:
+            A future that will get the WebhookResult when the message has been sent.
+        """
+        job = _Job(url=url, payload=payload, files=files)
+        with self._condition:
+            self._queues.setdefault(url, deque()).append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="webhook-scheduler", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+        return job.future
+
+    def join(self: "DeliveryScheduler", timeout: float | None = None) -> bool:
+        """Wait until every queued message has been sent.
+
+        Args:
+            timeout: How many seconds to wait at most. None waits forever.
+
+        Returns:
+            True if every message was sent, False if we timed out.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queues and not self._in_flight, timeout)
+
+    def _run(self: "DeliveryScheduler") -> None:
+        with self._condition:
+            while True:
+                self._condition.wait(timeout=self._dispatch())
+
+    def _dispatch(self: "DeliveryScheduler") -> float | None:
+        """Start sending every message that is ready.
+
+        Returns:
+            Seconds until a rate limited webhook can be sent to again, or None if no webhook is waiting on Discord.
+        """
+        next_ready: float | None = None
+        for url in list(self._queues):
+            if len(self._in_flight) >= self.concurrency:
+                break
+
+            if url in self._in_flight:
+                continue
+
+            wait: float = self.rate_limiter.acquire(url)
+            if wait > 0:
+                next_ready = wait if next_ready is None else min(next_ready, wait)
+                continue
+
+            # Move the webhook to the back of the line so every webhook gets its turn
+            queue: deque[_Job] = self._queues.pop(url)
+            job: _Job = queue.popleft()
+            if queue:
+                self._queues[url] = queue
+
+            self._in_flight.add(url)
+            self._executor.submit(self._send, job)
+
+        return next_ready
+
+    def _send(self: "DeliveryScheduler", job: _Job) -> None:
+        try:
+            result: WebhookResult = post_webhook(job.url, job.payload, job.files)
+            self.rate_limiter.update(job.url, result.status_code, result.headers)
+        except Exception as e:  # noqa: BLE001
+            logger.exception("Failed to send webhook")
+            result = WebhookResult(url=job.url, error=str(e))
+
+        with self._condition:
+            self._in_flight.discard(job.url)
+            if result.status_code == 429 and job.attempts < MAX_RATE_LIMIT_RETRIES:  # noqa: PLR2004
+                job.attempts += 1
+                self._queues.setdefault(job.url, deque()).appendleft(job)
+            else:
+                job.future.set_result(result)
+            self._condition.notify_all()
+
+
+@lru_cache(maxsize=1)
+def get_scheduler() -> DeliveryScheduler:
+    """Get the scheduler every message to Discord goes through."""
+    return DeliveryScheduler()
+
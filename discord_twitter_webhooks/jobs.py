@@ -0,0 +1,164 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any
+from uuid import uuid4
+
+from loguru import logger
+from reader import InvalidFeedURLError, Reader, StorageError
+
+from discord_twitter_webhooks.polling import update_feed
+from discord_twitter_webhooks.storage import set_feed_read
+from discord_twitter_webhooks.watermark import get_watermark, set_watermark
+
+# How many feeds we fetch at the same time when a group is added
+ADD_FEEDS_WORKERS: int = 8
+
+# How many finished jobs we remember
+MAX_FINISHED_JOBS: int = 50
+
+
+@dataclass
+class AddFeedsJob:
+    """Adding the feeds of a group in the background."""
+
+    group_uuid: str
+    feed_urls: list[str]
+    id: str = field(default_factory=lambda: str(uuid4()))
+
+    # How many feeds have been added and fetched
+    done: int = 0
+
+    # Feeds that couldn't be added
+    failed: list[str] = field(default_factory=list)
+
+    started: datetime = field(default_factory=lambda: datetime.now(tz=timezone.utc))
+    finished: datetime | None = None
+
+    future: Future | None = field(default=None, repr=False)
+
+    def to_dict(self: "AddFeedsJob") -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "group_uuid": self.group_uuid,
+            "total": len(self.feed_urls),
+            "done": self.done,
+            "failed": self.failed,
+            "started": self.started.isoformat(),
+            "finished": self.finished.isoformat() if self.finished else None,
+        }
+
+
+# Every job we know about, oldest first
+_jobs: dict[str, AddFeedsJob] = {}
+_jobs_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def get_job_executor() -> ThreadPoolExecutor:
+    """Get the thread the jobs run in. Jobs run one at a time so two groups don't add the same feed at once."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="job")
+
+
+def get_job(job_id: str) -> AddFeedsJob | None:
+    """Get a job by its id."""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def get_jobs() -> list[AddFeedsJob]:
+    """Get every job we remember, oldest first."""
+    with _jobs_lock:
+        return list(_jobs.values())
+
+
+def add_feed(reader: Reader, feed_url: str) -> bool:
+    """Add a feed to the reader.
+
+    Returns:
+        True if the feed was added.
+    """
+    try:
+        reader.add_feed(feed_url, exist_ok=True)
+    except InvalidFeedURLError:
+        logger.error(f"Invalid URL {feed_url}")
+        return False
+    except StorageError:
+        logger.error(f"Got StorageError when adding {feed_url}")
+        return False
+
+    return True
+
+
+def fetch_feed(reader: Reader, job: AddFeedsJob, feed_url: str) -> None:
+    """Get the tweets we already have for a new feed, so only newer tweets are sent."""
+    update_feed(reader, feed_url)
+
+    # Mark every entry as read
+    marked: int = set_feed_read(reader, feed_url, read=True)
+    logger.debug(f"Marked {marked} entries in {feed_url} as read")
+
+    # Tweets older than the ones we have now will not be sent, see watermark.py
+    if get_watermark(reader, feed_url) is None:
+        set_watermark(reader, feed_url, reader.get_entries(feed=feed_url))
+
+    with _jobs_lock:
+        job.done += 1
+
+
+def run_add_feeds_job(reader: Reader, job: AddFeedsJob) -> None:
+    """Add and fetch every feed of the job, ADD_FEEDS_WORKERS feeds at a time."""
+    try:
+        added: list[str] = []
+        for feed_url in job.feed_urls:
+            if add_feed(reader, feed_url):
+                added.append(feed_url)
+            else:
+                with _jobs_lock:
+                    job.failed.append(feed_url)
+                    job.done += 1
+
+        with ThreadPoolExecutor(max_workers=ADD_FEEDS_WORKERS, thread_name_prefix="add_feed") as executor:
+            list(executor.map(lambda feed_url: fetch_feed(reader, job, feed_url), added))
+    except Exception:  # noqa: BLE001
+        logger.exception(f"Failed to add the feeds for group {job.group_uuid}")
+    finally:
+        job.finished = datetime.now(tz=timezone.utc)
+        logger.info(f"Added {job.done - len(job.failed)} of {len(job.feed_urls)} feeds for group {job.group_uuid}")
+
+
+def start_add_feeds_job(reader: Reader, group_uuid: str, feed_urls: list[str]) -> AddFeedsJob:
+    """Add the feeds of a group in the background.
+
+    Args:
+        reader: The reader to add the feeds to.
+        group_uuid: The group the feeds belong to.
+        feed_urls: The feeds to add.
+
+    Returns:
+        The job. Use get_job() with its id to see how far it has come.
+    """
+    job = AddFeedsJob(group_uuid=group_uuid, feed_urls=feed_urls)
+    with _jobs_lock:
+        _jobs[job.id] = job
+
+        # Forget the oldest finished jobs
+        finished: list[str] = [job_id for job_id, old_job in _jobs.items() if old_job.finished]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del _jobs[job_id]
+
+    job.future = get_job_executor().submit(run_add_feeds_job, reader, job)
+    return job
+
+
+def wait_for_group_jobs(group_uuid: str, timeout: float | None = None) -> None:
+    """Wait until the feeds of a group have been added, so we don't remove a group while it is being added.
+
+    Args:
+        group_uuid: The group.
+        timeout: How many seconds to wait at most. None waits forever.
+    """
+    futures: list[Future] = [job.future for job in get_jobs() if job.group_uuid == group_uuid and job.future]
+    wait(futures, timeout=timeout)
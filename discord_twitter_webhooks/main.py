@@ -1,18 +1,18 @@
 import functools
+import hashlib
 import sys
-from datetime import datetime, timezone
+from multiprocessing.process import BaseProcess
 from pathlib import Path
-from typing import TYPE_CHECKING, Annotated, Literal
+from typing import TYPE_CHECKING, Annotated, Any, Literal
 from uuid import uuid4
 
 import uvicorn
-from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi import FastAPI, Form, Request, Response
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from loguru import logger
-from reader import InvalidFeedURLError, Reader, StorageError
+from reader import FeedNotFoundError, Reader
 from starlette import status
 
 from discord_twitter_webhooks._dataclasses import (
@@ -20,22 +20,36 @@ from discord_twitter_webhooks._dataclasses import (
     Group,
     get_app_settings,
     get_group,
+    get_groups,
+    on_app_settings_change,
     set_app_settings,
 )
-from discord_twitter_webhooks.reader_settings import get_reader
-from discord_twitter_webhooks.send_to_discord import (
-    blacklisted,
-    has_media,
-    send_embed,
-    send_link,
-    send_text,
-    send_to_discord,
-    whitelisted,
+from discord_twitter_webhooks.blocking import run_blocking
+from discord_twitter_webhooks.cycles import get_cycles, run_cycle, start_checking
+from discord_twitter_webhooks.delivery import get_scheduler
+from discord_twitter_webhooks.jobs import AddFeedsJob, get_job, get_jobs, start_add_feeds_job, wait_for_group_jobs
+from discord_twitter_webhooks.metrics import render_metrics
+from discord_twitter_webhooks.nitter import get_instance_pool
+from discord_twitter_webhooks.outbox import get_outbox_state, get_outbox_worker
+from discord_twitter_webhooks.profiling import (
+    MAX_PROFILES,
+    Profile,
+    ProfileMode,
+    get_profile,
+    get_profile_request,
+    get_profile_stats,
+    get_profiles,
+    request_profiles,
 )
+from discord_twitter_webhooks.reader_settings import get_reader
+from discord_twitter_webhooks.send_to_discord import get_skip_reason, send_embed, send_link, send_text
+from discord_twitter_webhooks.storage import remove_group_feeds, set_entries_read, set_group_feeds
 from discord_twitter_webhooks.translate import languages_from, languages_to
+from discord_twitter_webhooks.tweet_text import clear_render_cache
+from discord_twitter_webhooks.workers import get_worker_metrics, get_worker_state, start_workers
 
 if TYPE_CHECKING:
-    from reader.types import Entry, EntryLike, FeedLike
+    from reader.types import Entry, EntryLike
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory=Path(__file__).parent / "static"), name="static")
@@ -43,29 +57,154 @@ templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
 
 reader: Reader = get_reader()
 
-# TODO: Add /debug page to show all the database fields
+# The processes that check for new tweets if the settings say so, see startup()
+worker_processes: list[BaseProcess] = []
+
+# TODO: Show all the database fields on the /debug page
 # TODO: Add backup/restore functionality
 
 
+# The rendered index page and its ETag by base URL, see index(). Cleared when a group or the settings change.
+_index_pages: dict[str, tuple[str, str]] = {}
+
+
+@on_app_settings_change
+def clear_index_pages(*args: object) -> None:  # noqa: ARG001
+    """Render the index page again the next time it is requested."""
+    _index_pages.clear()
+
+
+def save_group(group: Group) -> None:
+    """Save a new or changed group and start adding its feeds.
+
+    Args:
+        group: The group to save.
+    """
+    # Add the group to the reader
+    reader.set_tag((), group.uuid, group.__dict__)
+    set_group_feeds(reader, group.uuid, group.rss_feeds)
+
+    # Adding and fetching the feeds can take minutes for big groups, so it is done in the background.
+    # The progress can be seen at /jobs/{job.id}
+    job: AddFeedsJob = start_add_feeds_job(reader, group.uuid, group.rss_feeds)
+    logger.info(f"Adding {len(group.rss_feeds)} feeds for group {group.uuid} in job {job.id}")
+
+    # Add the group to the groups list
+    groups = reader.get_tag((), "groups", [])
+    groups.append(group.uuid)
+    reader.set_tag((), "groups", list(set(groups)))
+    logger.info(f"Added group {group.uuid} to groups list")
+    logger.info(f"Group list is now {set(groups)}")
+    clear_index_pages()
+
+
+def remove_group(uuid: str) -> None:
+    """Remove a group and the feeds no other group uses.
+
+    Args:
+        uuid: The uuid of the group.
+    """
+    group: Group = get_group(reader, uuid)
+    logger.info(f"Removing group {group}")
+
+    # Let the feeds finish being added first, so they don't end up in a group that doesn't exist
+    wait_for_group_jobs(uuid)
+
+    reader.delete_tag((), uuid)
+
+    groups = reader.get_tag((), "groups", [])
+    groups.remove(uuid)
+    reader.set_tag((), "groups", groups)
+    clear_index_pages()
+
+    # Remove the feeds that are no longer used by any groups
+    for feed_url in remove_group_feeds(reader, uuid):
+        try:
+            reader.delete_feed(feed_url)
+        except FeedNotFoundError:
+            continue
+        logger.info(f"Removed feed {feed_url} due to no groups using it")
+
+
+def resend_group(uuid: str) -> str | None:
+    """Update the first feed of a group and send its tweets again.
+
+    Args:
+        uuid: The uuid of the group.
+
+    Returns:
+        Why the tweets couldn't be sent, or None if they were sent.
+    """
+    # Get the group
+    group: Group = get_group(reader, uuid)
+
+    if not group.rss_feeds:
+        return f"No RSS feeds found for group {uuid}"
+
+    # Get the feed
+    _feed = reader.get_feed(group.rss_feeds[0], None)
+    logger.info(f"Feed is {_feed}")
+
+    # Update the feed
+    reader.update_feeds(feed=_feed, workers=4)
+
+    # Get the entries
+    entries = reader.get_entries(feed=_feed)
+    entries = list(entries)
+
+    if not entries:
+        return f"Failed to mark feed {uuid} as unread. No entries found."
+
+    # Mark the entries as unread
+    set_entries_read(reader, entries, read=False)
+
+    # Render the tweets again, what we rendered before could be from a translation that failed
+    clear_render_cache(_feed.url)
+
+    entry: EntryLike | Entry
+    for entry in entries:
+        if skip_reason := get_skip_reason(group, entry):
+            logger.info(f"Skipping entry {entry} as {skip_reason}")
+            continue
+
+        if group.send_as_link:
+            send_link(entry=entry, group=group)
+        if group.send_as_text:
+            send_text(entry=entry, group=group)
+        if group.send_as_embed:
+            send_embed(entry=entry, group=group)
+
+    # Mark the entries as read
+    set_entries_read(reader, entries, read=True)
+
+    return None
+
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request) -> Response:
     """Return the index page.
 
+    The page is only rendered again after a group or the settings have changed. Browsers that already have the
+    page get a 304 Not Modified.
+
     Returns:
         The index page.
     """
-    groups = reader.get_tag((), "groups", [])
-    list_of_groups = [get_group(reader, group) for group in groups]
-    list_of_groups = [group for group in list_of_groups if group]  # Remove None values
-
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "groups": list_of_groups,
-            "app_settings": get_app_settings(reader),
-        },
-    )
+    base_url: str = str(request.base_url)
+    if base_url not in _index_pages:
+        html: str = templates.get_template("index.html").render(
+            {
+                "request": request,
+                "groups": await run_blocking(get_groups, reader),
+                "app_settings": await run_blocking(get_app_settings, reader),
+            },
+        )
+        _index_pages[base_url] = (html, f'"{hashlib.sha256(html.encode()).hexdigest()[:32]}"')
+
+    html, etag = _index_pages[base_url]
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return HTMLResponse(html, headers={"ETag": etag})
 
 
 @app.get("/add", response_class=HTMLResponse)
@@ -84,7 +223,7 @@ async def add(request: Request) -> Response:
             "group_name": None,
             "languages_from": languages_from,
             "languages_to": languages_to,
-            "global_settings": get_app_settings(reader),
+            "global_settings": await run_blocking(get_app_settings, reader),
         },
     )
 
@@ -97,7 +236,7 @@ async def modify(request: Request, uuid: str) -> Response:
         The add page.
     """
     # Get the old settings
-    group: Group = get_group(reader, uuid)
+    group: Group = await run_blocking(get_group, reader, uuid)
 
     return templates.TemplateResponse(
         "feed.html",
@@ -107,7 +246,7 @@ async def modify(request: Request, uuid: str) -> Response:
             "modifying": True,
             "languages_from": languages_from,
             "languages_to": languages_to,
-            "global_settings": get_app_settings(reader),
+            "global_settings": await run_blocking(get_app_settings, reader),
         },
     )
 
@@ -124,6 +263,7 @@ async def feed(  # noqa: PLR0913, ANN201
     send_as_text: Annotated[bool, Form(title="Send Text?")] = False,
     send_as_text_username: Annotated[bool, Form(title="Append username before text?")] = False,
     send_as_embed: Annotated[bool, Form(title="Send Embed?")] = False,
+    batch_embeds: Annotated[bool, Form(title="Combine embeds?")] = False,
     send_as_link: Annotated[bool, Form(title="Send Only Link?")] = False,
     unescape_html: Annotated[bool, Form(title="Unescape HTML?")] = False,
     remove_copyright: Annotated[bool, Form(title="Remove Copyright?")] = False,
@@ -150,7 +290,8 @@ async def feed(  # noqa: PLR0913, ANN201
 
     # Get the RSS feeds for each username
     # TODO: Check if the RSS feed is valid
-    rss_feeds = [f"{get_app_settings(reader).nitter_instance}/{_feed}/rss" for _feed in usernames_split]
+    app_settings: ApplicationSettings = await run_blocking(get_app_settings, reader)
+    rss_feeds = [f"{app_settings.nitter_instance}/{_feed}/rss" for _feed in usernames_split]
 
     group = Group(
         uuid=uuid,
@@ -164,6 +305,7 @@ async def feed(  # noqa: PLR0913, ANN201
         send_as_text=send_as_text,
         send_as_text_username=send_as_text_username,
         send_as_embed=send_as_embed,
+        batch_embeds=batch_embeds,
         send_as_link=send_as_link,
         unescape_html=unescape_html,
         remove_copyright=remove_copyright,
@@ -181,47 +323,7 @@ async def feed(  # noqa: PLR0913, ANN201
         replace_youtube=replace_youtube,
     )
 
-    # This will be used when adding group.rss_feeds
-    rss_feeds = []
-
-    # Add the group to the reader
-    reader.set_tag((), uuid, group.__dict__)
-    for _name in usernames_split:
-        name_url = f"{get_app_settings(reader).nitter_instance}/{_name}/rss"  # TODO: Check if URL is valid
-        # Add the rss feed to the reader
-        try:
-            reader.add_feed(name_url, exist_ok=True)
-        except InvalidFeedURLError:
-            logger.error(f"Invalid URL {name_url}")
-            continue
-        except StorageError:
-            logger.error(f"Got StorageError when adding {name_url}")
-            continue
-
-        # Update the feed
-        reader.update_feeds(feed=name_url, workers=4)
-
-        # Mark every entry as read
-        _entry: Entry | EntryLike
-        for _entry in reader.get_entries(feed=name_url):
-            logger.debug(f"Marking entry {_entry} as read")
-            reader.mark_entry_as_read(_entry)
-
-        # Add what groups the feed is connected to
-        our_feed = reader.get_feed(name_url)
-        groups = reader.get_tag(our_feed, "groups", [])  # type: ignore  # noqa: PGH003
-        groups.append(uuid)
-        reader.set_tag(our_feed, "groups", list(set(groups)))  # type: ignore  # noqa: PGH003
-        logger.info(f"Added group {group.uuid} to feed {name_url}")
-
-        rss_feeds.append(name_url)
-
-    # Add the group to the groups list
-    groups = reader.get_tag((), "groups", [])
-    groups.append(uuid)
-    reader.set_tag((), "groups", list(set(groups)))
-    logger.info(f"Added group {group.uuid} to groups list")
-    logger.info(f"Group list is now {set(groups)}")
+    await run_blocking(save_group, group)
 
     # Redirect to the index page.
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
@@ -234,35 +336,15 @@ async def remove_group_post(uuid: Annotated[str, Form()]) -> RedirectResponse:
     Returns:
         str: The index page.
     """
-    group: Group = get_group(reader, uuid)
-    logger.info(f"Removing group {group}")
-
-    reader.delete_tag((), uuid)
-
-    groups = reader.get_tag((), "groups", [])
-    groups.remove(uuid)
-    reader.set_tag((), "groups", groups)
-
-    # Remove the group tag from every RSS feed that has it
-    _feed: FeedLike
-    for _feed in reader.get_feeds():
-        if uuid in reader.get_tag(_feed, "groups", []):
-            groups = reader.get_tag(_feed, "groups", [])
-            groups.remove(uuid)
-            reader.set_tag(_feed, "groups", groups)
-
-    # Remove the feed if it is no longer used by any groups
-    for _feed in reader.get_feeds():
-        if not reader.get_tag(_feed, "groups", []):
-            reader.delete_feed(_feed)
-            logger.info(f"Removed feed {_feed} due to no groups using it")
+    # Waiting for the feeds of the group to be added can take a while
+    await run_blocking(remove_group, uuid, slow=True)
 
     # Redirect to the index page.
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
 
 @app.get("/mark_as_unread/{uuid}")
-async def mark_as_unread(uuid: str):  # noqa: ANN201, C901
+async def mark_as_unread(uuid: str):  # noqa: ANN201
     """Mark a feed as unread.
 
     Args:
@@ -273,84 +355,190 @@ async def mark_as_unread(uuid: str):  # noqa: ANN201, C901
     """
     logger.info(f"Marking feed {uuid} as unread")
 
-    # Get the group
-    group: Group = get_group(reader, uuid)
+    # Updating the feed and sending the tweets can take minutes
+    error: str | None = await run_blocking(resend_group, uuid, slow=True)
+    if error:
+        # TODO: Return a proper error page
+        return HTMLResponse(error)
 
-    if not group.rss_feeds:
-        return HTMLResponse(f"No RSS feeds found for group {uuid}")
+    # Redirect to the index page.
+    return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
-    # Get the feed
-    _feed = reader.get_feed(group.rss_feeds[0], None)
-    logger.info(f"Feed is {_feed}")
 
-    # Update the feed
-    reader.update_feeds(feed=_feed, workers=4)
+@app.get("/settings")
+async def settings(request: Request) -> Response:
+    """Get the settings page.
 
-    # Get the entries
-    entries = reader.get_entries(feed=_feed)
-    entries = list(entries)
+    Args:
+        request: The request object.
 
-    if not entries:
-        # TODO: Return a proper error page
-        return HTMLResponse(f"Failed to mark feed {uuid} as unread. No entries found.")
+    Returns:
+        Response: The settings page.
+    """
+    application_settings: ApplicationSettings = await run_blocking(get_app_settings, reader)
+    return templates.TemplateResponse("settings.html", {"request": request, "settings": application_settings})
 
-    # Mark the entry as unread
-    entry: EntryLike | Entry
-    for entry in entries:
-        reader.mark_entry_as_unread(entry)
 
-    for entry in entries:
-        if group.whitelist_enabled and not whitelisted(group, entry):
-            logger.info(f"Skipping entry {entry} as it is not whitelisted")
-            reader.mark_entry_as_read(entry)
-            continue
+@app.get("/rate_limits")
+async def rate_limits() -> dict[str, Any]:
+    """Get Discord's rate limit buckets for the webhooks we send to.
 
-        if group.blacklist_enabled and blacklisted(group, entry):
-            logger.info(f"Skipping entry {entry} as it is blacklisted")
-            reader.mark_entry_as_read(entry)
-            continue
+    Returns:
+        The global rate limit and the state of every bucket.
+    """
+    return get_scheduler().rate_limiter.get_state()
 
-        if not group.send_retweets and entry.title.startswith("RT by "):
-            logger.info(f"Skipping entry {entry} as it is a retweet")
-            reader.mark_entry_as_read(entry)
-            continue
 
-        if not group.send_replies and entry.title.startswith("R to "):
-            logger.info(f"Skipping entry {entry} as it is a reply")
-            reader.mark_entry_as_read(entry)
-            continue
+@app.get("/jobs")
+async def jobs() -> list[dict[str, Any]]:
+    """Get the groups that are being added or were added recently.
 
-        if group.only_send_if_media and not has_media(entry):
-            logger.info(f"Skipping entry {entry} as it has no media attached")
-            reader.mark_entry_as_read(entry)
-            continue
+    Returns:
+        How many of the feeds of every group have been added.
+    """
+    return [job.to_dict() for job in get_jobs()]
 
-        if group.send_as_link:
-            send_link(entry=entry, group=group)
-        if group.send_as_text:
-            send_text(entry=entry, group=group)
-        if group.send_as_embed:
-            send_embed(entry=entry, group=group)
 
-        # Mark the entry as read
-        reader.mark_entry_as_read(entry)
+@app.get("/jobs/{job_id}")
+async def job_progress(job_id: str) -> Response:
+    """Get how far adding the feeds of a group has come.
 
-    # Redirect to the index page.
-    return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
+    Args:
+        job_id: The id of the job.
 
+    Returns:
+        The progress of the job, or 404 if we don't know about it.
+    """
+    job: AddFeedsJob | None = get_job(job_id)
+    if job is None:
+        return JSONResponse({"detail": f"Job {job_id} not found"}, status_code=status.HTTP_404_NOT_FOUND)
+    return JSONResponse(job.to_dict())
 
-@app.get("/settings")
-async def settings(request: Request) -> Response:
-    """Get the settings page.
+
+@app.get("/nitter_instances")
+async def nitter_instances() -> list[dict[str, Any]]:
+    """Get how the Nitter instances we update the feeds from are doing.
+
+    Returns:
+        The error rate, latency and score of every instance.
+    """
+    return get_instance_pool().get_state()
+
+
+@app.get("/workers")
+async def workers() -> list[dict[str, Any]]:
+    """Get the worker processes that check for new tweets.
+
+    Returns:
+        The id, seconds since the last heartbeat and leases of every worker.
+    """
+    return await run_blocking(get_worker_state, reader)
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Get the metrics in the Prometheus text format, see metrics.py.
+
+    The metrics of the worker processes are shown with a worker label, see workers.py.
+
+    Returns:
+        The metrics.
+    """
+    worker_metrics: dict[str, dict[str, Any]] = await run_blocking(get_worker_metrics, reader)
+    return PlainTextResponse(render_metrics(worker_metrics.items()), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cycles")
+async def cycles() -> list[dict[str, Any]]:
+    """Get how long the latest checks for new tweets took, to see if the delay is too short for the feeds.
+
+    Returns:
+        When every check started, how many seconds it took and the delay in minutes at the time.
+    """
+    return await run_blocking(get_cycles, reader)
+
+
+@app.get("/outbox")
+async def outbox() -> dict[str, Any]:
+    """Get how many messages are waiting to be sent to Discord.
+
+    Returns:
+        How many messages are waiting, how many we gave up on and how old the oldest message is in seconds.
+    """
+    return await run_blocking(get_outbox_state, reader)
+
+
+@app.get("/debug")
+async def debug(request: Request) -> Response:
+    """Get the debug page, where the checks for new tweets can be profiled.
 
     Args:
         request: The request object.
 
     Returns:
-        Response: The settings page.
+        The debug page with the saved profiles.
     """
-    application_settings: ApplicationSettings = get_app_settings(reader)
-    return templates.TemplateResponse("settings.html", {"request": request, "settings": application_settings})
+    profiles: list[Profile] = await run_blocking(get_profiles, reader)
+    request_state: tuple[ProfileMode, int] | None = await run_blocking(get_profile_request, reader)
+    return templates.TemplateResponse(
+        "debug.html",
+        {"request": request, "profiles": profiles, "request_state": request_state, "max_profiles": MAX_PROFILES},
+    )
+
+
+@app.post("/debug/profile")
+async def debug_profile_post(
+    mode: Annotated[ProfileMode, Form(title="Profiler")] = "sampling",
+    cycles: Annotated[int, Form(title="Checks to profile")] = 1,
+) -> Response:
+    """Profile the next checks for new tweets, see profiling.py.
+
+    Args:
+        mode: "sampling" or "cprofile".
+        cycles: How many checks to profile.
+
+    Returns:
+        Redirect to the debug page.
+    """
+    await run_blocking(request_profiles, reader, mode, min(cycles, MAX_PROFILES))
+    return RedirectResponse(url="/debug", status_code=status.HTTP_303_SEE_OTHER)
+
+
+@app.get("/debug/profiles/{profile_id}.prof")
+async def debug_profile_stats(profile_id: int) -> Response:
+    """Download a whole cProfile profile, to open it with pstats or snakeviz.
+
+    Args:
+        profile_id: The id of the profile.
+
+    Returns:
+        The profile in the pstats format, or 404 if it doesn't exist or is a sampling profile.
+    """
+    stats: bytes | None = await run_blocking(get_profile_stats, reader, profile_id)
+    if stats is None:
+        return JSONResponse({"detail": f"Profile {profile_id} not found"}, status_code=status.HTTP_404_NOT_FOUND)
+    return Response(
+        stats,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.prof"'},
+    )
+
+
+@app.get("/debug/profiles/{profile_id}")
+async def debug_profile(request: Request, profile_id: int) -> Response:
+    """Get the functions and packages a check for new tweets spent its time in.
+
+    Args:
+        request: The request object.
+        profile_id: The id of the profile.
+
+    Returns:
+        The profile, or 404 if it doesn't exist.
+    """
+    profile: Profile | None = await run_blocking(get_profile, reader, profile_id)
+    if profile is None:
+        return JSONResponse({"detail": f"Profile {profile_id} not found"}, status_code=status.HTTP_404_NOT_FOUND)
+    return templates.TemplateResponse("profile.html", {"request": request, "profile": profile})
 
 
 @functools.lru_cache(maxsize=1)
@@ -373,31 +561,40 @@ async def favicon():  # noqa: ANN201
 async def settings_post(  # noqa: PLR0913
     request: Request,
     nitter_instance: Annotated[str, Form(title="Nitter instance")] = "",
+    extra_nitter_instances: Annotated[str, Form(title="Extra Nitter instances")] = "",
     deepl_auth_key: Annotated[str, Form(title="DeepL auth key")] = "",
     piped_instance: Annotated[str, Form(title="Piped instance")] = "",
     teddit_instance: Annotated[str, Form(title="Teddit instance")] = "",
     delay: Annotated[int, Form(title="Delay between checking for new tweets")] = 15,
+    webhook_concurrency: Annotated[int, Form(title="Webhooks to send to at the same time")] = 8,
+    worker_processes: Annotated[int, Form(title="Processes that check for new tweets")] = 0,
 ) -> Response:
     """Save the settings.
 
     Args:
         request: The request object.
         nitter_instance: The Nitter instance to use.
+        extra_nitter_instances: More Nitter instances to use, separated by newlines.
         deepl_auth_key: The DeepL auth key to use.
         piped_instance: The Piped instance to use.
         teddit_instance: The Teddit instance to use.
         delay: The delay between checking for new tweets.
+        webhook_concurrency: How many webhooks to send to at the same time.
+        worker_processes: How many processes check for new tweets.
     """
     # TODO: Run reader.change_feed_url() on all feeds if the Nitter instance has changed.
     app_settings = ApplicationSettings(
         nitter_instance=nitter_instance,
+        extra_nitter_instances=extra_nitter_instances.splitlines(),
         deepl_auth_key=deepl_auth_key,
         piped_instance=piped_instance,
         teddit_instance=teddit_instance,
         delay=delay,
+        webhook_concurrency=webhook_concurrency,
+        worker_processes=worker_processes,
     )
 
-    set_app_settings(reader, app_settings)
+    await run_blocking(set_app_settings, reader, app_settings)
     return templates.TemplateResponse(
         "settings.html",
         {
@@ -425,21 +622,30 @@ def startup() -> None:
         catch=True,
     )
 
-    # Get the delay from the settings
-    delay = get_app_settings(reader).delay or 10
+    app_settings: ApplicationSettings = get_app_settings(reader)
+    if app_settings.worker_processes > 0:
+        # The workers check for new tweets and send them, see workers.py
+        get_outbox_worker(reader).active = False
+        worker_processes.extend(start_workers(app_settings.worker_processes))
+        return
 
-    logger.info("I will check for new tweets every {} minutes", delay)
+    # Check for new entries every x minutes. They will be sent to Discord if they are new.
+    # The delay is changed right away when the settings are saved, see cycles.py
+    start_checking(reader, sched_func)
 
-    scheduler: BackgroundScheduler = BackgroundScheduler()
 
-    # Check for new entries every x minutes. They will be sent to Discord if they are new.
-    scheduler.add_job(sched_func, "interval", minutes=delay, next_run_time=datetime.now(tz=timezone.utc))
-    scheduler.start()
+@app.on_event("shutdown")
+def shutdown() -> None:
+    """Stop the worker processes."""
+    for process in worker_processes:
+        process.terminate()
+    for process in worker_processes:
+        process.join(timeout=10)
 
 
 def sched_func() -> None:
     """The scheduler can't call a function with arguments, so we need to wrap it."""
-    send_to_discord(reader)
+    run_cycle(reader)
 
 
 def start() -> None:
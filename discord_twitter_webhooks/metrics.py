@@ -0,0 +1,209 @@
+import math
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# Seconds. Goes from a cached render to a slow Nitter instance or a long GIF conversion.
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Seconds from a tweet being posted to it being in Discord. Most tweets are found on the first check after they are
+# posted, so this depends on the delay in the settings.
+LAG_BUCKETS: tuple[float, ...] = (10, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 21600, 86400)
+
+# The label that tells the values of the worker processes apart, see render_metrics()
+WORKER_LABEL: str = "worker"
+
+# Every metric that has been created, by name
+_metrics: dict[str, "Metric"] = {}
+_metrics_lock = threading.Lock()
+
+
+def escape_label(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Iterable[tuple[str, str]]) -> str:
+    """Format labels as {name="value",...}, or an empty string if there are none."""
+    formatted: str = ",".join(f'{name}="{escape_label(value)}"' for name, value in labels)
+    return f"{{{formatted}}}" if formatted else ""
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """A metric that is shown at /metrics in the Prometheus text format.
+
+    https://prometheus.io/docs/instrumenting/exposition_formats/
+    """
+
+    type: str = ""
+
+    def __init__(self: "Metric", name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple[str, ...] = labelnames
+
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], Any] = {}
+
+        with _metrics_lock:
+            _metrics[name] = self
+
+    def _get_key(self: "Metric", labels: dict[str, object]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            msg: str = f"{self.name} needs the labels {self.labelnames}, got {tuple(labels)}"
+            raise ValueError(msg)
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get_snapshot(self: "Metric") -> list[tuple[tuple[str, ...], Any]]:
+        """Get a copy of the values that can be sent to another process as JSON."""
+        raise NotImplementedError
+
+    def load(self: "Metric", snapshot: list[tuple[tuple[str, ...], Any]]) -> dict[tuple[str, ...], Any]:
+        """Get the values from a snapshot of another process, see get_snapshot()."""
+        # Snapshots are sent between processes as JSON, so the tuples become lists
+        return {tuple(key): value for key, value in snapshot}
+
+    def render(
+        self: "Metric",
+        values: dict[tuple[str, ...], Any],
+        extra_labels: tuple[tuple[str, str], ...] = (),
+    ) -> list[str]:
+        """Get the lines for this metric in the Prometheus text format.
+
+        Args:
+            values: The values, by their labels.
+            extra_labels: Labels to add to every line, e.g. the worker the values are from.
+
+        Returns:
+            The lines.
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A number that only goes up, like how many tweets have been sent."""
+
+    type = "counter"
+
+    def inc(self: "Counter", amount: float = 1, **labels: object) -> None:
+        key: tuple[str, ...] = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get_snapshot(self: "Counter") -> list[tuple[tuple[str, ...], Any]]:
+        with self._lock:
+            return list(self._values.items())
+
+    def render(
+        self: "Counter",
+        values: dict[tuple[str, ...], Any],
+        extra_labels: tuple[tuple[str, str], ...] = (),
+    ) -> list[str]:
+        lines: list[str] = []
+        for key, value in sorted(values.items()):
+            labels: list[tuple[str, str]] = [*zip(self.labelnames, key, strict=True), *extra_labels]
+            lines.append(f"{self.name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    """How long something took, counted in buckets so the percentiles can be calculated."""
+
+    type = "histogram"
+
+    def __init__(
+        self: "Histogram",
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets: tuple[float, ...] = (*sorted(buckets), math.inf)
+
+    def observe(self: "Histogram", value: float, **labels: object) -> None:
+        key: tuple[str, ...] = self._get_key(labels)
+        with self._lock:
+            # [count per bucket..., sum]
+            counts: list[float] = self._values.setdefault(key, [0] * len(self.buckets) + [0.0])
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    @contextmanager
+    def time(self: "Histogram", **labels: object) -> Iterator[None]:
+        """Observe how many seconds the code in the with block takes."""
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_snapshot(self: "Histogram") -> list[tuple[tuple[str, ...], Any]]:
+        with self._lock:
+            return [(key, list(counts)) for key, counts in self._values.items()]
+
+    def load(self: "Histogram", snapshot: list[tuple[tuple[str, ...], Any]]) -> dict[tuple[str, ...], Any]:
+        # Processes that run an older version can have other buckets
+        return {tuple(key): counts for key, counts in snapshot if len(counts) == len(self.buckets) + 1}
+
+    def render(
+        self: "Histogram",
+        values: dict[tuple[str, ...], Any],
+        extra_labels: tuple[tuple[str, str], ...] = (),
+    ) -> list[str]:
+        lines: list[str] = []
+        for key, counts in sorted(values.items()):
+            labels: list[tuple[str, str]] = [*zip(self.labelnames, key, strict=True), *extra_labels]
+            cumulative: float = 0
+            for bucket, count in zip(self.buckets, counts, strict=False):
+                cumulative += count
+                bucket_labels: str = format_labels([*labels, ("le", format_value(bucket))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {format_value(cumulative)}")
+        return lines
+
+
+def get_snapshot() -> dict[str, list[tuple[tuple[str, ...], Any]]]:
+    """Get the values of every metric in this process, so they can be shown by another process."""
+    with _metrics_lock:
+        metrics: list[Metric] = list(_metrics.values())
+    return {metric.name: metric.get_snapshot() for metric in metrics}
+
+
+def render_metrics(
+    worker_snapshots: Iterable[tuple[str, dict[str, list[tuple[tuple[str, ...], Any]]]]] = (),
+) -> str:
+    """Get every metric in the Prometheus text format.
+
+    Args:
+        worker_snapshots: The id and snapshot of other processes, see get_snapshot(). Their values are shown with a
+            worker label instead of being added to ours, so they don't go down when a worker exits or restarts and
+            Prometheus doesn't mistake that for a counter reset.
+
+    Returns:
+        The metrics.
+    """
+    snapshots: list[tuple[str, dict[str, list[tuple[tuple[str, ...], Any]]]]] = list(worker_snapshots)
+    with _metrics_lock:
+        metrics: list[Metric] = sorted(_metrics.values(), key=lambda metric: metric.name)
+
+    lines: list[str] = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render(dict(metric.get_snapshot())))
+        for worker_id, snapshot in sorted(snapshots, key=lambda item: item[0]):
+            lines.extend(metric.render(metric.load(snapshot.get(metric.name, [])), ((WORKER_LABEL, worker_id),)))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,278 @@
+import io
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+import requests
+from loguru import logger
+from reader import Reader
+
+from discord_twitter_webhooks._dataclasses import ApplicationSettings, get_app_settings
+from discord_twitter_webhooks.avatar import remember_avatar
+
+# How many requests we remember for every instance
+STATS_WINDOW: int = 20
+
+# Instances that fail more often than this are only used if every instance does
+MAX_ERROR_RATE: float = 0.5
+
+# How long we wait before trying an unhealthy instance again, in seconds
+UNHEALTHY_COOLDOWN: float = 300
+
+
+@dataclass
+class InstanceStats:
+    """How an instance has been doing lately."""
+
+    url: str
+
+    # (seconds, ok) for the last STATS_WINDOW requests
+    requests: deque[tuple[float, bool]] = field(default_factory=lambda: deque(maxlen=STATS_WINDOW))
+
+    # Unix time of the last request
+    last_used: float = 0.0
+
+    @property
+    def error_rate(self: "InstanceStats") -> float:
+        if not self.requests:
+            return 0.0
+        return sum(not ok for _, ok in self.requests) / len(self.requests)
+
+    @property
+    def latency(self: "InstanceStats") -> float:
+        """The average response time of the successful requests in seconds."""
+        latencies: list[float] = [seconds for seconds, ok in self.requests if ok]
+        return sum(latencies) / len(latencies) if latencies else 1.0
+
+    @property
+    def healthy(self: "InstanceStats") -> bool:
+        return self.error_rate <= MAX_ERROR_RATE
+
+    @property
+    def score(self: "InstanceStats") -> float:
+        """Lower is better. Slow instances and instances that fail get lower scores."""
+        return self.latency * (1 + 4 * self.error_rate)
+
+
+class InstancePool:
+    """Spread the feed updates over multiple Nitter instances.
+
+    Feeds are always stored with the URL of the main instance from the settings. When a feed is updated, the
+    request is sent to one of the instances instead, picked at random with fast instances more likely to be picked.
+    Instances that fail a lot are skipped, but are tried again every UNHEALTHY_COOLDOWN seconds to see if they are
+    back up.
+    """
+
+    def __init__(self: "InstancePool") -> None:
+        self._lock = threading.Lock()
+        self._stats: dict[str, InstanceStats] = {}
+
+        # The instance each feed was last fetched from
+        self._served_by: dict[str, str] = {}
+
+    def _get_stats(self: "InstancePool", instance: str) -> InstanceStats:
+        return self._stats.setdefault(instance, InstanceStats(url=instance))
+
+    def choose(self: "InstancePool", instances: list[str], exclude: set[str] | None = None) -> str:
+        """Pick the instance to send a request to.
+
+        Args:
+            instances: The instances to choose from.
+            exclude: Instances that already failed this request.
+
+        Returns:
+            The instance URL.
+        """
+        with self._lock:
+            now: float = time.time()
+            candidates: list[InstanceStats] = [
+                self._get_stats(instance) for instance in instances if instance not in (exclude or set())
+            ] or [self._get_stats(instance) for instance in instances]
+
+            # Try an unhealthy instance again once in a while so we notice when it is back up
+            for stats in candidates:
+                if not stats.healthy and now - stats.last_used > UNHEALTHY_COOLDOWN:
+                    stats.last_used = now
+                    return stats.url
+
+            healthy: list[InstanceStats] = [stats for stats in candidates if stats.healthy]
+            if not healthy:
+                healthy = [min(candidates, key=lambda stats: stats.error_rate)]
+
+            weights: list[float] = [1 / stats.score for stats in healthy]
+            chosen: InstanceStats = random.choices(healthy, weights=weights)[0]  # noqa: S311
+            chosen.last_used = now
+            return chosen.url
+
+    def record(self: "InstancePool", instance: str, seconds: float, *, ok: bool) -> None:
+        """Remember how a request to an instance went.
+
+        Args:
+            instance: The instance URL.
+            seconds: How long the request took.
+            ok: If the instance responded with a feed.
+        """
+        with self._lock:
+            self._get_stats(instance).requests.append((seconds, ok))
+
+    def record_error(self: "InstancePool", feed_url: str) -> None:
+        """Remember that updating a feed failed before the instance responded, e.g. because of a timeout.
+
+        Args:
+            feed_url: The URL of the feed.
+        """
+        with self._lock:
+            if instance := self._served_by.get(feed_url):
+                self._get_stats(instance).requests.append((0.0, False))
+
+    def set_served_by(self: "InstancePool", feed_url: str, instance: str) -> None:
+        with self._lock:
+            self._served_by[feed_url] = instance
+
+    def get_served_by(self: "InstancePool", feed_url: str) -> str | None:
+        with self._lock:
+            return self._served_by.get(feed_url)
+
+    def get_state(self: "InstancePool") -> list[dict[str, Any]]:
+        """Get the statistics of every instance.
+
+        Returns:
+            The error rate, average latency and score of every instance we have sent requests to.
+        """
+        with self._lock:
+            return [
+                {
+                    "url": stats.url,
+                    "requests": len(stats.requests),
+                    "error_rate": round(stats.error_rate, 3),
+                    "latency": round(stats.latency, 3),
+                    "healthy": stats.healthy,
+                    "score": round(stats.score, 3),
+                }
+                for stats in self._stats.values()
+            ]
+
+
+@lru_cache(maxsize=1)
+def get_instance_pool() -> InstancePool:
+    """Get the instance pool every feed update goes through."""
+    return InstancePool()
+
+
+def get_instances(app_settings: ApplicationSettings) -> list[str]:
+    """Get every Nitter instance we can fetch feeds from, with the main instance first."""
+    return list(dict.fromkeys([app_settings.nitter_instance, *app_settings.extra_nitter_instances]))
+
+
+def replace_instance(url: str, old: str, new: str) -> str:
+    """Replace the instance at the start of a URL."""
+    return new + url[len(old) :] if url.startswith(f"{old}/") else url
+
+
+def rewrite_links(data: bytes, served_by: str, main_instance: str) -> bytes:
+    """Change the links in a feed that was fetched from another instance back to the main instance.
+
+    This way the entries are the same no matter which instance we got them from.
+    """
+    # Links are both full URLs and just the domain and path
+    data = data.replace(served_by.encode(), main_instance.encode())
+    return data.replace(urlsplit(served_by).netloc.encode(), urlsplit(main_instance).netloc.encode())
+
+
+def nitter_plugin(reader: Reader) -> None:
+    """Send feed updates to the Nitter instances in the instance pool and look at the feeds before they are parsed.
+
+    Everything is done in the request and response hooks of reader's HTTP retriever, the parser is left alone.
+
+    Args:
+        reader: The reader to add the plugin to.
+    """
+    pool: InstancePool = get_instance_pool()
+
+    # The feed every request we routed is for
+    feed_urls: WeakKeyDictionary[requests.Request, str] = WeakKeyDictionary()
+    feed_urls_lock = threading.Lock()
+
+    def route_request(
+        session: requests.Session,  # noqa: ARG001
+        request: requests.Request,
+        **kwargs: Any,  # noqa: ARG001, ANN401
+    ) -> requests.Request | None:
+        instances: list[str] = get_instances(get_app_settings(reader))
+        if not request.url.startswith(f"{instances[0]}/"):
+            return None
+
+        feed_url: str = request.url
+        instance: str = pool.choose(instances)
+        pool.set_served_by(feed_url, instance)
+        request.url = replace_instance(feed_url, instances[0], instance)
+        with feed_urls_lock:
+            feed_urls[request] = feed_url
+        return request
+
+    def record_response(
+        session: requests.Session,  # noqa: ARG001
+        response: requests.Response,
+        request: requests.Request,
+        **kwargs: Any,  # noqa: ARG001, ANN401
+    ) -> requests.Request | None:
+        with feed_urls_lock:
+            feed_url: str | None = feed_urls.get(request)
+        if feed_url is None:
+            return None
+
+        instances: list[str] = get_instances(get_app_settings(reader))
+        instance: str = pool.get_served_by(feed_url) or instances[0]
+
+        # Nitter answers with a HTML page instead of the feed when Twitter rate limits it
+        ok: bool = response.status_code == 304 or (  # noqa: PLR2004
+            response.ok and "html" not in response.headers.get("Content-Type", "")
+        )
+        pool.record(instance, response.elapsed.total_seconds(), ok=ok)
+        if ok or len(instances) == 1:
+            return None
+
+        # Try another instance, the response of this request is used whether it works or not
+        logger.info(f"Got {response.status_code} from {instance} for {feed_url}, trying another instance")
+        retry_instance: str = pool.choose(instances, exclude={instance})
+        pool.set_served_by(feed_url, retry_instance)
+        request.url = replace_instance(feed_url, instances[0], retry_instance)
+        return request
+
+    def read_response(
+        session: requests.Session,  # noqa: ARG001
+        response: requests.Response,
+        request: requests.Request,
+        **kwargs: Any,  # noqa: ARG001, ANN401
+    ) -> requests.Request | None:
+        with feed_urls_lock:
+            feed_url: str = feed_urls.pop(request, None) or request.url
+        if not response.ok:
+            return None
+
+        # Read the whole feed now, reader reads it from response.raw
+        data: bytes = response.content
+        response.close()
+
+        main_instance: str = get_app_settings(reader).nitter_instance
+        served_by: str | None = pool.get_served_by(feed_url)
+        if served_by and served_by != main_instance:
+            data = rewrite_links(data, served_by, main_instance)
+
+        remember_avatar(feed_url, data)
+        response.raw = io.BytesIO(data)
+        return None
+
+    # Like the plugins that come with reader, the retriever only exists after the parser is initialized
+    @reader._parser.lazy_init  # noqa: SLF001
+    def add_hooks(parser: Any) -> None:  # noqa: ANN401
+        retriever = parser.get_retriever("http://")
+        retriever.request_hooks.append(route_request)
+        retriever.response_hooks.append(record_response)
+        retriever.response_hooks.append(read_response)
@@ -0,0 +1,623 @@
+import contextlib
+import json
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from discord_webhook import DiscordWebhook
+from loguru import logger
+from reader import Entry, Reader
+from reader.types import EntryLike
+
+from discord_twitter_webhooks.delivery import DeliveryScheduler, WebhookResult, get_scheduler
+from discord_twitter_webhooks.metrics import LAG_BUCKETS, Counter, Histogram
+from discord_twitter_webhooks.rate_limit import redact_webhook
+from discord_twitter_webhooks.storage import get_db
+from discord_twitter_webhooks.video import convert_video
+
+# How many seconds we wait before sending a message again the first time it fails. It doubles every time it fails.
+RETRY_DELAY: float = 30
+
+# The longest we wait between two attempts, in seconds
+MAX_RETRY_DELAY: float = 60 * 60
+
+# Messages Discord rejects (a 4xx other than 429) are given up on after this many attempts.
+# Everything else, like Discord being down, is retried until it works.
+MAX_REJECTED_ATTEMPTS: int = 5
+
+# How many messages are read from the outbox at a time
+DRAIN_BATCH: int = 500
+
+# How many seconds a message that is being sent is left alone by the other processes, see claim_messages(). If the
+# process that claimed it stops before Discord has responded, the message is sent by another process after this long.
+CLAIM_TTL: float = 10 * 60
+
+# How many seconds the embeds of groups that combine embeds wait for the embeds after them, see Batch
+BATCH_WINDOW: float = 5
+
+# What Discord allows in one message, https://discord.com/developers/docs/resources/message#embed-object-embed-limits
+MAX_EMBEDS: int = 10
+MAX_EMBED_CHARACTERS: int = 6000
+MAX_FILES: int = 10
+MAX_FILES_SIZE: int = 25 * 1024 * 1024
+
+MESSAGES_DELIVERED = Counter("dtw_messages_delivered_total", "Messages Discord has accepted.")
+MESSAGES_FAILED = Counter(
+    "dtw_messages_failed_total",
+    "Attempts at sending a message that failed, by the status code Discord responded with.",
+    labelnames=("status",),
+)
+MESSAGES_BATCHED = Counter(
+    "dtw_messages_batched_total",
+    "Messages Discord has accepted that were combined with other messages into one request.",
+)
+DELIVERY_LAG_SECONDS = Histogram(
+    "dtw_delivery_lag_seconds",
+    "Time from a tweet being posted to it being accepted by Discord.",
+    buckets=LAG_BUCKETS,
+)
+
+
+@dataclass
+class OutboxMessage:
+    """A message in the outbox, waiting to be sent to one webhook."""
+
+    id: int
+    feed_url: str
+    entry_id: str
+    webhook: str
+    payload: dict[str, Any]
+
+    # Videos that are attached as GIFs, by filename, see video.py
+    attachments: dict[str, str]
+
+    attempts: int
+
+    # Unix time the message should be sent
+    next_attempt: float = 0
+
+    # Can be combined with the messages after it, see Batch
+    batch: bool = False
+
+    # Unix time until which the message is being sent by a process, see claim_messages()
+    claimed_until: float | None = None
+
+
+def get_embed_size(embed: dict[str, Any]) -> int:
+    """Count the characters of an embed like Discord does for MAX_EMBED_CHARACTERS."""
+    size: int = len(embed.get("title") or "") + len(embed.get("description") or "")
+    size += len((embed.get("author") or {}).get("name") or "") + len((embed.get("footer") or {}).get("text") or "")
+    for embed_field in embed.get("fields") or []:
+        size += len(embed_field.get("name") or "") + len(embed_field.get("value") or "")
+    return size
+
+
+def can_batch(message: OutboxMessage) -> bool:
+    """Check if a message can be combined with other messages. Only messages with just embeds can be."""
+    return message.batch and bool(message.payload.get("embeds")) and not message.payload.get("content")
+
+
+@dataclass
+class Batch:
+    """Messages to one webhook that are sent as one message, in order.
+
+    Discord shows up to MAX_EMBEDS embeds in one message, so a thread of tweets can be sent with one request
+    instead of one request per tweet.
+    """
+
+    webhook: str
+    messages: list[OutboxMessage] = field(default_factory=list)
+
+    # The GIFs of every message, see OutboxWorker.get_files()
+    files: list[dict[str, Any]] = field(default_factory=list)
+
+    def fits(self: "Batch", message: OutboxMessage, files: dict[str, Any]) -> bool:
+        """Check if a message can be added without going over Discord's limits."""
+        embeds: list[dict[str, Any]] = [
+            embed for batched in [*self.messages, message] for embed in batched.payload["embeds"]
+        ]
+        all_files: list[tuple[str, bytes]] = [file for batched in [*self.files, files] for file in batched.values()]
+        return (
+            len(embeds) <= MAX_EMBEDS
+            and sum(get_embed_size(embed) for embed in embeds) <= MAX_EMBED_CHARACTERS
+            and len(all_files) <= MAX_FILES
+            and sum(len(data) for _, data in all_files) <= MAX_FILES_SIZE
+        )
+
+    def add(self: "Batch", message: OutboxMessage, files: dict[str, Any]) -> None:
+        self.messages.append(message)
+        self.files.append(files)
+
+    def get_message(self: "Batch") -> tuple[dict[str, Any], dict[str, Any]]:
+        """Combine the messages into one.
+
+        Returns:
+            The payload and the files of the combined message.
+        """
+        if len(self.messages) == 1:
+            return self.messages[0].payload, self.files[0]
+
+        payload: dict[str, Any] = {**self.messages[0].payload, "embeds": []}
+        files: dict[str, Any] = {}
+        for number, (message, message_files) in enumerate(zip(self.messages, self.files, strict=True)):
+            embeds: list[dict[str, Any]] = message.payload["embeds"]
+            for filename, data in message_files.values():
+                # Every message calls its GIF video.gif, so they are renamed to not replace each other
+                new_filename: str = f"{number}_{filename}"
+                files[f"_{new_filename}"] = (new_filename, data)
+                for embed in embeds:
+                    if (embed.get("image") or {}).get("url") == f"attachment://{filename}":
+                        embed["image"] = {"url": f"attachment://{new_filename}"}
+            payload["embeds"].extend(embeds)
+
+        return payload, files
+
+
+def add_to_outbox(  # noqa: PLR0913
+    reader: Reader,
+    entry: Entry | EntryLike,
+    message: str,
+    webhook: DiscordWebhook,
+    urls: list[str],
+    attachments: dict[str, str] | None = None,
+    *,
+    batch: bool = False,
+) -> int:
+    """Save a message so it is sent to every webhook, even if Discord is down or we crash before it is sent.
+
+    A message that is already in the outbox for the same entry and webhook is not added again, unless we gave up
+    on sending it.
+
+    Args:
+        reader: The reader whose database the outbox is stored in.
+        entry: The entry the message is for.
+        message: What the message is, e.g. the group and the kind of message. Used to not add the same message twice.
+        webhook: The message to send. Its URL and files are ignored.
+        urls: The webhook URLs to send the message to.
+        attachments: Videos to attach as GIFs, by filename. They are converted before the message is sent.
+        batch: Wait BATCH_WINDOW seconds for more messages to combine this one with, see Batch.
+
+    Returns:
+        How many messages were added.
+    """
+    if not urls:
+        return 0
+
+    payload: str = json.dumps(webhook.json)
+    now: float = time.time()
+    next_attempt: float = now + BATCH_WINDOW if batch else now
+    attachments_json: str = json.dumps(attachments or {})
+    with get_db(reader) as db:
+        cursor = db.executemany(
+            """
+            INSERT INTO outbox (
+                feed_url, entry_id, message, webhook, payload, attachments, next_attempt, created, batch
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (feed_url, entry_id, message, webhook) DO UPDATE SET
+                payload = excluded.payload,
+                attachments = excluded.attachments,
+                attempts = 0,
+                next_attempt = excluded.next_attempt,
+                batch = excluded.batch
+            WHERE outbox.next_attempt IS NULL;
+            """,
+            [
+                (entry.feed_url, entry.id, message, url, payload, attachments_json, next_attempt, now, batch)
+                for url in dict.fromkeys(urls)
+            ],
+        )
+
+    get_outbox_worker(reader).wake()
+    return cursor.rowcount
+
+
+def get_due_messages(reader: Reader, now: float, limit: int = DRAIN_BATCH) -> list[OutboxMessage]:
+    """Get the messages that should be sent now, oldest first.
+
+    New messages that are waiting to be combined with other messages are included too, so they can be sent
+    together with the messages before them, see Batch.
+    """
+    rows = get_db(reader).execute(
+        """
+        SELECT id, feed_url, entry_id, webhook, payload, attachments, attempts, next_attempt, batch, claimed_until
+        FROM outbox
+        WHERE next_attempt <= ? OR (batch AND attempts = 0 AND next_attempt IS NOT NULL)
+        ORDER BY id LIMIT ?;
+        """,
+        (now, limit),
+    )
+    return [
+        OutboxMessage(
+            id=message_id,
+            feed_url=feed_url,
+            entry_id=entry_id,
+            webhook=webhook,
+            payload=json.loads(payload),
+            attachments=json.loads(attachments),
+            attempts=attempts,
+            next_attempt=next_attempt,
+            batch=bool(batch),
+            claimed_until=claimed_until,
+        )
+        for (
+            message_id,
+            feed_url,
+            entry_id,
+            webhook,
+            payload,
+            attachments,
+            attempts,
+            next_attempt,
+            batch,
+            claimed_until,
+        ) in rows
+    ]
+
+
+def claim_messages(reader: Reader, messages: list[OutboxMessage], now: float) -> list[OutboxMessage]:
+    """Claim messages before sending them, so no other process sends them too.
+
+    When the outbox lease moves to another worker, the worker that had it can still be sending messages, see
+    workers.py. Messages that another process claimed in the last CLAIM_TTL seconds can't be claimed.
+
+    Returns:
+        The messages that were claimed, in order.
+    """
+    claimed: list[OutboxMessage] = []
+    with get_db(reader) as db:
+        for message in messages:
+            cursor = db.execute(
+                "UPDATE outbox SET claimed_until = ? WHERE id = ? AND (claimed_until IS NULL OR claimed_until <= ?);",
+                (now + CLAIM_TTL, message.id, now),
+            )
+            if cursor.rowcount == 1:
+                claimed.append(message)
+    return claimed
+
+
+def get_next_attempt(reader: Reader, now: float) -> float | None:
+    """Get the Unix time of the next message that is waiting to be sent again, or None if no message is waiting."""
+    row = get_db(reader).execute("SELECT MIN(next_attempt) FROM outbox WHERE next_attempt > ?;", (now,)).fetchone()
+    return row[0]
+
+
+def get_retry_delay(attempts: int) -> float:
+    """Get how many seconds to wait before sending a message again after it has failed this many times."""
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def delete_message(reader: Reader, message_id: int) -> None:
+    """Remove a message that has been sent from the outbox."""
+    with get_db(reader) as db:
+        db.execute("DELETE FROM outbox WHERE id = ?;", (message_id,))
+
+
+def retry_message(
+    reader: Reader,
+    message: OutboxMessage,
+    result: WebhookResult,
+    *,
+    combined: bool = False,
+) -> float | None:
+    """Remember that sending a message failed and decide when to send it again.
+
+    Args:
+        reader: The reader whose database the outbox is stored in.
+        message: The message that failed.
+        result: What Discord responded with.
+        combined: The message was combined with other messages, see Batch. If Discord rejected it, one of the other
+            messages may be why, so every message is sent again on its own right away and the attempt isn't counted.
+
+    Returns:
+        The Unix time the message will be sent again, or None if we gave up on it. Messages we gave up on are kept
+        in the outbox so they can be looked at.
+    """
+    attempts: int = message.attempts + 1
+    rejected: bool = (
+        result.status_code is not None and 400 <= result.status_code < 500 and result.status_code != 429  # noqa: PLR2004
+    )
+    batch: bool = message.batch
+    next_attempt: float | None = None
+    if rejected and combined:
+        attempts = message.attempts
+        batch = False
+        next_attempt = time.time()
+    elif not rejected or attempts < MAX_REJECTED_ATTEMPTS:
+        next_attempt = time.time() + get_retry_delay(attempts)
+
+    error: str = f"{result.status_code}: {result.text}" if result.status_code else result.error
+    with get_db(reader) as db:
+        db.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ?, batch = ?, claimed_until = NULL"
+            " WHERE id = ?;",
+            (attempts, next_attempt, error, batch, message.id),
+        )
+    return next_attempt
+
+
+def get_outbox_state(reader: Reader) -> dict[str, Any]:
+    """Get how many messages are waiting to be sent.
+
+    Returns:
+        How many messages are waiting, how many we gave up on and how old the oldest message is in seconds.
+    """
+    waiting, failed, oldest = get_db(reader).execute(
+        "SELECT COUNT(next_attempt), COUNT(*) - COUNT(next_attempt), MIN(created) FROM outbox;",
+    ).fetchone()
+    return {
+        "waiting": waiting,
+        "failed": failed,
+        "oldest": round(time.time() - oldest, 1) if oldest else None,
+    }
+
+
+def show_attachment(payload: dict[str, Any], filename: str) -> None:
+    """Show an attachment in the first embed of a message instead of its image."""
+    if payload.get("embeds"):
+        payload["embeds"][0]["image"] = {"url": f"attachment://{filename}"}
+
+
+def show_video_link(payload: dict[str, Any], video_url: str) -> None:
+    """Link to a video that couldn't be attached as a GIF, in the first embed or after the text."""
+    if payload.get("embeds"):
+        embed: dict[str, Any] = payload["embeds"][0]
+        embed["description"] = f"{embed.get('description') or ''}\n\n[Video]({video_url})".strip()
+    else:
+        payload["content"] = f"{payload.get('content') or ''}\n{video_url}".strip()
+
+
+class OutboxWorker:
+    """Send the messages in the outbox to Discord.
+
+    Messages are only removed from the outbox when Discord has accepted them. Messages that fail are sent again
+    later, waiting longer after every attempt, see get_retry_delay(). Messages with videos wait for the video to be
+    converted without holding up the messages to other webhooks.
+    """
+
+    def __init__(self: "OutboxWorker", reader: Reader, scheduler: DeliveryScheduler | None = None) -> None:
+        self.reader: Reader = reader
+        self.scheduler: DeliveryScheduler = scheduler or get_scheduler()
+
+        # Only one process sends the messages, the others leave them alone, see workers.py
+        self.active: bool = True
+
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight: set[int] = set()
+        self._thread: threading.Thread | None = None
+
+        # The conversions we are waiting for, by video URL. Kept until the drain after they are done, as
+        # convert_video() starts over once a conversion is done and we would never see the result.
+        self._conversions: dict[str, Future] = {}
+
+    def wake(self: "OutboxWorker") -> None:
+        """Look for messages to send now, starting the worker if it isn't running."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def join(self: "OutboxWorker", timeout: float | None = None) -> bool:
+        """Wait until every message that is due has been sent or has failed.
+
+        Args:
+            timeout: How many seconds to wait at most. None waits forever.
+
+        Returns:
+            True if nothing is due, False if we timed out.
+        """
+        deadline: float | None = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                idle: bool = not self._in_flight
+            if idle and not self._wake.is_set() and not get_due_messages(self.reader, time.time(), limit=1):
+                return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+
+    def _run(self: "OutboxWorker") -> None:
+        while True:
+            self._wake.clear()
+            try:
+                timeout: float | None = self.drain()
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to send the messages in the outbox")
+                timeout = RETRY_DELAY
+            self._wake.wait(timeout)
+
+    def get_files(self: "OutboxWorker", message: OutboxMessage) -> dict[str, Any] | None:
+        """Get the GIFs to attach to a message. Videos that couldn't be converted are linked to instead.
+
+        Returns:
+            The files, or None if a video is still being converted. The worker is woken up when it is done.
+        """
+        files: dict[str, Any] = {}
+        for filename, video_url in message.attachments.items():
+            future: Future | None = self._conversions.get(video_url)
+            if future is None:
+                future = convert_video(video_url)
+                if not future.done():
+                    self._conversions[video_url] = future
+                    future.add_done_callback(lambda _: self.wake())
+            if not future.done():
+                return None
+
+            gif: bytes | None = None
+            gif_path: Path | None = None if future.exception() else future.result()
+            if gif_path:
+                # The GIF can have been removed from the cache by another conversion
+                with contextlib.suppress(FileNotFoundError):
+                    gif = gif_path.read_bytes()
+
+            if gif:
+                files[f"_{filename}"] = (filename, gif)
+                show_attachment(message.payload, filename)
+            else:
+                show_video_link(message.payload, video_url)
+
+        return files
+
+    def drain(self: "OutboxWorker") -> float | None:
+        """Send every message that is due and isn't being sent already.
+
+        Returns:
+            Seconds until the next message should be sent again, or None if no message is waiting.
+        """
+        if not self.active:
+            return None
+
+        now: float = time.time()
+        with self._lock:
+            in_flight: set[int] = set(self._in_flight)
+
+        # Webhooks with a message waiting for its video or for messages to be combined with. Their newer messages
+        # wait too, so they are sent in order.
+        waiting: set[str] = set()
+
+        # The messages that are being combined for every webhook
+        batches: dict[str, Batch] = {}
+
+        # Conversions that finished before this drain. The ones that finish during it are used by the next one.
+        converted: list[str] = [url for url, future in self._conversions.items() if future.done()]
+
+        # When the first message another process is sending can be claimed, if that process stops
+        claimed_until: float | None = None
+
+        for message in get_due_messages(self.reader, now):
+            if message.id in in_flight or message.webhook in waiting:
+                continue
+
+            # Another process is sending it. Newer messages to the webhook wait for it so they are sent in order.
+            if message.claimed_until is not None and message.claimed_until > now:
+                claimed_until = min(claimed_until or message.claimed_until, message.claimed_until)
+                waiting.add(message.webhook)
+                continue
+
+            batch: Batch | None = batches.get(message.webhook)
+            batchable: bool = can_batch(message)
+
+            # Messages that are waiting to be combined can still be combined with the messages before them
+            if message.next_attempt > now and not (batchable and batch):
+                waiting.add(message.webhook)
+                continue
+
+            files: dict[str, Any] | None = self.get_files(message)
+            if files is None:
+                waiting.add(message.webhook)
+                continue
+
+            if batch and batchable and batch.fits(message, files):
+                batch.add(message, files)
+                continue
+
+            if batch:
+                self.send(batches.pop(message.webhook))
+
+            batch = Batch(message.webhook, [message], [files])
+            if batchable:
+                batches[message.webhook] = batch
+            else:
+                self.send(batch)
+
+        for batch in batches.values():
+            self.send(batch)
+
+        # Every message that was waiting for these conversions has been sent
+        for video_url in converted:
+            del self._conversions[video_url]
+
+        next_attempt: float | None = get_next_attempt(self.reader, now)
+        if claimed_until is not None:
+            next_attempt = min(next_attempt or claimed_until, claimed_until)
+        return None if next_attempt is None else max(0.0, next_attempt - time.time())
+
+    def send(self: "OutboxWorker", batch: Batch) -> None:
+        """Send messages to their webhook as one message, leaving out the ones another process is sending."""
+        claimed: set[int] = {message.id for message in claim_messages(self.reader, batch.messages, time.time())}
+        if len(claimed) < len(batch.messages):
+            logger.info(
+                "Not sending {} messages to {} as another process is sending them",
+                len(batch.messages) - len(claimed),
+                redact_webhook(batch.webhook),
+            )
+            messages: list[tuple[OutboxMessage, dict[str, Any]]] = [
+                (message, files)
+                for message, files in zip(batch.messages, batch.files, strict=True)
+                if message.id in claimed
+            ]
+            if not messages:
+                return
+            batch = Batch(batch.webhook, [message for message, _ in messages], [files for _, files in messages])
+
+        with self._lock:
+            self._in_flight.update(message.id for message in batch.messages)
+
+        payload, files = batch.get_message()
+        future: Future = self.scheduler.submit(batch.webhook, payload, files)
+        future.add_done_callback(partial(self._sent, batch.messages))
+
+    def record_delivery(self: "OutboxWorker", message: OutboxMessage) -> None:
+        """Count a message that was sent and how long after the tweet was posted it was sent."""
+        MESSAGES_DELIVERED.inc()
+        entry: Entry | None = self.reader.get_entry((message.feed_url, message.entry_id), None)
+        if entry is not None and (posted := entry.published or entry.added):
+            DELIVERY_LAG_SECONDS.observe((datetime.now(tz=timezone.utc) - posted).total_seconds())
+
+    def _sent(self: "OutboxWorker", messages: list[OutboxMessage], future: Future) -> None:
+        result: WebhookResult = future.result()
+        webhook: str = redact_webhook(messages[0].webhook)
+        try:
+            if result.ok:
+                for message in messages:
+                    delete_message(self.reader, message.id)
+                    logger.info("Webhook posted for {} to {}", message.entry_id, webhook)
+                    self.record_delivery(message)
+                if len(messages) > 1:
+                    MESSAGES_BATCHED.inc(len(messages))
+            else:
+                for message in messages:
+                    MESSAGES_FAILED.inc(status=result.status_code or "error")
+                    next_attempt: float | None = retry_message(
+                        self.reader,
+                        message,
+                        result,
+                        combined=len(messages) > 1,
+                    )
+                retry: str = f"Trying again in {max(0, next_attempt - time.time()):.0f} seconds" if next_attempt else ""
+                logger.error(
+                    "Got {} from {} for {} messages. Response: {}. {}",
+                    result.status_code,
+                    webhook,
+                    len(messages),
+                    result.text or result.error,
+                    retry or "Giving up",
+                )
+        finally:
+            with self._lock:
+                self._in_flight.difference_update(message.id for message in messages)
+                done: bool = not self._in_flight
+
+        # Look for the next batch when this one is done, and for when to try again when a message failed
+        if done or not result.ok:
+            self.wake()
+
+
+# The worker of every reader we have sent messages for
+_workers: dict[Reader, OutboxWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def get_outbox_worker(reader: Reader) -> OutboxWorker:
+    """Get the worker that sends the messages in the outbox of a reader."""
+    with _workers_lock:
+        if reader not in _workers:
+            _workers[reader] = OutboxWorker(reader)
+        return _workers[reader]
@@ -0,0 +1,189 @@
+from dataclasses import dataclass, field
+from typing import Literal
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import PreformattedString
+from reader import Entry
+from reader.types import EntryLike
+
+# Entries we have already parsed, see parse_entry()
+_parse_cache: dict[tuple[str, str], "ParsedEntry"] = {}
+
+
+@dataclass
+class Link:
+    """A hyperlink in the tweet."""
+
+    text: str
+    href: str | None
+
+    @property
+    def is_hashtag(self: "Link") -> bool:
+        return self.text.startswith("#")
+
+    @property
+    def is_mention(self: "Link") -> bool:
+        return self.text.startswith("@")
+
+
+@dataclass
+class ParsedEntry:
+    """Everything we need from the HTML of a tweet, so we only have to parse it once."""
+
+    # The text and the links of the tweet in the order they appear. Paragraphs end with a newline.
+    runs: list[str | Link] = field(default_factory=list)
+
+    # Images, videos and gifs are shown as images in the RSS feed
+    images: list[str] = field(default_factory=list)
+
+    # The URLs of <source type="video/mp4"> tags
+    videos: list[str] = field(default_factory=list)
+
+    @property
+    def links(self: "ParsedEntry") -> list[Link]:
+        return [run for run in self.runs if isinstance(run, Link)]
+
+    @property
+    def hashtags(self: "ParsedEntry") -> list[Link]:
+        return [link for link in self.links if link.is_hashtag]
+
+    @property
+    def mentions(self: "ParsedEntry") -> list[Link]:
+        return [link for link in self.links if link.is_mention]
+
+    @property
+    def has_media(self: "ParsedEntry") -> bool:
+        return bool(self.images or self.videos)
+
+    def to_markdown(self: "ParsedEntry", link_destination: Literal["Twitter", "Nitter"] = "Twitter") -> str:
+        """Convert the tweet to markdown.
+
+        Args:
+            link_destination: Hashtags and mentions link to Twitter if this is "Twitter".
+
+        Returns:
+            Our markdown.
+        """
+        markdown: list[str] = []
+        for run in self.runs:
+            if not isinstance(run, Link):
+                markdown.append(run)
+                continue
+
+            # TODO: This breaks for https://nitter.lovinator.space/Steam/status/1679694708761669634#m
+            #  and https://nitter.lovinator.space/SteamDB/status/1677217359487021056#m
+            href: str | None = run.href
+
+            # Replace Nitter links with Twitter links
+            if link_destination == "Twitter":
+                if run.is_hashtag:
+                    href = f"https://twitter.com/hashtag/{run.text[1:]}"
+                elif run.is_mention:
+                    href = f"https://twitter.com/{run.text[1:]}"
+
+            # Remove the link preview
+            markdown.append(f"[{run.text}](<{href}>)")
+
+        return "".join(markdown).strip()
+
+
+class _Parser:
+    """Walk the HTML of a tweet once and build a ParsedEntry from it."""
+
+    def __init__(self: "_Parser") -> None:
+        self.parsed = ParsedEntry()
+
+        # The runs since the last tag, a whitespace-only text node is shortened to one newline or space.
+        self._text_node: list[str | Link] = []
+
+    def _end_text_node(self: "_Parser") -> None:
+        text_node: list[str | Link] = self._text_node
+        self._text_node = []
+
+        if not any(isinstance(run, Link) for run in text_node):
+            text: str = "".join(run for run in text_node if isinstance(run, str))
+            if text and not text.strip():
+                text_node = ["\n" if "\n" in text else " "]
+
+        self.parsed.runs.extend(text_node)
+
+    def walk(self: "_Parser", tag: Tag) -> None:
+        for child in tag.children:
+            if isinstance(child, NavigableString):
+                # Comments, doctypes and the like are not part of the text
+                if not isinstance(child, PreformattedString):
+                    self._text_node.append(str(child))
+                continue
+
+            if not isinstance(child, Tag):
+                continue
+
+            # Used for photos, videos, gifs and tweet cards
+            if child.name == "img":
+                if src := child.get("src"):
+                    self.parsed.images.append(str(src))
+                continue
+
+            if child.name in {"a", "link"}:
+                # Links can wrap images, we want those too
+                for image in child.find_all("img"):
+                    if src := image.get("src"):
+                        self.parsed.images.append(str(src))
+
+                text: str = child.get_text()
+                if text.strip():
+                    href = child.get("href")
+                    self._text_node.append(Link(text=text, href=str(href) if href is not None else None))
+                continue
+
+            self._end_text_node()
+            if child.name == "source" and child.get("type") == "video/mp4" and (src := child.get("src")):
+                self.parsed.videos.append(str(src))
+
+            self.walk(child)
+            self._end_text_node()
+
+            # Paragraphs end with a newline
+            if child.name == "p":
+                self._text_node.append("\n")
+
+    def parse(self: "_Parser", html: str) -> ParsedEntry:
+        self.walk(BeautifulSoup(html, features="lxml"))
+        self._end_text_node()
+        return self.parsed
+
+
+def parse_html(html: str) -> ParsedEntry:
+    """Parse the HTML of a tweet.
+
+    Args:
+        html: The HTML to parse.
+
+    Returns:
+        The text, links, images and videos of the tweet.
+    """
+    if not html:
+        return ParsedEntry()
+    return _Parser().parse(html)
+
+
+def parse_entry(entry: Entry | EntryLike) -> ParsedEntry:
+    """Parse the summary of an entry.
+
+    Every entry is only parsed once per check for new tweets, no matter how many times it is used.
+
+    Args:
+        entry: The entry to parse.
+
+    Returns:
+        The text, links, images and videos of the tweet.
+    """
+    key: tuple[str, str] = (entry.feed_url, entry.id)
+    if key not in _parse_cache:
+        _parse_cache[key] = parse_html(entry.summary or "")
+    return _parse_cache[key]
+
+
+def clear_parse_cache() -> None:
+    """Forget every parsed entry. This is called at the start of every check for new tweets."""
+    _parse_cache.clear()
@@ -0,0 +1,127 @@
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+from loguru import logger
+from reader import Entry, Reader, ReaderError
+
+from discord_twitter_webhooks._dataclasses import get_app_settings
+from discord_twitter_webhooks.metrics import Histogram
+from discord_twitter_webhooks.nitter import get_instance_pool
+
+# Quiet accounts are still checked at least this often
+MAX_UPDATE_INTERVAL: timedelta = timedelta(hours=6)
+
+# How many of the newest tweets we look at to see how often an account tweets
+RECENT_ENTRIES: int = 20
+
+# Feeds that are due this close to the start of a check are updated in that check
+DUE_SLACK: timedelta = timedelta(seconds=30)
+
+UPDATE_FEED_SECONDS = Histogram("dtw_update_feed_seconds", "Time spent updating one feed.")
+UPDATE_FEEDS_SECONDS = Histogram(
+    "dtw_update_feeds_seconds",
+    "Time spent updating every feed that was due in one check for new tweets.",
+)
+
+
+def get_update_interval(reader: Reader, feed_url: str, now: datetime, min_interval: timedelta) -> timedelta:
+    """Get how long we should wait before updating a feed again.
+
+    Accounts are checked twice as often as they have tweeted lately, but never more often than min_interval and never
+    less often than MAX_UPDATE_INTERVAL.
+
+    Args:
+        reader: The reader the feed is in.
+        feed_url: The URL of the feed.
+        now: When the feed was updated.
+        min_interval: The delay from the settings.
+
+    Returns:
+        The time until the next update.
+    """
+    entries: list[Entry] = list(reader.get_entries(feed=feed_url, sort="recent", limit=RECENT_ENTRIES))
+    published: list[datetime] = [entry.published or entry.added for entry in entries]
+    if not published:
+        return min_interval
+
+    # The average time between tweets, counting the time since the last tweet
+    average: timedelta = (now - min(published)) / len(published)
+    return max(min_interval, min(average / 2, MAX_UPDATE_INTERVAL))
+
+
+def get_next_update(reader: Reader, feed_url: str) -> datetime | None:
+    """Get when a feed should be updated next.
+
+    Args:
+        reader: The reader the feed is in.
+        feed_url: The URL of the feed.
+
+    Returns:
+        When the feed should be updated, or None if it should be updated now.
+    """
+    next_update: str | None = reader.get_tag(feed_url, "next_update", None)
+    return datetime.fromisoformat(next_update) if next_update else None
+
+
+def get_due_feeds(reader: Reader, now: datetime, feed_filter: Callable[[str], bool] | None = None) -> list[str]:
+    """Get the feeds that should be updated.
+
+    Args:
+        reader: The reader the feeds are in.
+        now: When the check for new tweets started.
+        feed_filter: Only look at the feeds this returns True for, see workers.py.
+
+    Returns:
+        The URLs of the feeds that are due.
+    """
+    due: list[str] = []
+    for feed in reader.get_feeds(updates_enabled=True):
+        if feed_filter and not feed_filter(feed.url):
+            continue
+
+        next_update: datetime | None = get_next_update(reader, feed.url)
+        if next_update is None or next_update <= now + DUE_SLACK:
+            due.append(feed.url)
+    return due
+
+
+def update_feed(reader: Reader, feed_url: str) -> None:
+    """Update a feed and log if it fails."""
+    try:
+        with UPDATE_FEED_SECONDS.time():
+            reader.update_feed(feed_url)
+    except ReaderError as e:
+        logger.error("Failed to update {} - {}", feed_url, e)
+
+        # Instances that responded have already been judged by their response, see nitter.py
+        if isinstance(e.__cause__, requests.RequestException):
+            get_instance_pool().record_error(feed_url)
+
+
+def update_due_feeds(reader: Reader, workers: int = 4, feed_filter: Callable[[str], bool] | None = None) -> list[str]:
+    """Update the feeds that are due and decide when they should be updated next.
+
+    Args:
+        reader: The reader the feeds are in.
+        workers: How many feeds to update at the same time.
+        feed_filter: Only update the feeds this returns True for, see workers.py.
+
+    Returns:
+        The URLs of the feeds that were updated.
+    """
+    now: datetime = datetime.now(tz=timezone.utc)
+    due: list[str] = get_due_feeds(reader, now, feed_filter)
+    logger.debug("Updating {} feeds", len(due))
+
+    with UPDATE_FEEDS_SECONDS.time():
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="update_feed") as executor:
+            list(executor.map(lambda feed_url: update_feed(reader, feed_url), due))
+
+    min_interval = timedelta(minutes=get_app_settings(reader).delay or 10)
+    for feed_url in due:
+        interval: timedelta = get_update_interval(reader, feed_url, now, min_interval)
+        reader.set_tag(feed_url, "next_update", (now + interval).isoformat())
+
+    return due
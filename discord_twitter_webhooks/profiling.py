@@ -0,0 +1,403 @@
+import cProfile
+import json
+import marshal
+import os
+import pstats
+import re
+import socket
+import sqlite3
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from types import FrameType
+from typing import Any, Literal, TypeVar
+
+from loguru import logger
+from reader import Reader
+
+from discord_twitter_webhooks.storage import get_db
+
+T = TypeVar("T")
+
+ProfileMode = Literal["cprofile", "sampling"]
+
+# How often the sampling profiler looks at what every thread is doing, in seconds
+SAMPLE_INTERVAL: float = 0.01
+
+# How many functions are saved per profile
+TOP_FUNCTIONS: int = 50
+
+# How many profiles are kept. The oldest ones are deleted when there are more.
+MAX_PROFILES: int = 20
+
+# Functions threads wait in when they have nothing to do. Samples of threads waiting here aren't counted, so the
+# thread pools that are waiting for work don't hide the threads that are working.
+IDLE_FUNCTIONS: frozenset[tuple[str, str]] = frozenset(
+    {
+        ("threading.py", "wait"),
+        ("threading.py", "_wait_for_tstate_lock"),
+        ("queue.py", "get"),
+        ("selectors.py", "select"),
+        ("socketserver.py", "serve_forever"),
+        ("thread.py", "_worker"),
+        ("base_events.py", "_run_once"),
+    },
+)
+
+# Where the standard library, the installed packages and this package are, to make the file names shorter
+_library_paths: list[str] = sorted(
+    {
+        str(Path(path).resolve())
+        for path in [*sys.path, *sysconfig.get_paths().values(), Path(__file__).parent.parent]
+        if path
+    },
+    key=len,
+    reverse=True,
+)
+
+
+@dataclass
+class FunctionStats:
+    """The time spent in a function during a profile."""
+
+    function: str
+    package: str
+
+    # Seconds spent in the function itself and in the function and everything it called
+    own: float
+    cumulative: float
+
+    # Only known for cProfile
+    calls: int | None = None
+
+
+@dataclass
+class Profile:
+    """A profile of one check for new tweets, see profile_cycle()."""
+
+    id: int
+    mode: str
+    process: str
+
+    # Unix time
+    started: float
+    seconds: float
+
+    # The functions with the most cumulative time
+    functions: list[FunctionStats] = field(default_factory=list)
+
+    # Seconds spent in the functions of every package, e.g. "bs4" or "reader"
+    packages: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def started_at(self: "Profile") -> str:
+        return datetime.fromtimestamp(self.started, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+
+
+def get_location(filename: str) -> tuple[str, str]:
+    """Get a short name for a file and the package it is in.
+
+    Args:
+        filename: The file name from the code object, or "~" for functions written in C.
+
+    Returns:
+        The file relative to the standard library or site-packages, and its first part without .py.
+    """
+    # Modules that are frozen into Python, like <frozen importlib._bootstrap>
+    if filename.startswith("<frozen "):
+        module: str = filename.removeprefix("<frozen ").removesuffix(">")
+        return module, module.split(".")[0]
+
+    path: str = str(Path(filename).resolve()) if Path(filename).is_absolute() else filename
+    for library_path in _library_paths:
+        if path.startswith(library_path + os.sep):
+            path = path[len(library_path) + 1 :]
+            break
+
+    return path, path.split(os.sep)[0].removesuffix(".py")
+
+
+def get_builtin_package(name: str) -> str:
+    """Get the module a C function cProfile saw is from, e.g. "sqlite3" for <method 'execute' of 'sqlite3.Cursor'>."""
+    if match := re.search(r"of '(\w+)", name):
+        return match.group(1).lstrip("_")
+    if match := re.search(r"built-in method (\w+)\.", name):
+        return match.group(1).lstrip("_")
+    return "builtins"
+
+
+def get_cprofile_stats(profiler: cProfile.Profile) -> tuple[list[FunctionStats], dict[str, float]]:
+    """Get the functions with the most cumulative time and the own time of every package from cProfile."""
+    functions: list[FunctionStats] = []
+    packages: Counter[str] = Counter()
+    stats: dict[tuple[str, int, str], tuple] = pstats.Stats(profiler).stats  # type: ignore  # noqa: PGH003
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.items():
+        if filename == "~":
+            function, package = name, get_builtin_package(name)
+        else:
+            path, package = get_location(filename)
+            function = f"{name} ({path}:{line})"
+
+        packages[package] += own
+        functions.append(
+            FunctionStats(function=function, package=package, own=own, cumulative=cumulative, calls=calls),
+        )
+
+    functions.sort(key=lambda stats: stats.cumulative, reverse=True)
+    return functions[:TOP_FUNCTIONS], dict(packages.most_common())
+
+
+class SamplingProfiler:
+    """Look at what every thread in the process is doing every SAMPLE_INTERVAL seconds.
+
+    Unlike cProfile this sees the threads the feeds are updated and the webhooks are sent in, and it doesn't slow
+    down the code it profiles. Time spent in C, like SQLite, counts towards the Python function that called it.
+    """
+
+    def __init__(self: "SamplingProfiler", interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval: float = interval
+
+        # Seconds per function, where the function was running and where it was anywhere in the stack
+        self.own: Counter[tuple[str, int, str]] = Counter()
+        self.cumulative: Counter[tuple[str, int, str]] = Counter()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self: "SamplingProfiler") -> None:
+        self._thread.start()
+
+    def stop(self: "SamplingProfiler") -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def sample(self: "SamplingProfiler", seconds: float) -> None:
+        """Count what every thread but this one is doing right now.
+
+        Args:
+            seconds: How long since the last sample. The threads are assumed to have been doing this all that time.
+        """
+        for thread_id, frame in sys._current_frames().items():  # noqa: SLF001
+            if thread_id == threading.get_ident():
+                continue
+
+            code = frame.f_code
+            if (Path(code.co_filename).name, code.co_name) in IDLE_FUNCTIONS:
+                continue
+
+            self.own[(code.co_filename, code.co_firstlineno, code.co_name)] += seconds
+
+            stack: set[tuple[str, int, str]] = set()
+            current: FrameType | None = frame
+            while current is not None:
+                code = current.f_code
+                stack.add((code.co_filename, code.co_firstlineno, code.co_name))
+                current = current.f_back
+            for function in stack:
+                self.cumulative[function] += seconds
+
+    def _run(self: "SamplingProfiler") -> None:
+        # Sampling takes time too, so the samples are further apart than the interval
+        last: float = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now: float = time.perf_counter()
+            self.sample(now - last)
+            last = now
+
+    def get_stats(self: "SamplingProfiler") -> tuple[list[FunctionStats], dict[str, float]]:
+        """Get the functions with the most cumulative time and the own time of every package."""
+        packages: Counter[str] = Counter()
+        for (filename, _, _), seconds in self.own.items():
+            packages[get_location(filename)[1]] += seconds
+
+        functions: list[FunctionStats] = []
+        for (filename, line, name), seconds in self.cumulative.most_common(TOP_FUNCTIONS):
+            path, package = get_location(filename)
+            functions.append(
+                FunctionStats(
+                    function=f"{name} ({path}:{line})",
+                    package=package,
+                    own=self.own[(filename, line, name)],
+                    cumulative=seconds,
+                ),
+            )
+        return functions, dict(packages.most_common())
+
+
+def request_profiles(reader: Reader, mode: ProfileMode, cycles: int) -> None:
+    """Profile the next checks for new tweets, in whichever process does them.
+
+    Args:
+        reader: The reader whose database the request is saved in.
+        mode: "cprofile" to profile every function call in the thread that checks for new tweets, "sampling" to
+            look at every thread a hundred times a second.
+        cycles: How many checks to profile. 0 cancels the profiles that haven't been taken yet.
+    """
+    with get_db(reader) as db:
+        db.execute(
+            "INSERT OR REPLACE INTO profile_requests (id, mode, remaining) VALUES (1, ?, ?);",
+            (mode, max(0, cycles)),
+        )
+
+
+def get_profile_request(reader: Reader) -> tuple[ProfileMode, int] | None:
+    """Get the kind of profiles that are requested and how many are left, or None if none are."""
+    row = get_db(reader).execute("SELECT mode, remaining FROM profile_requests WHERE remaining > 0;").fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def take_profile_request(reader: Reader) -> ProfileMode | None:
+    """Take one of the requested profiles, so no other process takes it too.
+
+    Returns:
+        The kind of profile to take, or None if no profiles are requested.
+    """
+    # Most checks aren't profiled, so don't lock the database for writing to find that out
+    if get_profile_request(reader) is None:
+        return None
+
+    db: sqlite3.Connection = get_db(reader)
+    db.execute("BEGIN IMMEDIATE;")
+    try:
+        row = db.execute("SELECT mode FROM profile_requests WHERE remaining > 0;").fetchone()
+        db.execute("UPDATE profile_requests SET remaining = remaining - 1 WHERE remaining > 0;")
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+    return row[0] if row else None
+
+
+def save_profile(  # noqa: PLR0913
+    reader: Reader,
+    mode: ProfileMode,
+    started: float,
+    seconds: float,
+    functions: list[FunctionStats],
+    packages: dict[str, float],
+    stats: bytes | None = None,
+) -> int:
+    """Save a profile and delete the oldest ones if there are more than MAX_PROFILES.
+
+    Args:
+        reader: The reader whose database the profile is saved in.
+        mode: How the profile was taken.
+        started: When the check started, in Unix time.
+        seconds: How long the check took.
+        functions: The functions with the most cumulative time.
+        packages: The own time of every package.
+        stats: The whole cProfile profile in the pstats format, so it can be opened with other tools.
+
+    Returns:
+        The id of the profile.
+    """
+    with get_db(reader) as db:
+        cursor = db.execute(
+            "INSERT INTO profiles (mode, process, started, seconds, functions, packages, stats)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?);",
+            (
+                mode,
+                f"{socket.gethostname()}:{os.getpid()}",
+                started,
+                seconds,
+                json.dumps([function.__dict__ for function in functions]),
+                json.dumps(packages),
+                stats,
+            ),
+        )
+        db.execute(
+            "DELETE FROM profiles WHERE id NOT IN (SELECT id FROM profiles ORDER BY id DESC LIMIT ?);",
+            (MAX_PROFILES,),
+        )
+    return cursor.lastrowid or 0
+
+
+def get_profiles(reader: Reader) -> list[Profile]:
+    """Get every saved profile without its functions, newest first."""
+    rows = get_db(reader).execute("SELECT id, mode, process, started, seconds FROM profiles ORDER BY id DESC;")
+    return [Profile(*row) for row in rows]
+
+
+def get_profile(reader: Reader, profile_id: int) -> Profile | None:
+    """Get a saved profile, or None if it doesn't exist."""
+    row = (
+        get_db(reader)
+        .execute(
+            "SELECT id, mode, process, started, seconds, functions, packages FROM profiles WHERE id = ?;",
+            (profile_id,),
+        )
+        .fetchone()
+    )
+    if row is None:
+        return None
+
+    *columns, functions, packages = row
+    return Profile(
+        *columns,
+        functions=[FunctionStats(**function) for function in json.loads(functions)],
+        packages=json.loads(packages),
+    )
+
+
+def get_profile_stats(reader: Reader, profile_id: int) -> bytes | None:
+    """Get the whole cProfile profile in the pstats format, or None if it was a sampling profile."""
+    row = get_db(reader).execute("SELECT stats FROM profiles WHERE id = ?;", (profile_id,)).fetchone()
+    return row[0] if row else None
+
+
+def profile_cycle(reader: Reader, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:  # noqa: ANN401
+    """Check for new tweets, and profile it if profiles have been requested with request_profiles().
+
+    The profiles are shown at /debug.
+
+    Args:
+        reader: The reader whose database the requests and profiles are in.
+        func: The function that checks for new tweets.
+        *args: The arguments to call it with.
+        **kwargs: The keyword arguments to call it with.
+
+    Returns:
+        What the function returned.
+    """
+    try:
+        mode: ProfileMode | None = take_profile_request(reader)
+    except sqlite3.Error:
+        logger.exception("Failed to check if this check for new tweets should be profiled")
+        mode = None
+
+    if mode is None:
+        return func(*args, **kwargs)
+
+    logger.info("Profiling this check for new tweets with {}", mode)
+    started: float = time.time()
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        sampler = SamplingProfiler()
+        sampler.start()
+
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stats: bytes | None = None
+        if mode == "cprofile":
+            profiler.disable()
+            functions, packages = get_cprofile_stats(profiler)
+            stats = marshal.dumps(pstats.Stats(profiler).stats)  # type: ignore  # noqa: PGH003
+        else:
+            sampler.stop()
+            functions, packages = sampler.get_stats()
+
+        try:
+            profile_id: int = save_profile(reader, mode, started, time.time() - started, functions, packages, stats)
+            logger.info("Saved profile {}, see /debug/profiles/{}", profile_id, profile_id)
+        except sqlite3.Error:
+            logger.exception("Failed to save the profile")
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class RateLimitBucket:
+    """What Discord has told us about one of its rate limit buckets.
+
+    https://discord.com/developers/docs/topics/rate-limits#header-format
+    """
+
+    name: str
+    limit: int | None = None
+    remaining: int | None = None
+
+    # Unix time when the bucket is refilled
+    reset_at: float = 0.0
+
+    # The webhooks that share this bucket
+    webhooks: set[str] = field(default_factory=set)
+
+    # How many requests we have sent and how many of them got a 429
+    sent: int = 0
+    rate_limited: int = 0
+
+    def wait_time(self: "RateLimitBucket", now: float) -> float:
+        """How many seconds we have to wait before we can send another request."""
+        if self.remaining is None or self.remaining > 0:
+            return 0.0
+        return max(0.0, self.reset_at - now)
+
+
+def redact_webhook(url: str) -> str:
+    """Remove the token from a webhook URL so we can show it to the user."""
+    return url.rsplit("/", 1)[0]
+
+
+class RateLimiter:
+    """Keep track of Discord's rate limit buckets for every webhook we send to.
+
+    Webhooks start in a bucket of their own, named after the webhook URL, and are moved to the bucket from the
+    X-RateLimit-Bucket header once Discord has responded.
+    """
+
+    def __init__(self: "RateLimiter") -> None:
+        self._lock = threading.Lock()
+        self._buckets: dict[str, RateLimitBucket] = {}
+        self._webhook_buckets: dict[str, str] = {}
+
+        # Unix time when the global rate limit is over
+        self._global_reset_at: float = 0.0
+
+    def _get_bucket(self: "RateLimiter", url: str) -> RateLimitBucket:
+        name: str = self._webhook_buckets.get(url, url)
+        bucket: RateLimitBucket = self._buckets.setdefault(name, RateLimitBucket(name=name))
+        bucket.webhooks.add(url)
+        return bucket
+
+    def acquire(self: "RateLimiter", url: str) -> float:
+        """Reserve a request for a webhook.
+
+        Args:
+            url: The webhook URL.
+
+        Returns:
+            0 if the request can be sent now, otherwise how many seconds until it can be sent.
+        """
+        with self._lock:
+            now: float = time.time()
+            bucket: RateLimitBucket = self._get_bucket(url)
+
+            # The bucket has been refilled since we last heard from Discord
+            if bucket.reset_at <= now and bucket.limit is not None:
+                bucket.remaining = bucket.limit
+
+            wait: float = max(self._global_reset_at - now, bucket.wait_time(now))
+            if wait > 0:
+                return wait
+
+            if bucket.remaining is not None:
+                bucket.remaining -= 1
+            return 0.0
+
+    def update(self: "RateLimiter", url: str, status_code: int | None, headers: Mapping[str, str]) -> None:
+        """Update the bucket of a webhook from the headers Discord sent us.
+
+        Args:
+            url: The webhook URL.
+            status_code: The status code Discord responded with. None if the request failed.
+            headers: The response headers. Their names are case-insensitive.
+        """
+        headers = {name.lower(): value for name, value in headers.items()}
+        with self._lock:
+            now: float = time.time()
+
+            name: str | None = headers.get("x-ratelimit-bucket")
+            old_name: str = self._webhook_buckets.get(url, url)
+            if name and name != old_name:
+                if old_bucket := self._buckets.get(old_name):
+                    old_bucket.webhooks.discard(url)
+                    if not old_bucket.webhooks:
+                        del self._buckets[old_name]
+                self._webhook_buckets[url] = name
+
+            bucket: RateLimitBucket = self._get_bucket(url)
+            bucket.sent += 1
+
+            if limit := headers.get("x-ratelimit-limit"):
+                bucket.limit = int(limit)
+            if remaining := headers.get("x-ratelimit-remaining"):
+                bucket.remaining = int(remaining)
+            if reset_after := headers.get("x-ratelimit-reset-after"):
+                bucket.reset_at = now + float(reset_after)
+
+            if status_code == 429:  # noqa: PLR2004
+                bucket.rate_limited += 1
+                retry_after: float = float(headers.get("retry-after", 1))
+                if headers.get("x-ratelimit-global") == "true":
+                    self._global_reset_at = now + retry_after
+                else:
+                    bucket.remaining = 0
+                    bucket.reset_at = max(bucket.reset_at, now + retry_after)
+
+    def get_state(self: "RateLimiter") -> dict[str, Any]:
+        """Get the current state of every bucket.
+
+        Returns:
+            The global rate limit and every bucket, with the tokens removed from the webhook URLs.
+        """
+        with self._lock:
+            now: float = time.time()
+            return {
+                "global_wait": round(max(0.0, self._global_reset_at - now), 3),
+                "buckets": [
+                    {
+                        "name": redact_webhook(bucket.name) if bucket.name in bucket.webhooks else bucket.name,
+                        "webhooks": sorted(redact_webhook(url) for url in bucket.webhooks),
+                        "limit": bucket.limit,
+                        "remaining": bucket.remaining,
+                        "wait": round(bucket.wait_time(now), 3),
+                        "sent": bucket.sent,
+                        "rate_limited": bucket.rate_limited,
+                    }
+                    for bucket in self._buckets.values()
+                ],
+            }
@@ -5,6 +5,9 @@ from pathlib import Path
 from loguru import logger
 from reader import Reader, make_reader
 
+from discord_twitter_webhooks.avatar import avatar_plugin
+from discord_twitter_webhooks.nitter import nitter_plugin
+
 
 def get_data_location() -> Path:
     """Get the data location where the database file is stored.
@@ -71,7 +74,7 @@ def get_reader(db_location: Path | None = None) -> Reader:
             gid=Path.group(db_location),
         )
 
-    reader: Reader = make_reader(url=str(db_file))
+    reader: Reader = make_reader(url=str(db_file), plugins=[nitter_plugin, avatar_plugin])
     if reader is None:
         msg = f"Failed to create reader\ndb_location: {db_location}\ndb_file: {db_file}"
         raise RuntimeError(msg)
@@ -1,47 +1,63 @@
 import re
-import tempfile
-from functools import lru_cache
-from pathlib import Path
-from typing import TYPE_CHECKING
-
-import requests
-from bs4 import BeautifulSoup
-from defusedxml import ElementTree
+from collections import defaultdict
+from collections.abc import Callable
+from datetime import datetime
+
 from discord_webhook import DiscordEmbed, DiscordWebhook
 from loguru import logger
-from moviepy.editor import VideoFileClip
 from reader import Entry, Reader
 from reader.types import EntryLike
-from requests import request
 
-from discord_twitter_webhooks._dataclasses import Group, get_app_settings, get_group
+from discord_twitter_webhooks._dataclasses import Group, get_app_settings, get_groups
+from discord_twitter_webhooks.avatar import get_avatar
+from discord_twitter_webhooks.delivery import get_scheduler
+from discord_twitter_webhooks.metrics import Counter
+from discord_twitter_webhooks.outbox import add_to_outbox
+from discord_twitter_webhooks.parsed_entry import ParsedEntry, clear_parse_cache, parse_entry
+from discord_twitter_webhooks.polling import update_due_feeds
 from discord_twitter_webhooks.reader_settings import get_reader
-from discord_twitter_webhooks.tweet_text import get_tweet_text
-from discord_twitter_webhooks.whitelist import check_word_in_string_regex
-
-if TYPE_CHECKING:
-    from xml.etree.ElementTree import Element
-
-    from requests import Response
-
-
-def send_webhook(webhook: DiscordWebhook, entry: Entry | EntryLike, group: Group) -> None:
+from discord_twitter_webhooks.storage import set_entries_read
+from discord_twitter_webhooks.tweet_text import clear_render_cache, get_tweet_text, prefetch_translations
+from discord_twitter_webhooks.video import convert_video
+from discord_twitter_webhooks.watermark import get_watermark, is_older_than_watermark, set_watermark
+from discord_twitter_webhooks.whitelist import compile_filter
+
+ENTRIES_FILTERED = Counter(
+    "dtw_entries_filtered_total",
+    "Times a group didn't get a tweet because of its settings, e.g. because it is a reply.",
+)
+ENTRIES_SKIPPED = Counter(
+    "dtw_entries_skipped_total",
+    "New tweets that weren't sent to any group, by why.",
+    labelnames=("reason",),
+)
+ENTRIES_QUEUED = Counter("dtw_entries_queued_total", "New tweets that were put in the outbox to be sent.")
+
+
+def send_webhook(
+    webhook: DiscordWebhook,
+    entry: Entry | EntryLike,
+    group: Group,
+    message: str,
+    attachments: dict[str, str] | None = None,
+    *,
+    batch: bool = False,
+) -> None:
     """Send a webhook to Discord.
 
+    The message is saved in the outbox for every webhook in the group and sent in the background, see outbox.py.
+
     Args:
         webhook: The webhook to send.
         entry: The entry to send.
         group: The settings to use.
+        message: What kind of message it is, e.g. "embed". The same message is only sent once per entry and group.
+        attachments: Videos to attach as GIFs, by filename.
+        batch: Combine the message with the messages sent right after it, see outbox.Batch.
     """
-    for _webhook in group.webhooks:
-        logger.debug("Webhook URL: {}", _webhook)
-        webhook.url = _webhook
-        response: Response = webhook.execute()
-
-        if response.ok:
-            logger.info("Webhook posted for {}", entry.link)
-        else:
-            logger.error(f"Got {response.status_code} from {webhook}. Response: {response.text}")
+    reader: Reader = get_reader()
+    get_scheduler().concurrency = get_app_settings(reader).webhook_concurrency
+    add_to_outbox(reader, entry, f"{group.uuid}/{message}", webhook, group.webhooks, attachments, batch=batch)
 
 
 def send_text(entry: Entry | EntryLike, group: Group) -> None:
@@ -77,66 +93,26 @@ def send_text(entry: Entry | EntryLike, group: Group) -> None:
     # Send the tweet text to Discord
     webhook.content = tweet_text
 
-    send_webhook(webhook, entry, group)
-
-
-@lru_cache(maxsize=128)
-def get_avatar(rss_feed: str) -> str:
-    """Get the avatar of the embed.
-
-    Returns:
-        The avatar of the embed as an int.
-    """
-    default_avatar: str = "https://pbs.twimg.com/profile_images/1354479643882004483/Btnfm47p_400x400.jpg"
-    # Go to the RSS feed and get the avatar
-    try:
-        response: Response = request("GET", rss_feed, timeout=5)
-    except requests.exceptions.ReadTimeout as e:
-        logger.error("Read timeout for {} - {}", rss_feed, e)
-        return default_avatar
-
-    if not response.ok:
-        logger.error(f"Got {response.status_code} from {rss_feed}. Response: {response.text}")
-        return default_avatar
-
-    # Parse XML and get the avatar
-    xml_data: str = response.content.decode("utf-8")
-
-    try:
-        root: Element = ElementTree.fromstring(xml_data)
-        found: Element | None = root.find("channel/image/url")
-    except ElementTree.ParseError:
-        logger.error("Unable to parse XML from {}", rss_feed)
-        return default_avatar
-
-    return found.text or default_avatar if found is not None else default_avatar
+    send_webhook(webhook, entry, group, "text")
 
 
-def create_image_embeds(entry_summary: str, entry_link: str) -> list[DiscordEmbed]:
-    """Get the images from the entry and create embeds from them.
+def create_image_embeds(images: list[str], entry_link: str) -> list[DiscordEmbed]:
+    """Create embeds from the images of the entry.
 
     We can unofficially have up to 4 images in an embed.
     https://github.com/lovvskillz/python-discord-webhook/issues/126
 
     Args:
-        entry_summary: The tweet text from the RSS feed. This is HTML.
+        images: The image URLs from the tweet, see parsed_entry.py.
         entry_link: The link to the entry.
 
     Returns:
         A list of embeds.
     """
-    if not entry_summary:
-        return []
-
     embeds: list[DiscordEmbed] = []
-    urls = re.findall('src="(https?://[^"]+)"', entry_summary)
-
-    if not urls:
-        return embeds
-
-    for i in range(1, min(len(urls), 4) + 1):
+    for url in [image for image in images if image.startswith(("http://", "https://"))][:4]:
         embed = DiscordEmbed(url=entry_link)
-        embed.set_image(url=urls[i - 1])
+        embed.set_image(url=url)
         embeds.append(embed)
 
     return embeds
@@ -160,53 +136,33 @@ def send_embed(entry: Entry | EntryLike, group: Group) -> None:
     name_username = entry.feed.title.split(" / @")
 
     entry_author = f"{name_username[0]} (@{name_username[1]})"
-    author_avatar = get_avatar(entry.feed_url)
+    author_avatar = get_avatar(get_reader(), entry.feed_url)
 
     embed.set_author(name=entry_author, url=entry_link, icon_url=author_avatar)
     embed.set_timestamp(timestamp=entry.published.timestamp())
     embed.set_color("1DA1F2")
     embed.set_footer(text="Twitter", icon_url="https://abs.twimg.com/icons/apple-touch-icon-192x192.png")
 
-    if embeds := create_image_embeds(entry.summary, entry_link):
+    parsed: ParsedEntry = parse_entry(entry)
+    if embeds := create_image_embeds(parsed.images, entry_link):
         # Only do this if more than one image is found
         if len(embeds) > 1:
             embeds.insert(0, embed)
-            webhook = DiscordWebhook(url=entry_link, embeds=embeds, rate_limit_retry=True)  # type: ignore  # noqa: PGH003, E501
+            webhook = DiscordWebhook(url=entry_link, embeds=embeds)  # type: ignore  # noqa: PGH003
         else:
             if embeds[0].image:
                 image = embeds[0].image
                 embed.set_image(image["url"])
-            webhook = DiscordWebhook(url=entry_link, rate_limit_retry=True)
+            webhook = DiscordWebhook(url=entry_link)
             webhook.add_embed(embed)
     else:
-        webhook = DiscordWebhook(url=entry_link, rate_limit_retry=True)
+        webhook = DiscordWebhook(url=entry_link)
         webhook.add_embed(embed)
 
-    # Send a link to the mp4 if it's a video or gif
-    soup: BeautifulSoup = BeautifulSoup(entry.summary, features="lxml")
-    source = soup.find("source", attrs={"type": "video/mp4"})
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-    if source:
-        # Download the mp4
-        response: Response = request("GET", source["src"], timeout=5)
-        if response.ok:
-            with Path.open(Path(temp_file.name), "wb") as f:
-                f.write(response.content)
+    # Attach the video as a gif. It is converted in the background and attached when it is done, see outbox.py
+    attachments: dict[str, str] = {"video.gif": parsed.videos[0]} if parsed.videos else {}
 
-                # Convert the mp4 to a gif
-                VideoFileClip(temp_file.name).write_gif(temp_file.name.replace(".mp4", ".gif"))
-
-                # Add the gif to the webhook
-                with Path.open(Path(temp_file.name.replace(".mp4", ".gif")), "rb") as g:
-                    webhook.add_file(file=g.read(), filename="video.gif")
-                embed.set_image(url="attachment://video.gif")
-
-    send_webhook(webhook, entry, group)
-
-    # Remove our temporary files
-    if Path.exists(Path(temp_file.name)):
-        temp_file.close()
-        Path.unlink(Path(temp_file.name))
+    send_webhook(webhook, entry, group, "embed", attachments, batch=group.batch_embeds)
 
 
 def send_link(entry: Entry | EntryLike, group: Group) -> None:
@@ -225,7 +181,7 @@ def send_link(entry: Entry | EntryLike, group: Group) -> None:
         entry_link = entry_link.replace(get_app_settings(get_reader()).nitter_instance, "https://twitter.com")
         entry_link = entry_link.rstrip("#m")
 
-    send_webhook(DiscordWebhook(url="", content=f"{entry_link}"), entry, group)
+    send_webhook(DiscordWebhook(url="", content=f"{entry_link}"), entry, group, "link")
 
 
 def has_media(entry: Entry | EntryLike) -> bool:
@@ -237,10 +193,7 @@ def has_media(entry: Entry | EntryLike) -> bool:
     Returns:
         True if the entry has media, False otherwise.
     """
-    soup: BeautifulSoup = BeautifulSoup(entry.summary, features="lxml")
-    video_files = bool(soup.find("source", attrs={"type": "video/mp4"}))
-    images = bool(soup.find("img"))
-    return video_files or images
+    return parse_entry(entry).has_media
 
 
 def whitelisted(group: Group, entry: Entry | EntryLike) -> bool:
@@ -253,11 +206,7 @@ def whitelisted(group: Group, entry: Entry | EntryLike) -> bool:
     Returns:
         True if the entry is whitelisted, False otherwise.
     """
-    for word in group.whitelist:
-        if word.lower() in entry.title.lower():
-            return True
-
-    return any(check_word_in_string_regex(entry.title, regex_pattern) for regex_pattern in group.whitelist_regex)
+    return compile_filter(tuple(group.whitelist), tuple(group.whitelist_regex)).matches(entry.title)
 
 
 def blacklisted(group: Group, entry: Entry | EntryLike) -> bool:
@@ -270,91 +219,158 @@ def blacklisted(group: Group, entry: Entry | EntryLike) -> bool:
     Returns:
         True if the entry is blacklisted, False otherwise.
     """
-    for word in group.blacklist:
-        if word.lower() in entry.title.lower():
-            return True
+    return compile_filter(tuple(group.blacklist), tuple(group.blacklist_regex)).matches(entry.title)
+
+
+def get_skip_reason(group: Group, entry: Entry | EntryLike) -> str | None:
+    """Check if the entry should be skipped for the group.
+
+    Args:
+        group: The group to check.
+        entry: The entry to check.
+
+    Returns:
+        Why the entry should be skipped, or None if it should be sent.
+    """
+    if group.whitelist_enabled and not whitelisted(group, entry):
+        return "it is not whitelisted"
+
+    if group.blacklist_enabled and blacklisted(group, entry):
+        return "it is blacklisted"
+
+    if not group.send_retweets and entry.title.startswith("RT by "):
+        return "it is a retweet"
+
+    if not group.send_replies and entry.title.startswith("R to "):
+        return "it is a reply"
+
+    if group.only_send_if_media and not has_media(entry):
+        return "it has no media attached"
+
+    return None
+
 
-    return any(check_word_in_string_regex(entry.title, regex_pattern) for regex_pattern in group.blacklist_regex)
+def get_groups_by_feed(groups: list[Group]) -> dict[str, list[Group]]:
+    """Build an index from RSS feed URL to the groups that are subscribed to it.
 
+    Args:
+        groups: The groups to index.
+
+    Returns:
+        A dict with the RSS feed URL as key and the groups using that feed as value.
+    """
+    groups_by_feed: dict[str, list[Group]] = defaultdict(list)
+    for group in groups:
+        for rss_feed in dict.fromkeys(group.rss_feeds):
+            groups_by_feed[rss_feed].append(group)
+    return dict(groups_by_feed)
 
-def send_to_discord(reader: Reader) -> None:  # noqa: C901, PLR0912
+
+def send_to_discord(reader: Reader, feed_filter: Callable[[str], bool] | None = None) -> None:
     """Send all new entries to Discord.
 
     This is called by the scheduler every 15 minutes. It will check for new entries and send them to Discord.
 
     Args:
         reader: The reader which contains the entries.
+        feed_filter: Only look at the feeds this returns True for. Used by the workers to only look at their own
+            feeds, see workers.py.
     """
-    reader.update_feeds(workers=4)
+    # Only update the feeds that are due, see polling.py
+    update_due_feeds(reader, feed_filter=feed_filter)
 
     # Loop through the unread (unsent) entries.
-    entries = list(reader.get_entries(read=False))
+    entries = [
+        entry for entry in reader.get_entries(read=False) if feed_filter is None or feed_filter(entry.feed_url)
+    ]
 
     if not entries:
         return
 
+    # Every entry is only parsed once per cycle, and only rendered once for groups with the same rendering settings.
+    clear_parse_cache()
+    clear_render_cache()
+
+    # Load every group once per cycle instead of once per entry.
+    groups_by_feed: dict[str, list[Group]] = get_groups_by_feed(get_groups(reader))
+
+    # Watermarks are read once per feed and cycle, see watermark.py.
+    watermarks: dict[str, datetime | None] = {}
+
+    # Feeds we haven't seen before. Their entries are marked as read instead of being sent.
+    new_feeds: set[str] = set()
+
+    # The entries we will send and the groups we will send them to
+    to_send: list[tuple[Entry | EntryLike, list[Group]]] = []
+
+    # The entries we won't send. They are marked as read together, see storage.py
+    skipped: list[Entry | EntryLike] = []
+
     entry: Entry | EntryLike
     for entry in entries:
-        # Don't send tweets that are older than the oldest tweet we have
-        the_oldest_tweet = reader.get_entries(read=True)
-
-        if not the_oldest_tweet:
-            # Related: https://github.com/TheLovinator1/discord-twitter-webhooks/issues/132
-            # Get and mark every entry as read
-            _entry: Entry | EntryLike
-            for _entry in reader.get_entries(read=False):
-                reader.mark_entry_as_read(_entry)
+        if entry.feed_url not in watermarks:
+            watermark: datetime | None = get_watermark(reader, entry.feed_url)
+            if watermark is None:
+                # Feeds added before watermarks existed get one from the entries we already sent.
+                watermark = set_watermark(reader, entry.feed_url, reader.get_entries(feed=entry.feed_url, read=True))
+
+            if watermark is None:
+                # Related: https://github.com/TheLovinator1/discord-twitter-webhooks/issues/132
+                # We have no tweets for this feed, so don't spam Discord with every tweet in it.
+                logger.info("Marking every entry in {} as read as it is a new feed", entry.feed_url)
+                watermark = set_watermark(reader, entry.feed_url, reader.get_entries(feed=entry.feed_url))
+                new_feeds.add(entry.feed_url)
+
+            watermarks[entry.feed_url] = watermark
+
+        if entry.feed_url in new_feeds:
+            ENTRIES_SKIPPED.inc(reason="new_feed")
+            skipped.append(entry)
             continue
 
-        # Sort the tweets by date
-        the_oldest_tweet = sorted(the_oldest_tweet, key=lambda x: x.published)
-
         # Check if the entry is older than the oldest tweet we have
-        if entry.published < the_oldest_tweet[0].published:
+        if is_older_than_watermark(entry, watermarks[entry.feed_url]):
             # Related: https://github.com/TheLovinator1/discord-twitter-webhooks/issues/129#issuecomment-1646086754
             logger.info("Skipping entry {} as it is older than the oldest tweet we have", entry)
-            reader.mark_entry_as_read(entry)
+            ENTRIES_SKIPPED.inc(reason="old")
+            skipped.append(entry)
             continue
 
-        for _group in reader.get_tag((), "groups", []):
-            group = get_group(reader, str(_group))
-            if not group:
-                logger.error("Group {} not found", _group)
+        # Only visit the groups that are subscribed to the feed this entry came from.
+        groups: list[Group] = []
+        for group in groups_by_feed.get(entry.feed_url, []):
+            if skip_reason := get_skip_reason(group, entry):
+                logger.info(f"Skipping entry {entry} for group {group.name} as {skip_reason}")
+                ENTRIES_FILTERED.inc()
                 continue
+            groups.append(group)
 
-            for feeds in group.rss_feeds:
-                if group.whitelist_enabled and not whitelisted(group, entry):
-                    logger.info(f"Skipping entry {entry} as it is not whitelisted")
-                    reader.mark_entry_as_read(entry)
-                    continue
-
-                if group.blacklist_enabled and blacklisted(group, entry):
-                    logger.info(f"Skipping entry {entry} as it is blacklisted")
-                    reader.mark_entry_as_read(entry)
-                    continue
-
-                if not group.send_retweets and entry.title.startswith("RT by "):
-                    logger.info(f"Skipping entry {entry} as it is a retweet")
-                    reader.mark_entry_as_read(entry)
-                    continue
-
-                if not group.send_replies and entry.title.startswith("R to "):
-                    logger.info(f"Skipping entry {entry} as it is a reply")
-                    reader.mark_entry_as_read(entry)
-                    continue
-
-                if group.only_send_if_media and not has_media(entry):
-                    logger.info(f"Skipping entry {entry} as it has no media attached")
-                    reader.mark_entry_as_read(entry)
-                    continue
-
-                if entry.feed_url == feeds:
-                    if group.send_as_link:
-                        send_link(entry=entry, group=group)
-                    if group.send_as_text:
-                        send_text(entry=entry, group=group)
-                    if group.send_as_embed:
-                        send_embed(entry=entry, group=group)
-
-                    # Mark the entry as read (sent)
-                    reader.mark_entry_as_read(entry)
+        if groups:
+            ENTRIES_QUEUED.inc()
+            to_send.append((entry, groups))
+        else:
+            ENTRIES_SKIPPED.inc(reason="filtered")
+            skipped.append(entry)
+
+    set_entries_read(reader, skipped, read=True)
+
+    # Translate everything we are going to send at once instead of one tweet at a time
+    prefetch_translations(to_send)
+
+    # Start converting the videos now, so they are converted while we send the tweets before them
+    for entry, groups in to_send:
+        parsed: ParsedEntry = parse_entry(entry)
+        if parsed.videos and any(group.send_as_embed for group in groups):
+            convert_video(parsed.videos[0])
+
+    for entry, groups in to_send:
+        for group in groups:
+            if group.send_as_link:
+                send_link(entry=entry, group=group)
+            if group.send_as_text:
+                send_text(entry=entry, group=group)
+            if group.send_as_embed:
+                send_embed(entry=entry, group=group)
+
+    # Mark the entries as read. They are in the outbox now and are sent in the background, see outbox.py
+    set_entries_read(reader, [entry for entry, _ in to_send], read=True)
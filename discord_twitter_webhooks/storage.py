@@ -0,0 +1,228 @@
+import sqlite3
+import threading
+from collections.abc import Iterable
+from datetime import datetime, timezone
+from weakref import WeakSet
+
+from reader import Entry, Reader
+from reader.types import EntryLike
+
+# Our own tables. They are stored in the same database as the reader's feeds and entries.
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS translation_cache (
+    key TEXT PRIMARY KEY NOT NULL,
+    translation TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS translation_cache_by_last_used ON translation_cache (last_used);
+CREATE TABLE IF NOT EXISTS group_feeds (
+    group_uuid TEXT NOT NULL,
+    feed_url TEXT NOT NULL,
+    PRIMARY KEY (group_uuid, feed_url)
+);
+CREATE INDEX IF NOT EXISTS group_feeds_by_feed ON group_feeds (feed_url);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    feed_url TEXT NOT NULL,
+    entry_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    webhook TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attachments TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL,
+    last_error TEXT,
+    created REAL NOT NULL,
+    batch INTEGER NOT NULL DEFAULT 0,
+    claimed_until REAL,
+    UNIQUE (feed_url, entry_id, message, webhook)
+);
+CREATE INDEX IF NOT EXISTS outbox_by_next_attempt ON outbox (next_attempt);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY NOT NULL,
+    worker TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS worker_metrics (
+    worker TEXT PRIMARY KEY NOT NULL,
+    metrics TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profile_requests (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    mode TEXT NOT NULL,
+    remaining INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mode TEXT NOT NULL,
+    process TEXT NOT NULL,
+    started REAL NOT NULL,
+    seconds REAL NOT NULL,
+    functions TEXT NOT NULL,
+    packages TEXT NOT NULL,
+    stats BLOB
+);
+CREATE TABLE IF NOT EXISTS cycles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    process TEXT NOT NULL,
+    started REAL NOT NULL,
+    seconds REAL NOT NULL,
+    delay INTEGER NOT NULL
+);
+"""
+
+# Readers we have already created our tables for
+_ready: WeakSet[Reader] = WeakSet()
+_ready_lock = threading.Lock()
+
+
+def get_db(reader: Reader) -> sqlite3.Connection:
+    """Get the database connection the reader uses in this thread.
+
+    We use the reader's own connection instead of opening a second one to the same file, so our writes and the
+    reader's writes never have to wait for each other's locks. Use it as a context manager to commit.
+
+    Args:
+        reader: The reader.
+
+    Returns:
+        The connection, with our tables created.
+    """
+    db: sqlite3.Connection = reader._storage.get_db()  # noqa: SLF001
+
+    if reader not in _ready:
+        with _ready_lock:
+            if reader not in _ready:
+                had_group_feeds: bool = bool(
+                    db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'group_feeds';").fetchone(),
+                )
+                with db:
+                    db.executescript(SCHEMA)
+                    migrate_outbox(db)
+                if not had_group_feeds:
+                    migrate_group_feeds(reader, db)
+                _ready.add(reader)
+
+    return db
+
+
+def migrate_outbox(db: sqlite3.Connection) -> None:
+    """Add the columns that were added to the outbox after it was created."""
+    columns: set[str] = {row[1] for row in db.execute("PRAGMA table_info(outbox);")}
+    if "batch" not in columns:
+        db.execute("ALTER TABLE outbox ADD COLUMN batch INTEGER NOT NULL DEFAULT 0;")
+    if "claimed_until" not in columns:
+        db.execute("ALTER TABLE outbox ADD COLUMN claimed_until REAL;")
+
+
+def migrate_group_feeds(reader: Reader, db: sqlite3.Connection) -> None:
+    """Fill the group_feeds table from the "groups" tags we used to keep on every feed."""
+    rows: list[tuple[str, str]] = [
+        (group_uuid, feed.url) for feed in reader.get_feeds() for group_uuid in reader.get_tag(feed, "groups", [])
+    ]
+    with db:
+        db.executemany("INSERT OR IGNORE INTO group_feeds (group_uuid, feed_url) VALUES (?, ?);", rows)
+
+
+def set_group_feeds(reader: Reader, group_uuid: str, feed_urls: Iterable[str]) -> None:
+    """Replace the feeds a group uses.
+
+    Args:
+        reader: The reader the group is in.
+        group_uuid: The group.
+        feed_urls: Every feed the group uses.
+    """
+    with get_db(reader) as db:
+        db.execute("DELETE FROM group_feeds WHERE group_uuid = ?;", (group_uuid,))
+        db.executemany(
+            "INSERT OR IGNORE INTO group_feeds (group_uuid, feed_url) VALUES (?, ?);",
+            [(group_uuid, feed_url) for feed_url in feed_urls],
+        )
+
+
+def get_feed_groups(reader: Reader, feed_url: str) -> list[str]:
+    """Get the groups that use a feed."""
+    rows = get_db(reader).execute("SELECT group_uuid FROM group_feeds WHERE feed_url = ?;", (feed_url,))
+    return [group_uuid for (group_uuid,) in rows]
+
+
+def remove_group_feeds(reader: Reader, group_uuid: str) -> list[str]:
+    """Remove a group from the feeds it uses.
+
+    Args:
+        reader: The reader the group is in.
+        group_uuid: The group.
+
+    Returns:
+        The feeds no other group uses. They can be removed from the reader.
+    """
+    with get_db(reader) as db:
+        orphans = db.execute(
+            """
+            SELECT feed_url FROM group_feeds AS ours
+            WHERE group_uuid = :group_uuid AND NOT EXISTS (
+                SELECT 1 FROM group_feeds AS theirs
+                WHERE theirs.feed_url = ours.feed_url AND theirs.group_uuid != :group_uuid
+            );
+            """,
+            {"group_uuid": group_uuid},
+        ).fetchall()
+        db.execute("DELETE FROM group_feeds WHERE group_uuid = ?;", (group_uuid,))
+    return [feed_url for (feed_url,) in orphans]
+
+
+def get_timestamp() -> str:
+    """Get the current time the way reader stores it."""
+    return datetime.now(tz=timezone.utc).replace(tzinfo=None).isoformat(" ")
+
+
+def set_entries_read(reader: Reader, entries: Iterable[Entry | EntryLike], *, read: bool) -> int:
+    """Mark entries as read or unread in one transaction.
+
+    This does the same as calling reader.set_entry_read() for every entry, without committing after every entry.
+    It writes to reader's own entries table, which isn't part of its API, so reader is pinned to the version this
+    was tested with in pyproject.toml, see test_reader_entries_schema().
+
+    Args:
+        reader: The reader the entries are in.
+        entries: The entries to mark.
+        read: Mark the entries as read if True, and as unread otherwise.
+
+    Returns:
+        How many entries were marked.
+    """
+    keys: list[tuple[str, str]] = [(entry.feed_url, entry.id) for entry in entries]
+    if not keys:
+        return 0
+
+    modified: str = get_timestamp()
+    with get_db(reader) as db:
+        cursor: sqlite3.Cursor = db.executemany(
+            "UPDATE entries SET read = ?, read_modified = ? WHERE feed = ? AND id = ?;",
+            [(read, modified, feed_url, entry_id) for feed_url, entry_id in keys],
+        )
+    return cursor.rowcount
+
+
+def set_feed_read(reader: Reader, feed_url: str, *, read: bool) -> int:
+    """Mark every entry in a feed as read or unread in one transaction.
+
+    Args:
+        reader: The reader the feed is in.
+        feed_url: The URL of the feed.
+        read: Mark the entries as read if True, and as unread otherwise.
+
+    Returns:
+        How many entries were marked.
+    """
+    with get_db(reader) as db:
+        cursor: sqlite3.Cursor = db.execute(
+            "UPDATE entries SET read = ?, read_modified = ? WHERE feed = ? AND read != ?;",
+            (read, get_timestamp(), feed_url, read),
+        )
+    return cursor.rowcount
@@ -1,8 +1,25 @@
+import hashlib
+import time
+from functools import lru_cache
+
 import deepl
 from loguru import logger
+from reader import Reader
 
 from discord_twitter_webhooks._dataclasses import get_app_settings
+from discord_twitter_webhooks.metrics import Histogram
 from discord_twitter_webhooks.reader_settings import get_reader
+from discord_twitter_webhooks.storage import get_db
+
+# How big the translation cache can get in bytes before the least recently used translations are removed
+MAX_TRANSLATION_CACHE_SIZE: int = 10 * 1024 * 1024
+
+# How many texts DeepL accepts in one request
+DEEPL_MAX_TEXTS: int = 50
+
+# Observed once per text. The time of a batch is split evenly between its texts, so the sum is still the time spent.
+TRANSLATE_SECONDS = Histogram("dtw_translate_seconds", "Time spent translating a tweet, including cached translations.")
+DEEPL_REQUEST_SECONDS = Histogram("dtw_deepl_request_seconds", "Time spent waiting for DeepL to translate.")
 
 _languages = {
     "bg": "Bulgarian",
@@ -46,27 +63,138 @@ languages_to["pt-BR"] = "Portuguese (Brazilian)"
 languages_to["pt-PT"] = "Portuguese (European)"
 
 
-def translate_html(html: str, translate_from: str | None = "auto", translate_to: languages_to = "en") -> str:
-    """Translate HTML text to another language."""
-    if translate_from == "auto":
-        logger.debug("Auto-detecting language when translating.")
-        translate_from = None
+@lru_cache(maxsize=1)
+def get_translator(auth_key: str) -> deepl.Translator:
+    """Get a DeepL translator. The same translator is reused until the auth key changes."""
+    return deepl.Translator(auth_key)
 
-    auth_key = get_app_settings(get_reader()).deepl_auth_key
-    if not auth_key:
-        logger.error("No DeepL auth key set. Not translating.")
-        return html
-
-    try:
-        translator = deepl.Translator(auth_key)
-        result = translator.translate_text(
-            html,
-            target_lang=translate_to,
-            source_lang=translate_from,
-            tag_handling="html",
+
+def get_translation_key(html: str, translate_from: str | None, translate_to: str) -> str:
+    """Get the key a translation is cached under."""
+    return hashlib.sha256(f"{translate_from}\0{translate_to}\0{html}".encode()).hexdigest()
+
+
+def get_cached_translations(reader: Reader, keys: list[str]) -> dict[str, str]:
+    """Get translations from the cache.
+
+    Args:
+        reader: The reader whose database the cache is stored in.
+        keys: The keys to look up, see get_translation_key().
+
+    Returns:
+        The translations that were found, by key.
+    """
+    if not keys:
+        return {}
+
+    with get_db(reader) as db:
+        placeholders: str = ", ".join("?" * len(keys))
+        rows = db.execute(f"SELECT key, translation FROM translation_cache WHERE key IN ({placeholders});", keys)  # noqa: S608, E501
+        translations: dict[str, str] = dict(rows.fetchall())
+        db.executemany(
+            "UPDATE translation_cache SET last_used = ? WHERE key = ?;",
+            [(time.time(), key) for key in translations],
+        )
+    return translations
+
+
+def cache_translations(reader: Reader, translations: dict[str, str]) -> None:
+    """Save translations in the cache and remove the least recently used ones if the cache is too big.
+
+    Args:
+        reader: The reader whose database the cache is stored in.
+        translations: The translations to save, by key.
+    """
+    if not translations:
+        return
+
+    now: float = time.time()
+    with get_db(reader) as db:
+        db.executemany(
+            "INSERT OR REPLACE INTO translation_cache (key, translation, size, last_used) VALUES (?, ?, ?, ?);",
+            [(key, text, len(key) + len(text.encode()), now) for key, text in translations.items()],
         )
-    except deepl.exceptions.DeepLException as e:
-        logger.error("Error while translating: {}", e)
-        return html
+        db.execute(
+            """
+            DELETE FROM translation_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS total FROM translation_cache
+                ) WHERE total > ?
+            );
+            """,
+            (MAX_TRANSLATION_CACHE_SIZE,),
+        )
+
+
+def translate_many(
+    texts: list[tuple[str, str | None, str]],
+    reader: Reader | None = None,
+) -> list[str]:
+    """Translate multiple HTML texts.
+
+    Translations are cached in the database. Everything that isn't cached is sent to DeepL with one request per
+    language pair (and per DEEPL_MAX_TEXTS texts).
+
+    Args:
+        texts: (html, translate_from, translate_to) for every text to translate.
+        reader: The reader whose database the cache is stored in.
+
+    Returns:
+        The translations, in the same order as the texts. Texts that failed to translate are returned as-is.
+    """
+    start: float = time.perf_counter()
+    reader = reader or get_reader()
+    normalized: list[tuple[str, str | None, str]] = [
+        (html, None if translate_from == "auto" else translate_from, translate_to)
+        for html, translate_from, translate_to in texts
+    ]
+    keys: list[str] = [get_translation_key(*text) for text in normalized]
+    translations: dict[str, str] = get_cached_translations(reader, list(set(keys)))
+
+    # Group what we don't have by language pair, DeepL only takes one pair per request
+    missing: dict[tuple[str | None, str], dict[str, str]] = {}
+    for key, (html, translate_from, translate_to) in zip(keys, normalized, strict=True):
+        if key not in translations:
+            missing.setdefault((translate_from, translate_to), {})[key] = html
+
+    auth_key: str = get_app_settings(reader).deepl_auth_key
+    if missing and not auth_key:
+        logger.error("No DeepL auth key set. Not translating.")
+        missing = {}
 
-    return result.text
+    new_translations: dict[str, str] = {}
+    for (translate_from, translate_to), htmls in missing.items():
+        if translate_from is None:
+            logger.debug("Auto-detecting language when translating.")
+
+        items: list[tuple[str, str]] = list(htmls.items())
+        for i in range(0, len(items), DEEPL_MAX_TEXTS):
+            chunk: list[tuple[str, str]] = items[i : i + DEEPL_MAX_TEXTS]
+            try:
+                with DEEPL_REQUEST_SECONDS.time():
+                    results = get_translator(auth_key).translate_text(
+                        [html for _, html in chunk],
+                        target_lang=translate_to,
+                        source_lang=translate_from,
+                        tag_handling="html",
+                    )
+            except deepl.exceptions.DeepLException as e:
+                logger.error("Error while translating: {}", e)
+                continue
+
+            for (key, _), result in zip(chunk, results, strict=True):
+                new_translations[key] = result.text
+
+    cache_translations(reader, new_translations)
+    translations.update(new_translations)
+
+    seconds: float = (time.perf_counter() - start) / max(len(texts), 1)
+    for _ in texts:
+        TRANSLATE_SECONDS.observe(seconds)
+
+    return [translations.get(key, html) for key, (html, _, _) in zip(keys, texts, strict=True)]
+
+
+def translate_html(html: str, translate_from: str | None = "auto", translate_to: languages_to = "en") -> str:
+    """Translate HTML text to another language."""
+    return translate_many([(html, translate_from, translate_to)])[0]
@@ -1,11 +1,18 @@
 from html import unescape
 
-from bs4 import BeautifulSoup
 from reader import Entry
+from reader.types import EntryLike
 
 from discord_twitter_webhooks._dataclasses import Group, get_app_settings
+from discord_twitter_webhooks.metrics import Histogram
+from discord_twitter_webhooks.parsed_entry import parse_entry, parse_html
 from discord_twitter_webhooks.reader_settings import get_reader
-from discord_twitter_webhooks.translate import translate_html
+from discord_twitter_webhooks.translate import translate_html, translate_many
+
+# Tweet text we have already rendered, see get_tweet_text()
+_render_cache: dict[tuple, str] = {}
+
+RENDER_SECONDS = Histogram("dtw_render_seconds", "Time spent rendering the text of a tweet for a group.")
 
 
 def convert_html_to_md(html: str, group: Group) -> str:
@@ -18,41 +25,101 @@ def convert_html_to_md(html: str, group: Group) -> str:
     Returns:
         Our markdown.
     """
-    soup: BeautifulSoup = BeautifulSoup(html, features="lxml")
+    return parse_html(html).to_markdown(group.link_destination)
+
 
-    # Used for photos, videos, gifs and tweet cards
-    for image in soup.find_all("img"):
-        image.decompose()
+def get_tweet_html(entry: Entry | EntryLike) -> str:
+    """Get the HTML we render the tweet text from.
+
+    Args:
+        entry: The entry to get the HTML for.
 
-    for link in soup.find_all("a") + soup.find_all("link"):
-        if not link.get_text().strip():
-            link.decompose()
-        else:
-            # TODO: This breaks for https://nitter.lovinator.space/Steam/status/1679694708761669634#m
-            #  and https://nitter.lovinator.space/SteamDB/status/1677217359487021056#m
+    Returns:
+        The summary of the entry, or the title if it has no summary.
+    """
+    # entry.summary has text and HTML tags, entry.title has only text
+    return entry.summary or entry.title or f"Failed to get tweet text for <{entry.link}>"
 
-            # Replace Nitter links with Twitter links
-            if group.link_destination == "Twitter":
-                if link.text.startswith("#") and hasattr(link, "href"):
-                    link["href"] = f"https://twitter.com/hashtag/{link.text[1:]}"
-                elif link.text.startswith("@") and hasattr(link, "href"):
-                    link["href"] = f"https://twitter.com/{link.text[1:]}"
 
-            # Remove the link preview
-            link.replace_with(f"[{link.text}](<{link.get('href')}>)")
+def prefetch_translations(entries: list[tuple[Entry | EntryLike, list[Group]]]) -> None:
+    """Translate every tweet that will be sent to a group with translation enabled, in as few requests as possible.
 
-    clean_soup: BeautifulSoup = BeautifulSoup(str(soup).replace("</p>", "</p>\n"), features="lxml")
+    The translations end up in the translation cache, so get_tweet_text() doesn't have to ask DeepL.
 
-    # Remove all other tags
-    for tag in clean_soup.find_all(True):
-        tag.replace_with(tag.text)
+    Args:
+        entries: The entries that will be sent and the groups they will be sent to.
+    """
+    texts: set[tuple[str, str, str]] = {
+        (get_tweet_html(entry), group.translate_from, group.translate_to)
+        for entry, groups in entries
+        for group in groups
+        if group.translate
+    }
+    if texts:
+        translate_many(list(texts))
+
+
+def get_render_key(entry: Entry | EntryLike, group: Group) -> tuple:
+    """Get the key we cache the rendered tweet text under.
+
+    Only the settings that change how the text looks are part of the key, so groups that render the text the same way
+    share the result.
+
+    Args:
+        entry: The entry to render.
+        group: The settings to use.
+
+    Returns:
+        The cache key.
+    """
+    return (
+        entry.feed_url,
+        entry.id,
+        (group.translate_from, group.translate_to) if group.translate else None,
+        group.link_destination,
+        group.replace_reddit,
+        group.replace_youtube,
+        group.unescape_html,
+        group.remove_copyright,
+    )
 
-    return clean_soup.text.strip()
+
+def clear_render_cache(feed_url: str | None = None) -> None:
+    """Forget rendered tweet texts. This is called at the start of every check for new tweets.
+
+    Args:
+        feed_url: Only forget the tweets of this feed, for example when they are sent again. Everything if None.
+    """
+    if feed_url is None:
+        _render_cache.clear()
+        return
+
+    for key in [key for key in list(_render_cache) if key[0] == feed_url]:
+        _render_cache.pop(key, None)
 
 
 def get_tweet_text(entry: Entry, group: Group) -> str:
     """Get the text to send in the embed.
 
+    The text is only rendered once per entry and rendering settings, see get_render_key().
+
+    Args:
+        entry: The entry to send.
+        group: The settings to use.
+
+    Returns:
+        The text to send in the embed.
+    """
+    key: tuple = get_render_key(entry, group)
+    if key not in _render_cache:
+        with RENDER_SECONDS.time():
+            _render_cache[key] = render_tweet_text(entry, group)
+    return _render_cache[key]
+
+
+def render_tweet_text(entry: Entry, group: Group) -> str:
+    """Render the text to send in the embed.
+
     Args:
         entry: The entry to send.
         group: The settings to use.
@@ -63,15 +130,18 @@ def get_tweet_text(entry: Entry, group: Group) -> str:
     # TODO: We should replace "<p><a href="https://nitter.lovinator.space/User/status/1234#m">nitter.lovinator.space/User/status/1234#m</a></p>" # noqa: E501
     #  in entry.summary with the text from the tweet if it is a retweet or quote tweet.
 
-    # entry.summary has text and HTML tags, entry.title has only text
-    tweet_text: str = entry.summary or entry.title or f"Failed to get tweet text for <{entry.link}>"
+    tweet_text: str = get_tweet_html(entry)
 
     # Translate the tweet text
     if group.translate:
         # TODO: Maybe send the original text as a field or something?
         tweet_text = translate_html(tweet_text, group.translate_from, group.translate_to)
-
-    tweet_text = convert_html_to_md(tweet_text, group)
+        tweet_text = convert_html_to_md(tweet_text, group)
+    elif entry.summary:
+        # Reuse the summary we already parsed for the filters and the images
+        tweet_text = parse_entry(entry).to_markdown(group.link_destination)
+    else:
+        tweet_text = convert_html_to_md(tweet_text, group)
 
     # Teddit/Libreddit
     teddit_instance = get_app_settings(get_reader()).teddit_instance
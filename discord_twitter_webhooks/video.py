@@ -0,0 +1,234 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import requests
+from loguru import logger
+
+from discord_twitter_webhooks.metrics import Histogram
+from discord_twitter_webhooks.reader_settings import get_data_location
+
+# Videos bigger than this are not downloaded
+MAX_VIDEO_SIZE: int = 50 * 1024 * 1024
+
+# Videos longer than this (in seconds) are not converted
+MAX_VIDEO_DURATION: float = 60
+
+# Discord doesn't accept attachments bigger than this from webhooks
+MAX_GIF_SIZE: int = 25 * 1024 * 1024
+
+# How big the GIF cache can get in bytes before the least recently used GIFs are removed
+MAX_GIF_CACHE_SIZE: int = 500 * 1024 * 1024
+
+# How many videos we convert at the same time
+MAX_CONVERSIONS: int = 2
+
+# How many seconds we wait before trying to convert a video that couldn't be converted again
+FAILED_CONVERSION_TTL: float = 60 * 60
+
+# Conversions that are running, by video URL. Used so the same video is only converted once at a time.
+_conversions: dict[str, Future] = {}
+_conversions_lock = threading.Lock()
+
+# When the conversion of a video failed, by video URL. Used so a video that is too long or too big isn't
+# downloaded again every time a message with it is sent.
+_failed_conversions: dict[str, float] = {}
+
+GIF_CONVERSION_SECONDS = Histogram(
+    "dtw_gif_conversion_seconds",
+    "Time spent downloading a video and converting it to a GIF, including waiting for a free process.",
+    labelnames=("result",),
+)
+
+
+@lru_cache(maxsize=1)
+def get_gif_cache_dir() -> Path:
+    """Get the directory the converted GIFs are stored in.
+
+    Returns:
+        The directory, it is created if it doesn't exist.
+    """
+    cache_dir: Path = get_data_location() / "gifs"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+@lru_cache(maxsize=1)
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the processes the videos are downloaded and converted in.
+
+    moviepy keeps a whole core busy for as long as it takes to write the GIF, so it runs in its own processes
+    instead of in the thread that sends the tweets.
+
+    Returns:
+        The process pool.
+    """
+    # Forking a process with threads in it can deadlock, so start new processes instead.
+    return ProcessPoolExecutor(max_workers=MAX_CONVERSIONS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def get_gif_path(video_url: str) -> Path:
+    """Get where the GIF for a video is cached."""
+    return get_gif_cache_dir() / f"{hashlib.sha256(video_url.encode()).hexdigest()}.gif"
+
+
+def download_video(video_url: str, path: Path, max_size: int = MAX_VIDEO_SIZE) -> bool:
+    """Download a video to disk without keeping all of it in memory.
+
+    Args:
+        video_url: The URL of the video.
+        path: Where to save the video.
+        max_size: Stop downloading and return False if the video is bigger than this many bytes.
+
+    Returns:
+        True if the video was downloaded.
+    """
+    try:
+        with requests.get(video_url, stream=True, timeout=10) as response:
+            if not response.ok:
+                logger.error(f"Got {response.status_code} when downloading {video_url}")
+                return False
+
+            if int(response.headers.get("Content-Length", 0)) > max_size:
+                logger.info("Not downloading {} as it is bigger than {} bytes", video_url, max_size)
+                return False
+
+            size: int = 0
+            with path.open("wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    size += len(chunk)
+                    if size > max_size:
+                        logger.info("Stopped downloading {} as it is bigger than {} bytes", video_url, max_size)
+                        return False
+                    f.write(chunk)
+    except requests.RequestException as e:
+        logger.error("Failed to download {} - {}", video_url, e)
+        return False
+
+    return True
+
+
+def make_gif(video_url: str, gif_path: Path) -> Path | None:
+    """Download a video and convert it to a GIF. This runs in the process pool.
+
+    Args:
+        video_url: The URL of the video.
+        gif_path: Where to save the GIF.
+
+    Returns:
+        The path to the GIF, or None if the video couldn't be downloaded or converted.
+    """
+    # moviepy is slow to import, so only import it in the processes that need it
+    from moviepy.editor import VideoFileClip
+
+    # Write to temporary files first so a half written GIF never ends up in the cache
+    video_path: Path = gif_path.with_suffix(f".{os.getpid()}.mp4")
+    temp_gif_path: Path = gif_path.with_suffix(f".{os.getpid()}.tmp.gif")
+    try:
+        if not download_video(video_url, video_path):
+            return None
+
+        with VideoFileClip(str(video_path)) as clip:
+            if clip.duration > MAX_VIDEO_DURATION:
+                logger.info("Not converting {} as it is {} seconds long", video_url, clip.duration)
+                return None
+            clip.write_gif(str(temp_gif_path), logger=None)
+
+        if temp_gif_path.stat().st_size > MAX_GIF_SIZE:
+            logger.info("Not using the GIF for {} as it is too big for Discord", video_url)
+            return None
+
+        temp_gif_path.replace(gif_path)
+        return gif_path
+    except Exception:  # noqa: BLE001
+        logger.exception("Failed to convert {} to a GIF", video_url)
+        return None
+    finally:
+        video_path.unlink(missing_ok=True)
+        temp_gif_path.unlink(missing_ok=True)
+
+
+def evict_gif_cache(cache_dir: Path, max_size: int = MAX_GIF_CACHE_SIZE) -> None:
+    """Remove the least recently used GIFs until the cache is smaller than max_size.
+
+    GIFs that are still being written by a conversion, see make_gif(), are left alone.
+
+    Args:
+        cache_dir: The directory the GIFs are stored in.
+        max_size: How many bytes the cache can use.
+    """
+    gifs: list[tuple[float, int, Path]] = []
+    for gif in cache_dir.glob("*.gif"):
+        if gif.name.endswith(".tmp.gif"):
+            continue
+        try:
+            stat: os.stat_result = gif.stat()
+        except FileNotFoundError:
+            continue
+        gifs.append((stat.st_mtime, stat.st_size, gif))
+
+    total: int = sum(size for _, size, _ in gifs)
+    for _, size, gif in sorted(gifs):
+        if total <= max_size:
+            break
+        gif.unlink(missing_ok=True)
+        total -= size
+
+
+def convert_video(video_url: str) -> Future:
+    """Start converting a video to a GIF in the background.
+
+    The same video is only converted once. If it has been converted before, the GIF from the cache is used, and if
+    it couldn't be converted in the last FAILED_CONVERSION_TTL seconds, it isn't tried again.
+
+    Args:
+        video_url: The URL of the video.
+
+    Returns:
+        A future that will get the path to the GIF, or None if the video couldn't be converted.
+    """
+    gif_path: Path = get_gif_path(video_url)
+    if gif_path.exists():
+        # Mark the GIF as recently used
+        gif_path.touch()
+        future: Future = Future()
+        future.set_result(gif_path)
+        return future
+
+    with _conversions_lock:
+        if video_url in _conversions:
+            return _conversions[video_url]
+
+        failed_at: float | None = _failed_conversions.get(video_url)
+        if failed_at is not None and time.monotonic() - failed_at < FAILED_CONVERSION_TTL:
+            future = Future()
+            future.set_result(None)
+            return future
+
+        future = get_process_pool().submit(make_gif, video_url, gif_path)
+        _conversions[video_url] = future
+
+    started: float = time.perf_counter()
+
+    def done(future: Future) -> None:
+        converted: bool = not future.cancelled() and future.exception() is None and future.result() is not None
+        with _conversions_lock:
+            _conversions.pop(video_url, None)
+            if not converted:
+                now: float = time.monotonic()
+                for url, failed_at in list(_failed_conversions.items()):
+                    if now - failed_at >= FAILED_CONVERSION_TTL:
+                        del _failed_conversions[url]
+                _failed_conversions[video_url] = now
+        GIF_CONVERSION_SECONDS.observe(time.perf_counter() - started, result="converted" if converted else "failed")
+        if converted:
+            evict_gif_cache(get_gif_cache_dir())
+
+    future.add_done_callback(done)
+    return future
+
@@ -0,0 +1,71 @@
+from collections.abc import Iterable
+from datetime import datetime
+
+from loguru import logger
+from reader import Entry, Reader
+from reader.types import EntryLike
+
+
+def get_entry_date(entry: Entry | EntryLike) -> datetime | None:
+    """Get when an entry was published.
+
+    Some feeds don't have publish dates, so when the entry was updated or when we first saw it is used instead.
+    Otherwise those feeds would never get a watermark and would be treated as new feeds on every check.
+    """
+    return entry.published or entry.updated or entry.added
+
+
+def get_watermark(reader: Reader, feed_url: str) -> datetime | None:
+    """Get the watermark of a feed.
+
+    The watermark is when the oldest tweet we have for the feed was published. Tweets older than this are old tweets
+    that Nitter sent us again and should not be sent to Discord.
+
+    Related: https://github.com/TheLovinator1/discord-twitter-webhooks/issues/129
+
+    Args:
+        reader: The reader to get the tag from.
+        feed_url: The URL of the feed.
+
+    Returns:
+        The watermark, or None if the feed doesn't have one yet.
+    """
+    watermark: str | None = reader.get_tag(feed_url, "watermark", None)
+    return datetime.fromisoformat(watermark) if watermark else None
+
+
+def set_watermark(reader: Reader, feed_url: str, entries: Iterable[Entry | EntryLike]) -> datetime | None:
+    """Set the watermark of a feed to when the oldest of the entries was published, see get_entry_date().
+
+    Args:
+        reader: The reader to save the tag in.
+        feed_url: The URL of the feed.
+        entries: The entries we have for the feed.
+
+    Returns:
+        The new watermark, or None if there are no entries.
+    """
+    dates: list[datetime] = [date for entry in entries if (date := get_entry_date(entry))]
+    if not dates:
+        return None
+
+    watermark: datetime = min(dates)
+    reader.set_tag(feed_url, "watermark", watermark.isoformat())
+    logger.debug("Watermark for {} is now {}", feed_url, watermark)
+    return watermark
+
+
+def is_older_than_watermark(entry: Entry | EntryLike, watermark: datetime | None) -> bool:
+    """Check if the entry was published before the watermark.
+
+    Args:
+        entry: The entry to check.
+        watermark: The watermark of the feed the entry is from.
+
+    Returns:
+        True if the entry is older than the watermark, False otherwise.
+    """
+    published: datetime | None = get_entry_date(entry)
+    if watermark is None or published is None:
+        return False
+    return published < watermark
@@ -1,35 +1,75 @@
 import re
+from dataclasses import dataclass
+from functools import lru_cache
 
+from loguru import logger
 
-def check_word_in_string(input_string: str, word: str) -> bool:
-    """Check if a word exists in the input string.
 
-    Parameters:
-        input_string (str): The input string to search for the word.
-        word (str): The word to search for.
+@dataclass(frozen=True)
+class FilterMatcher:
+    """A whitelist or blacklist compiled into as few regular expressions as possible.
 
-    Returns:
-        bool: True if the word is found, False otherwise.
+    Attributes:
+        keywords: One pattern that matches any of the words. Used on the lowercased input string.
+        patterns: The regular expressions. Those that can be combined are combined into one pattern.
     """
-    # If the word is in the list of words, return True, otherwise, return False
-    return word in input_string
 
+    keywords: re.Pattern | None = None
+    patterns: tuple[re.Pattern, ...] = ()
+
+    def matches(self: "FilterMatcher", input_string: str) -> bool:
+        """Check if any of the words or regular expressions match the input string.
+
+        Parameters:
+            input_string (str): The input string to search.
+
+        Returns:
+            bool: True if anything matched, False otherwise.
+        """
+        if self.keywords is not None and self.keywords.search(input_string.lower()):
+            return True
+        return any(pattern.search(input_string) for pattern in self.patterns)
 
-def check_word_in_string_regex(input_string: str, regex_pattern: str) -> bool:
-    """Check if a word matching the given regular expression pattern exists in the input string.
+
+@lru_cache(maxsize=1024)
+def compile_filter(words: tuple[str, ...], regex_patterns: tuple[str, ...]) -> FilterMatcher:
+    """Compile a whitelist or blacklist.
+
+    The result is cached, so each group's filter is only compiled once.
 
     Parameters:
-        input_string (str): The input string to search for the word.
-        regex_pattern (str): The regular expression pattern to match the word.
+        words (tuple[str, ...]): Words that match if they are anywhere in the input string, case-insensitive.
+        regex_patterns (tuple[str, ...]): Regular expressions that match case-insensitive.
 
     Returns:
-        bool: True if the word matching the pattern is found, False otherwise.
+        FilterMatcher: The compiled filter.
     """
-    # Compile the regex pattern
-    pattern = re.compile(regex_pattern, flags=re.IGNORECASE)
+    keywords: re.Pattern | None = None
+    if words:
+        keywords = re.compile("|".join(re.escape(word.lower()) for word in words))
+
+    # Patterns with groups can't be combined, backreferences would point to the wrong group
+    combinable: list[str] = []
+    patterns: list[re.Pattern] = []
+    for regex_pattern in regex_patterns:
+        try:
+            pattern: re.Pattern = re.compile(regex_pattern, flags=re.IGNORECASE)
+        except re.error as e:
+            logger.error("Invalid regex {!r}: {}", regex_pattern, e)
+            continue
+
+        if pattern.groups:
+            patterns.append(pattern)
+        else:
+            combinable.append(regex_pattern)
 
-    # Search for the pattern in the input string
-    match = pattern.search(input_string)
+    if len(combinable) > 1:
+        try:
+            patterns.insert(0, re.compile("|".join(f"(?:{p})" for p in combinable), flags=re.IGNORECASE))
+        except re.error:
+            # Inline flags like (?i) have to be at the start of a pattern
+            patterns[0:0] = [re.compile(p, flags=re.IGNORECASE) for p in combinable]
+    elif combinable:
+        patterns.insert(0, re.compile(combinable[0], flags=re.IGNORECASE))
 
-    # If the pattern is found, return True, otherwise, return False
-    return match is not None
+    return FilterMatcher(keywords=keywords, patterns=tuple(patterns))
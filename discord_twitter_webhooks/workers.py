@@ -0,0 +1,307 @@
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from typing import Any
+from uuid import uuid4
+
+from loguru import logger
+from reader import Reader
+
+from discord_twitter_webhooks._dataclasses import reload_app_settings
+from discord_twitter_webhooks.cycles import get_delay, get_jitter, run_cycle
+from discord_twitter_webhooks.metrics import get_snapshot
+from discord_twitter_webhooks.outbox import get_outbox_worker
+from discord_twitter_webhooks.reader_settings import get_reader
+from discord_twitter_webhooks.storage import get_db
+
+# How many shards the feeds are split into. Every feed is always in the same shard and workers own whole shards,
+# so this is also the most workers that can have something to do.
+SHARDS: int = 64
+
+# How long a lease lasts if the worker doesn't renew it, in seconds. The shards of a worker that died are taken over
+# by the other workers after this long.
+LEASE_TTL: float = 60
+
+# How often the workers renew their leases, in seconds
+LEASE_RENEW_INTERVAL: float = LEASE_TTL / 3
+
+# The lease of the worker that sends the messages in the outbox. Only one worker sends them, so the webhooks are
+# sent to in order and Discord's rate limits are tracked in one place.
+OUTBOX_LEASE: str = "outbox"
+
+# How often a worker that is waiting for its next check looks for a new delay in the settings, in seconds
+SETTINGS_RELOAD_INTERVAL: float = 30
+
+
+def get_shard(feed_url: str, shards: int = SHARDS) -> int:
+    """Get the shard a feed is in. It is the same in every process and every time the program runs."""
+    return int.from_bytes(hashlib.sha256(feed_url.encode()).digest()[:8], "big") % shards
+
+
+def get_shard_lease(shard: int) -> str:
+    """Get the name of the lease for a shard."""
+    return f"shard:{shard}"
+
+
+def renew_leases(reader: Reader, worker_id: str, now: float | None = None, *, give_back: bool = True) -> set[str]:
+    """Renew the leases of a worker and take free leases until it has its share of the shards.
+
+    Every worker gets about the same number of shards. Workers give back the shards they have too many of when more
+    workers start, and take over the shards of workers that stopped renewing their leases.
+
+    Args:
+        reader: The reader whose database the leases are stored in.
+        worker_id: The worker.
+        now: The current Unix time.
+        give_back: Give back the shards the worker has too many of. False while the worker is checking for new tweets,
+            so another worker doesn't check the same feeds before the check is done.
+
+    Returns:
+        The leases the worker has now.
+    """
+    now = time.time() if now is None else now
+    db: sqlite3.Connection = get_db(reader)
+
+    # Lock the database for writing right away, so two workers can't take the same lease
+    db.execute("BEGIN IMMEDIATE;")
+    try:
+        db.execute(
+            "INSERT INTO workers (id, heartbeat) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET heartbeat = ?;",
+            (worker_id, now, now),
+        )
+        db.execute("DELETE FROM workers WHERE heartbeat < ?;", (now - LEASE_TTL,))
+        db.execute("DELETE FROM worker_metrics WHERE worker NOT IN (SELECT id FROM workers);")
+        db.execute("DELETE FROM leases WHERE expires < ?;", (now,))
+        db.execute("UPDATE leases SET expires = ? WHERE worker = ?;", (now + LEASE_TTL, worker_id))
+
+        (workers,) = db.execute("SELECT COUNT(*) FROM workers;").fetchone()
+        share: int = math.ceil(SHARDS / workers)
+
+        leased: dict[str, str] = dict(db.execute("SELECT name, worker FROM leases;").fetchall())
+        shards: list[str] = [get_shard_lease(shard) for shard in range(SHARDS)]
+        mine: list[str] = [name for name in shards if leased.get(name) == worker_id]
+
+        # Give back the shards we have too many of, so the new workers can take them
+        if give_back:
+            for name in mine[share:]:
+                db.execute("DELETE FROM leases WHERE name = ?;", (name,))
+
+        take: list[str] = [name for name in shards if name not in leased][: max(0, share - len(mine))]
+        if OUTBOX_LEASE not in leased:
+            take.append(OUTBOX_LEASE)
+
+        db.executemany(
+            "INSERT INTO leases (name, worker, expires) VALUES (?, ?, ?);",
+            [(name, worker_id, now + LEASE_TTL) for name in take],
+        )
+
+        leases: set[str] = {name for (name,) in db.execute("SELECT name FROM leases WHERE worker = ?;", (worker_id,))}
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+    return leases
+
+
+def release_leases(reader: Reader, worker_id: str) -> None:
+    """Give back every lease of a worker, so the other workers can take them over right away."""
+    with get_db(reader) as db:
+        db.execute("DELETE FROM leases WHERE worker = ?;", (worker_id,))
+        db.execute("DELETE FROM workers WHERE id = ?;", (worker_id,))
+        db.execute("DELETE FROM worker_metrics WHERE worker = ?;", (worker_id,))
+
+
+def save_worker_metrics(reader: Reader, worker_id: str) -> None:
+    """Save the metrics of a worker, so the web server can show them at /metrics."""
+    with get_db(reader) as db:
+        db.execute(
+            "INSERT OR REPLACE INTO worker_metrics (worker, metrics) VALUES (?, ?);",
+            (worker_id, json.dumps(get_snapshot())),
+        )
+
+
+def get_worker_metrics(reader: Reader) -> dict[str, dict[str, Any]]:
+    """Get the metrics of every worker that is running by the worker's id, see metrics.get_snapshot()."""
+    rows = get_db(reader).execute("SELECT worker, metrics FROM worker_metrics;")
+    return {worker_id: json.loads(metrics) for worker_id, metrics in rows}
+
+
+def get_worker_state(reader: Reader) -> list[dict[str, object]]:
+    """Get every worker and the leases it has.
+
+    Returns:
+        The id, last heartbeat and leases of every worker.
+    """
+    db: sqlite3.Connection = get_db(reader)
+    leases: dict[str, list[str]] = {}
+    for name, worker_id in db.execute("SELECT name, worker FROM leases ORDER BY name;"):
+        leases.setdefault(worker_id, []).append(name)
+
+    return [
+        {
+            "id": worker_id,
+            "heartbeat": round(time.time() - heartbeat, 1),
+            "shards": sum(name.startswith("shard:") for name in leases.get(worker_id, [])),
+            "outbox": OUTBOX_LEASE in leases.get(worker_id, []),
+        }
+        for worker_id, heartbeat in db.execute("SELECT id, heartbeat FROM workers ORDER BY id;")
+    ]
+
+
+class ShardWorker:
+    """Check the feeds in the shards this worker has leases for and send their new tweets.
+
+    The leases are renewed in a thread of their own, so a check that takes longer than LEASE_TTL doesn't lose them.
+    """
+
+    def __init__(self: "ShardWorker", reader: Reader, worker_id: str | None = None) -> None:
+        self.reader: Reader = reader
+        self.id: str = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+        self._leases: set[str] = set()
+        self._renewed_at: float = 0.0
+        self._stop = threading.Event()
+
+        # Held while checking for new tweets, so shards are only given back between checks
+        self._checking = threading.Lock()
+
+    @property
+    def leases(self: "ShardWorker") -> set[str]:
+        """The leases this worker has. Empty if it hasn't been able to renew them for LEASE_TTL seconds."""
+        if time.monotonic() - self._renewed_at > LEASE_TTL:
+            return set()
+        return self._leases
+
+    def owns_feed(self: "ShardWorker", feed_url: str) -> bool:
+        """Check if the feed is in one of the shards of this worker."""
+        return get_shard_lease(get_shard(feed_url)) in self.leases
+
+    def renew(self: "ShardWorker") -> None:
+        """Renew the leases, start or stop sending the messages in the outbox and save our metrics."""
+        give_back: bool = self._checking.acquire(blocking=False)
+        try:
+            self._leases = renew_leases(self.reader, self.id, give_back=give_back)
+            self._renewed_at = time.monotonic()
+        finally:
+            if give_back:
+                self._checking.release()
+
+        outbox_worker = get_outbox_worker(self.reader)
+        outbox_worker.active = OUTBOX_LEASE in self._leases
+        if outbox_worker.active:
+            outbox_worker.wake()
+
+        save_worker_metrics(self.reader, self.id)
+
+    def _keep_leases(self: "ShardWorker", parent_pid: int | None) -> None:
+        while not self._stop.wait(LEASE_RENEW_INTERVAL):
+            # Stop when the web server that started us has stopped
+            if parent_pid is not None and os.getppid() != parent_pid:
+                logger.info("Worker {} stopping as the web server is gone", self.id)
+                self.stop()
+                return
+
+            try:
+                self.renew()
+            except sqlite3.Error:
+                logger.exception("Worker {} failed to renew its leases", self.id)
+
+    def stop(self: "ShardWorker") -> None:
+        """Stop after the current check and give back the leases."""
+        self._stop.set()
+
+    def wait_for_next_check(self: "ShardWorker", started: float) -> None:
+        """Wait until the delay has passed since the last check started, plus some jitter, see cycles.JITTER.
+
+        The delay is read again every SETTINGS_RELOAD_INTERVAL seconds, so a new delay is used without a restart.
+
+        Args:
+            started: When the last check started, in time.monotonic().
+        """
+        jitter: float = random.random()  # noqa: S311
+        while not self._stop.is_set():
+            delay: int = get_delay(reload_app_settings(self.reader))
+            remaining: float = started + delay * 60 + jitter * get_jitter(delay) - time.monotonic()
+            if remaining <= 0:
+                return
+            self._stop.wait(min(remaining, SETTINGS_RELOAD_INTERVAL))
+
+    def run(self: "ShardWorker", *, watch_parent: bool = False) -> None:
+        """Check for new tweets every few minutes until stop() is called.
+
+        Args:
+            watch_parent: Stop when the process that started this one stops.
+        """
+        self.renew()
+        parent_pid: int | None = os.getppid() if watch_parent else None
+        threading.Thread(target=self._keep_leases, args=(parent_pid,), name="leases", daemon=True).start()
+        logger.info("Worker {} started with {} leases", self.id, len(self._leases))
+
+        try:
+            while not self._stop.is_set():
+                started: float = time.monotonic()
+
+                # The settings can have been changed by the web server
+                reload_app_settings(self.reader)
+                try:
+                    with self._checking:
+                        run_cycle(self.reader, feed_filter=self.owns_feed)
+                except Exception:  # noqa: BLE001
+                    logger.exception("Worker {} failed to check for new tweets", self.id)
+
+                self.wait_for_next_check(started)
+        finally:
+            get_outbox_worker(self.reader).active = False
+            release_leases(self.reader, self.id)
+            logger.info("Worker {} stopped", self.id)
+
+
+def run_worker(*, watch_parent: bool = False) -> None:
+    """Run a worker. This is the entry point of the worker processes.
+
+    More workers can be started on their own with python -m discord_twitter_webhooks.workers, as long as they use
+    the same database.
+
+    Args:
+        watch_parent: Stop when the process that started the worker stops.
+    """
+    # Give back the leases when we are told to stop, see ShardWorker.run()
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))  # noqa: ARG005
+
+    ShardWorker(get_reader()).run(watch_parent=watch_parent)
+
+
+def start_workers(processes: int) -> list[BaseProcess]:
+    """Start worker processes that check for new tweets instead of the web server.
+
+    Args:
+        processes: How many workers to start.
+
+    Returns:
+        The processes.
+    """
+    # Forking a process with threads in it can deadlock, so start new processes instead.
+    context = multiprocessing.get_context("spawn")
+    workers: list[BaseProcess] = []
+    for number in range(processes):
+        process: BaseProcess = context.Process(target=run_worker, kwargs={"watch_parent": True}, name=f"worker-{number}")
+        process.start()
+        workers.append(process)
+
+    logger.info("Started {} workers", processes)
+    return workers
+
+
+if __name__ == "__main__":
+    run_worker()
@@ -0,0 +1,77 @@
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks.avatar import avatar_plugin, get_avatar
+from discord_twitter_webhooks.nitter import nitter_plugin
+
+RSS: bytes = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+  <channel>
+    <title>Steam / @Steam</title>
+    <link>https://nitter.example.com/Steam</link>
+    <image>
+      <title>Steam / @Steam</title>
+      <url>https://nitter.example.com/pic/avatar.jpg?name=small&amp;format=jpg</url>
+    </image>
+    <item>
+      <title>Hello</title>
+      <link>https://nitter.example.com/Steam/status/1#m</link>
+      <guid>https://nitter.example.com/Steam/status/1#m</guid>
+    </item>
+  </channel>
+</rss>
+"""
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serve a Nitter feed and count how many times it was downloaded."""
+
+    def do_GET(self: "FeedHandler") -> None:  # noqa: N802
+        self.server.requests += 1  # type: ignore  # noqa: PGH003
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(RSS)))
+        self.end_headers()
+        self.wfile.write(RSS)
+
+    def log_message(self: "FeedHandler", *args: object) -> None:
+        """Don't spam the test output."""
+
+
+@pytest.fixture()
+def server() -> Iterator[ThreadingHTTPServer]:
+    """Start a fake Nitter server."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    httpd.requests = 0  # type: ignore  # noqa: PGH003
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_avatar_saved_when_feed_is_updated(server: ThreadingHTTPServer) -> None:
+    """Test that the avatar is taken from the feed when it is updated instead of downloading the feed again."""
+    reader: Reader = make_reader(":memory:", plugins=[nitter_plugin, avatar_plugin])
+    feed_url: str = f"http://127.0.0.1:{server.server_address[1]}/Steam/rss"
+    reader.add_feed(feed_url)
+    reader.update_feeds()
+
+    assert len(list(reader.get_entries())) == 1
+    assert get_avatar(reader, feed_url) == "https://nitter.example.com/pic/avatar.jpg?name=small&format=jpg"
+    assert server.requests == 1  # type: ignore  # noqa: PGH003
+
+
+def test_avatar_without_plugin(server: ThreadingHTTPServer) -> None:
+    """Test that the feed is downloaded if we don't have the avatar, but only once."""
+    reader: Reader = make_reader(":memory:")
+    feed_url: str = f"http://127.0.0.1:{server.server_address[1]}/Steam/rss"
+    reader.add_feed(feed_url)
+
+    assert get_avatar(reader, feed_url) == "https://nitter.example.com/pic/avatar.jpg?name=small&format=jpg"
+    assert get_avatar(reader, feed_url) == "https://nitter.example.com/pic/avatar.jpg?name=small&format=jpg"
+    assert server.requests == 1  # type: ignore  # noqa: PGH003
@@ -0,0 +1,48 @@
+import os
+from pathlib import Path
+
+from discord_twitter_webhooks.benchmark import BenchmarkConfig, BenchmarkResult, compare, run_benchmark
+
+
+def test_run_benchmark(tmp_path: Path) -> None:
+    """Tweets go from the fake Nitter to the fake Discord, even when Discord rate limits us."""
+    data_home: str | None = os.environ.get("XDG_DATA_HOME")
+    config = BenchmarkConfig(
+        accounts=4,
+        tweets_per_round=2,
+        rounds=2,
+        reply_rate=0,
+        rate_limit_rate=0.1,
+        retry_after=0.01,
+    )
+    result: BenchmarkResult = run_benchmark(config, tmp_path)
+
+    # Every tweet is sent to both webhooks of its group, the first round only marks the tweets as read
+    assert result.entries == 16
+    assert [round_result.messages for round_result in result.rounds] == [16, 16]
+    assert result.delivered == 32
+    assert result.pending == 0
+    assert result.entries_per_second > 0
+    assert result.rounds[0].stages["update_feeds"] > 0
+
+    # Everything else keeps using the real database
+    assert os.environ.get("XDG_DATA_HOME") == data_home
+    assert (tmp_path / "discord_twitter_webhooks" / "discord_twitter_webhooks.db").exists()
+
+
+def test_compare() -> None:
+    result = BenchmarkResult(
+        config=BenchmarkConfig(),
+        rounds=[],
+        delivered=0,
+        rate_limited=0,
+        pending=0,
+        peak_rss_kb=1000,
+        peak_children_rss_kb=None,
+    )
+
+    assert compare(result, {"entries_per_second": 0, "peak_rss_kb": 1000}, 0.2) == []
+    assert compare(result, {"entries_per_second": 0, "peak_rss_kb": 500}, 0.2) == [
+        "Peak RSS went from 500 kB to 1000 kB",
+    ]
+    assert len(compare(result, {"entries_per_second": 100, "peak_rss_kb": None}, 0.2)) == 1
@@ -0,0 +1,47 @@
+import threading
+from pathlib import Path
+
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks import cycles
+from discord_twitter_webhooks._dataclasses import ApplicationSettings, set_app_settings
+from discord_twitter_webhooks.cycles import CHECK_JOB_ID, get_check_scheduler, get_cycles, run_cycle, start_checking
+
+
+def test_run_cycle(tmp_path: Path) -> None:
+    reader: Reader = make_reader(str(tmp_path / "db.sqlite"))
+
+    seconds: float | None = run_cycle(reader)
+    assert seconds is not None
+
+    saved: list[dict] = get_cycles(reader)
+    assert len(saved) == 1
+    assert saved[0]["delay"] == 10  # noqa: PLR2004
+    assert not saved[0]["too_slow"]
+
+
+def test_run_cycle_skips_when_a_check_is_running(tmp_path: Path) -> None:
+    reader: Reader = make_reader(str(tmp_path / "db.sqlite"))
+
+    with cycles._cycle_lock:  # noqa: SLF001
+        assert run_cycle(reader) is None
+    assert get_cycles(reader) == []
+
+
+def test_delay_is_changed_without_restart(tmp_path: Path) -> None:
+    reader: Reader = make_reader(str(tmp_path / "db.sqlite"))
+    set_app_settings(reader, ApplicationSettings(delay=10))
+
+    checked = threading.Event()
+    start_checking(reader, checked.set)
+    try:
+        # The first check is right away
+        assert checked.wait(5)
+
+        set_app_settings(reader, ApplicationSettings(delay=3))
+        trigger = get_check_scheduler().get_job(CHECK_JOB_ID).trigger
+        assert trigger.interval.total_seconds() == 3 * 60
+        assert trigger.jitter == 3 * 60 * cycles.JITTER
+    finally:
+        get_check_scheduler().shutdown(wait=False)
+        get_check_scheduler.cache_clear()
@@ -0,0 +1,51 @@
+import pytest
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks import _dataclasses
+from discord_twitter_webhooks._dataclasses import (
+    ApplicationSettings,
+    Group,
+    get_app_settings,
+    get_groups,
+    on_app_settings_change,
+    set_app_settings,
+)
+
+
+def test_app_settings_snapshot(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the settings are only read from the database once and replaced when they are saved."""
+    reader: Reader = make_reader(":memory:")
+    reader.set_tag((), "app_settings", ApplicationSettings(delay=5).__dict__)
+
+    app_settings: ApplicationSettings = get_app_settings(reader)
+    assert app_settings.delay == 5  # noqa: PLR2004
+
+    # Changes made behind our back are not seen, we use the snapshot
+    reader.set_tag((), "app_settings", ApplicationSettings(delay=6).__dict__)
+    assert get_app_settings(reader) is app_settings
+
+    # Don't leave our listener behind for the other tests
+    monkeypatch.setattr(_dataclasses, "_app_settings_listeners", [])
+    changed: list[ApplicationSettings] = []
+    on_app_settings_change(changed.append)
+
+    new_settings = ApplicationSettings(delay=7)
+    set_app_settings(reader, new_settings)
+
+    assert get_app_settings(reader) is new_settings
+    assert reader.get_tag((), "app_settings")["delay"] == 7  # noqa: PLR2004
+    assert changed == [new_settings]
+
+
+def test_get_groups() -> None:
+    """Test that every group is loaded, that missing settings get their defaults and missing groups are skipped."""
+    reader: Reader = make_reader(":memory:")
+    reader.set_tag((), "groups", ["a", "b", "missing"])
+    reader.set_tag((), "a", Group(uuid="a", name="First", send_as_link=True).__dict__)
+    reader.set_tag((), "b", {"name": "Old group", "removed_setting": True})
+
+    groups: list[Group] = get_groups(reader)
+
+    assert [(group.uuid, group.name) for group in groups] == [("a", "First"), ("b", "Old group")]
+    assert groups[0].send_as_link
+    assert groups[1].send_as_embed == Group.send_as_embed
@@ -0,0 +1,144 @@
+import json
+import threading
+from collections.abc import Iterator
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from discord_twitter_webhooks.delivery import DeliveryScheduler, WebhookResult, post_webhook
+from discord_twitter_webhooks.rate_limit import RateLimiter
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Pretend to be Discord.
+
+    Paths ending with /broken return an error and paths ending with /limited are rate limited the first time. Paths
+    ending with /lowercase are rate limited with lowercase header names, like Discord sends them.
+    """
+
+    def do_POST(self: "WebhookHandler") -> None:  # noqa: N802
+        body: bytes = self.rfile.read(int(self.headers["Content-Length"]))
+        payloads: list[tuple[str, dict]] = self.server.payloads  # type: ignore  # noqa: PGH003
+        payloads.append((self.path, json.loads(body)))
+
+        if self.path.endswith("/limited") and [path for path, _ in payloads].count(self.path) == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", "0.5")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.path.endswith("/lowercase"):
+            self.send_response(429)
+            self.send_header("x-ratelimit-bucket", "abcd")
+            self.send_header("x-ratelimit-limit", "5")
+            self.send_header("x-ratelimit-remaining", "0")
+            self.send_header("retry-after", "30")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        status_code: int = 400 if self.path.endswith("/broken") else 204
+        self.send_response(status_code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self: "WebhookHandler", *args: object) -> None:
+        """Don't spam the test output."""
+
+
+@pytest.fixture()
+def server() -> Iterator[ThreadingHTTPServer]:
+    """Start a fake Discord server."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), WebhookHandler)
+    httpd.payloads = []  # type: ignore  # noqa: PGH003
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_scheduler(server: ThreadingHTTPServer) -> None:
+    """Test that the message is sent to every webhook and that we get one result per webhook."""
+    base_url: str = f"http://127.0.0.1:{server.server_address[1]}"
+    urls: list[str] = [f"{base_url}/api/webhooks/{i}" for i in range(5)] + [f"{base_url}/api/webhooks/broken"]
+    scheduler = DeliveryScheduler(concurrency=3)
+
+    futures: list[Future] = [scheduler.submit(url, {"content": "Hello"}, {}) for url in urls]
+    results: list[WebhookResult] = [future.result() for future in futures]
+
+    assert [result.url for result in results] == urls
+    assert [result.ok for result in results] == [True] * 5 + [False]
+    assert results[-1].status_code == 400  # noqa: PLR2004
+    assert len(server.payloads) == 6  # type: ignore  # noqa: PGH003, PLR2004
+    assert all(payload["content"] == "Hello" for _, payload in server.payloads)  # type: ignore  # noqa: PGH003
+
+
+def test_scheduler_connection_error() -> None:
+    """Test that connection errors are reported instead of raised."""
+    result: WebhookResult = DeliveryScheduler().submit("http://127.0.0.1:1/api/webhooks", {}, {}).result()
+
+    assert not result.ok
+    assert result.status_code is None
+    assert result.error
+
+
+def test_rate_limited_webhook_does_not_block_others(server: ThreadingHTTPServer) -> None:
+    """Test that a 429 only holds up the webhook that got it and that the message is sent again."""
+    base_url: str = f"http://127.0.0.1:{server.server_address[1]}"
+    urls: list[str] = [f"{base_url}/api/webhooks/limited", f"{base_url}/api/webhooks/1"]
+    scheduler = DeliveryScheduler()
+
+    futures: list[Future] = [scheduler.submit(url, {"content": "Hello"}, {}) for url in urls]
+
+    assert all(future.result().ok for future in futures)
+    paths: list[str] = [path for path, _ in server.payloads]  # type: ignore  # noqa: PGH003
+    assert paths.count("/api/webhooks/limited") == 2  # noqa: PLR2004
+
+    # The other webhook was sent to while the limited one was waiting
+    assert paths.index("/api/webhooks/1") < len(paths) - 1
+
+
+def test_rate_limiter() -> None:
+    """Test that the bucket headers from Discord are used to decide when we can send."""
+    rate_limiter = RateLimiter()
+    url: str = "https://discord.com/api/webhooks/1234/token"
+
+    assert rate_limiter.acquire(url) == 0
+    rate_limiter.update(
+        url,
+        204,
+        {
+            "X-RateLimit-Bucket": "abcd",
+            "X-RateLimit-Limit": "5",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset-After": "60",
+        },
+    )
+
+    assert rate_limiter.acquire(url) > 0
+    assert rate_limiter.acquire("https://discord.com/api/webhooks/5678/token") == 0
+
+    state = rate_limiter.get_state()
+    bucket = next(bucket for bucket in state["buckets"] if bucket["name"] == "abcd")
+    assert bucket["webhooks"] == ["https://discord.com/api/webhooks/1234"]
+    assert bucket["remaining"] == 0
+    assert bucket["sent"] == 1
+
+
+def test_rate_limiter_lowercase_headers(server: ThreadingHTTPServer) -> None:
+    """Test that the rate limit headers are used no matter the case of their names."""
+    rate_limiter = RateLimiter()
+    url: str = f"http://127.0.0.1:{server.server_address[1]}/api/webhooks/lowercase"
+
+    result: WebhookResult = post_webhook(url, {"content": "Hello"}, {})
+    rate_limiter.update(url, result.status_code, result.headers)
+
+    # Retry-After is used instead of the default of 1 second
+    assert rate_limiter.acquire(url) > 10  # noqa: PLR2004
+    bucket = rate_limiter.get_state()["buckets"][0]
+    assert bucket["name"] == "abcd"
+    assert bucket["limit"] == 5  # noqa: PLR2004
+    assert bucket["rate_limited"] == 1
@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks.jobs import AddFeedsJob, get_job, start_add_feeds_job, wait_for_group_jobs
+
+
+def test_add_feeds_job(tmp_path: Path) -> None:
+    """Test that the feeds are added in the background and that the progress can be followed."""
+    # In-memory databases can't be used from other threads
+    reader: Reader = make_reader(str(tmp_path / "db.sqlite"))
+
+    # Nothing listens on port 1, so the feeds are added but fetching them fails
+    feed_urls: list[str] = [f"http://127.0.0.1:1/user{i}/rss" for i in range(3)]
+    job: AddFeedsJob = start_add_feeds_job(reader, "group-uuid", [*feed_urls, "not a url"])
+    assert get_job(job.id) is job
+
+    wait_for_group_jobs("group-uuid", timeout=30)
+    assert job.finished
+
+    progress = job.to_dict()
+    assert progress["total"] == progress["done"] == 4  # noqa: PLR2004
+    assert progress["failed"] == ["not a url"]
+    assert sorted(feed.url for feed in reader.get_feeds()) == feed_urls
@@ -1,11 +1,17 @@
+import asyncio
+import threading
+import time
 from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import TYPE_CHECKING
 from uuid import uuid4
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 
-from discord_twitter_webhooks.main import app
+from discord_twitter_webhooks._dataclasses import Group
+from discord_twitter_webhooks.main import app, clear_index_pages, reader
 
 if TYPE_CHECKING:
     from httpx import Response
@@ -145,3 +151,89 @@ def test_remove_group() -> None:
     assert len(response.text) < len(old_index_page.text)
 
     assert temp_name not in response.text
+
+
+def test_index_page_etag() -> None:
+    """Test that the index page is not sent again if the browser already has it."""
+    response: Response = client.get("/")
+    etag: str = response.headers["ETag"]
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304  # noqa: PLR2004
+    assert not response.content
+
+    response = client.get("/", headers={"If-None-Match": '"something else"'})
+    assert response.status_code == 200  # noqa: PLR2004
+    assert response.headers["ETag"] == etag
+
+
+class SlowFeedHandler(BaseHTTPRequestHandler):
+    """A feed that takes a couple of seconds to download."""
+
+    def do_GET(self: "SlowFeedHandler") -> None:  # noqa: N802
+        time.sleep(2)
+        body: bytes = b'<?xml version="1.0"?><rss version="2.0"><channel><title>Slow</title></channel></rss>'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self: "SlowFeedHandler", *args: object) -> None:
+        pass
+
+
+def test_index_page_responds_while_marking_as_unread() -> None:
+    """Test that a slow /mark_as_unread doesn't stop the index page from loading."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SlowFeedHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    feed_url: str = f"http://127.0.0.1:{httpd.server_port}/slow/rss"
+    group = Group(uuid=str(uuid4()), name="Slow", rss_feeds=[feed_url])
+    reader.set_tag((), group.uuid, group.__dict__)
+    reader.add_feed(feed_url, exist_ok=True)
+
+    async def run() -> float:
+        transport = httpx.ASGITransport(app=app)  # type: ignore  # noqa: PGH003
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as async_client:
+            mark_as_unread = asyncio.create_task(async_client.get(f"/mark_as_unread/{group.uuid}"))
+            await asyncio.sleep(0.5)
+            assert not mark_as_unread.done()
+
+            clear_index_pages()
+            start: float = time.perf_counter()
+            response: httpx.Response = await async_client.get("/")
+            elapsed: float = time.perf_counter() - start
+            assert response.status_code == 200  # noqa: PLR2004
+
+            await mark_as_unread
+            return elapsed
+
+    try:
+        assert asyncio.run(run()) < 1
+    finally:
+        httpd.shutdown()
+        reader.delete_tag((), group.uuid, missing_ok=True)
+        reader.delete_feed(feed_url, missing_ok=True)
+
+
+def test_metrics() -> None:
+    """Test that the metrics can be scraped by Prometheus."""
+    response: Response = client.get("/metrics")
+    assert response.status_code == 200  # noqa: PLR2004
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert "# TYPE dtw_webhook_post_seconds histogram" in response.text
+    assert "# TYPE dtw_entries_filtered_total counter" in response.text
+
+
+def test_debug_page() -> None:
+    """Test that profiles can be requested and cancelled on the debug page."""
+    response: Response = client.post("/debug/profile", data={"mode": "sampling", "cycles": "2"})
+    assert response.status_code == 200  # noqa: PLR2004
+    assert "2 more sampling profiles will be taken" in response.text
+
+    response = client.post("/debug/profile", data={"mode": "sampling", "cycles": "0"})
+    assert response.status_code == 200  # noqa: PLR2004
+    assert "more sampling profiles" not in response.text
+
+    assert client.get("/debug/profiles/123456").status_code == 404  # noqa: PLR2004
+    assert client.get("/debug/profiles/123456.prof").status_code == 404  # noqa: PLR2004
@@ -0,0 +1,63 @@
+from collections.abc import Iterator
+
+import pytest
+
+from discord_twitter_webhooks import metrics
+from discord_twitter_webhooks.metrics import Counter, Histogram, get_snapshot, render_metrics
+
+
+@pytest.fixture(autouse=True)
+def _unregister_test_metrics() -> Iterator[None]:
+    """Don't show the metrics made by these tests at /metrics in the other tests."""
+    names: set[str] = set(metrics._metrics)  # noqa: SLF001
+    yield
+    for name in set(metrics._metrics) - names:  # noqa: SLF001
+        del metrics._metrics[name]  # noqa: SLF001
+
+
+def test_render_metrics() -> None:
+    """Test that the metrics are shown in the Prometheus text format."""
+    counter = Counter("test_things_total", "Things.", labelnames=("kind",))
+    counter.inc(kind="a")
+    counter.inc(2, kind='b"')
+
+    histogram = Histogram("test_thing_seconds", "Time spent on things.", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines: list[str] = render_metrics().splitlines()
+    assert "# TYPE test_things_total counter" in lines
+    assert 'test_things_total{kind="a"} 1.0' in lines
+    assert 'test_things_total{kind="b\\""} 2.0' in lines
+
+    assert "# TYPE test_thing_seconds histogram" in lines
+    assert 'test_thing_seconds_bucket{le="0.1"} 1.0' in lines
+    assert 'test_thing_seconds_bucket{le="1.0"} 2.0' in lines
+    assert 'test_thing_seconds_bucket{le="+Inf"} 3.0' in lines
+    assert "test_thing_seconds_sum 5.55" in lines
+    assert "test_thing_seconds_count 3.0" in lines
+
+
+def test_render_metrics_from_other_processes() -> None:
+    """Test that the metrics of every worker are shown separately from our own."""
+    counter = Counter("test_merged_total", "Things done by every process.")
+    counter.inc()
+
+    histogram = Histogram("test_merged_seconds", "Time spent by every process.", buckets=(1,))
+    histogram.observe(0.5)
+
+    # Snapshots are sent between processes as JSON, so the tuples become lists
+    other: dict = {"test_merged_total": [[[], 2.0]], "test_merged_seconds": [[[], [0, 1, 2.0]]]}
+    assert get_snapshot()["test_merged_total"] == [((), 1.0)]
+
+    lines: list[str] = render_metrics([("host:1", other)]).splitlines()
+    assert "test_merged_total 1.0" in lines
+    assert 'test_merged_total{worker="host:1"} 2.0' in lines
+    assert 'test_merged_seconds_bucket{le="1.0"} 1.0' in lines
+    assert 'test_merged_seconds_bucket{worker="host:1",le="1.0"} 0.0' in lines
+    assert 'test_merged_seconds_bucket{worker="host:1",le="+Inf"} 1.0' in lines
+    assert 'test_merged_seconds_sum{worker="host:1"} 2.0' in lines
+
+    # A worker that exits takes its series with it instead of making ours go down
+    assert "test_merged_total 1.0" in render_metrics().splitlines()
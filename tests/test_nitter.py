@@ -0,0 +1,93 @@
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks._dataclasses import ApplicationSettings, set_app_settings
+from discord_twitter_webhooks.nitter import InstancePool, get_instance_pool, nitter_plugin
+
+
+class NitterHandler(BaseHTTPRequestHandler):
+    """Pretend to be a Nitter instance. Instances on servers with broken=True return errors."""
+
+    def do_GET(self: "NitterHandler") -> None:  # noqa: N802
+        if self.server.broken:  # type: ignore  # noqa: PGH003
+            self.send_response(502)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        instance: str = f"http://127.0.0.1:{self.server.server_address[1]}"
+        rss: bytes = f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+  <channel>
+    <title>Steam / @Steam</title>
+    <link>{instance}/Steam</link>
+    <item>
+      <title>Hello</title>
+      <link>{instance}/Steam/status/1#m</link>
+      <guid>{instance}/Steam/status/1#m</guid>
+    </item>
+  </channel>
+</rss>
+""".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(rss)))
+        self.end_headers()
+        self.wfile.write(rss)
+
+    def log_message(self: "NitterHandler", *args: object) -> None:
+        """Don't spam the test output."""
+
+
+def start_server(*, broken: bool) -> ThreadingHTTPServer:
+    """Start a fake Nitter instance."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), NitterHandler)
+    httpd.broken = broken  # type: ignore  # noqa: PGH003
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+@pytest.fixture()
+def instances() -> Iterator[tuple[str, str]]:
+    """Start a broken main instance and a working extra instance."""
+    servers: list[ThreadingHTTPServer] = [start_server(broken=True), start_server(broken=False)]
+    yield tuple(f"http://127.0.0.1:{server.server_address[1]}" for server in servers)  # type: ignore  # noqa: PGH003
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_broken_instance_is_routed_around(instances: tuple[str, str]) -> None:
+    """Test that the feed is fetched from the working instance and that the tweets still link to the main one."""
+    main_instance, extra_instance = instances
+    reader: Reader = make_reader(":memory:", plugins=[nitter_plugin])
+    app_settings = ApplicationSettings(nitter_instance=main_instance, extra_nitter_instances=[extra_instance])
+    set_app_settings(reader, app_settings)
+
+    feed_url: str = f"{main_instance}/Steam/rss"
+    reader.add_feed(feed_url)
+    reader.update_feeds()
+
+    assert [entry.id for entry in reader.get_entries(feed=feed_url)] == [f"{main_instance}/Steam/status/1#m"]
+    assert reader.get_feed(feed_url).link == f"{main_instance}/Steam"
+
+    stats = {instance["url"]: instance for instance in get_instance_pool().get_state()}
+    assert stats[extra_instance]["error_rate"] == 0
+
+
+def test_choose_skips_unhealthy_instances() -> None:
+    """Test that instances that keep failing are not used while there are instances that work."""
+    pool = InstancePool()
+    instances: list[str] = ["https://broken.example.com", "https://working.example.com"]
+    for _ in range(5):
+        pool.record("https://broken.example.com", 1, ok=False)
+        pool.record("https://working.example.com", 1, ok=True)
+
+    # The broken instance is tried once to see if it is back up
+    assert pool.choose(instances) == "https://broken.example.com"
+    for _ in range(20):
+        assert pool.choose(instances) == "https://working.example.com"
@@ -0,0 +1,245 @@
+import json
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from discord_webhook import DiscordEmbed, DiscordWebhook
+from reader import Entry, Reader, make_reader
+
+from discord_twitter_webhooks import outbox
+from discord_twitter_webhooks.outbox import (
+    Batch,
+    OutboxMessage,
+    add_to_outbox,
+    claim_messages,
+    get_due_messages,
+    get_outbox_state,
+)
+from discord_twitter_webhooks.storage import get_db
+
+
+class FlakyDiscordHandler(BaseHTTPRequestHandler):
+    """Pretend to be Discord.
+
+    Paths ending with /flaky fail the first time and paths ending with /broken always fail, like messages with an
+    embed whose description is "bad".
+    """
+
+    def do_POST(self: "FlakyDiscordHandler") -> None:  # noqa: N802
+        body: bytes = self.rfile.read(int(self.headers["Content-Length"]))
+        payloads: list[tuple[str, dict]] = self.server.payloads  # type: ignore  # noqa: PGH003
+        payloads.append((self.path, json.loads(body)))
+
+        status_code: int = 204
+        embeds: list[dict] = payloads[-1][1].get("embeds") or []
+        if self.path.endswith("/broken") or any(embed.get("description") == "bad" for embed in embeds):
+            status_code = 400
+        elif self.path.endswith("/flaky") and [path for path, _ in payloads].count(self.path) == 1:
+            status_code = 500
+
+        self.send_response(status_code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self: "FlakyDiscordHandler", *args: object) -> None:
+        """Don't spam the test output."""
+
+
+@pytest.fixture()
+def server() -> Iterator[ThreadingHTTPServer]:
+    """Start a fake Discord server."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FlakyDiscordHandler)
+    httpd.payloads = []  # type: ignore  # noqa: PGH003
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_entry(tmp_path: Path) -> tuple[Reader, Entry]:
+    # In-memory databases can't be used from other threads
+    reader: Reader = make_reader(str(tmp_path / "db.sqlite"))
+    reader.add_feed("https://nitter.example/user/rss", allow_invalid_url=True)
+    reader.add_entry({"feed_url": "https://nitter.example/user/rss", "id": "1"})
+    return reader, reader.get_entry(("https://nitter.example/user/rss", "1"))
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 10) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_failed_messages_are_sent_again(
+    server: ThreadingHTTPServer,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that a message stays in the outbox until Discord accepts it."""
+    monkeypatch.setattr(outbox, "RETRY_DELAY", 0.1)
+    reader, entry = make_entry(tmp_path)
+    base_url: str = f"http://127.0.0.1:{server.server_address[1]}/api/webhooks"
+
+    urls: list[str] = [f"{base_url}/ok", f"{base_url}/flaky"]
+    added: int = add_to_outbox(reader, entry, "group/text", DiscordWebhook(url="", content="Hello"), urls)
+    assert added == 2  # noqa: PLR2004
+
+    assert wait_for(lambda: get_outbox_state(reader)["waiting"] == 0)
+    paths: list[str] = [path for path, _ in server.payloads]  # type: ignore  # noqa: PGH003
+    assert sorted(paths) == ["/api/webhooks/flaky", "/api/webhooks/flaky", "/api/webhooks/ok"]
+    assert all(payload["content"] == "Hello" for _, payload in server.payloads)  # type: ignore  # noqa: PGH003
+
+
+def test_rejected_messages_are_kept(
+    server: ThreadingHTTPServer,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that we give up on messages Discord keeps rejecting, but keep them so they can be sent again."""
+    monkeypatch.setattr(outbox, "RETRY_DELAY", 0.05)
+    monkeypatch.setattr(outbox, "MAX_REJECTED_ATTEMPTS", 2)
+    reader, entry = make_entry(tmp_path)
+    url: str = f"http://127.0.0.1:{server.server_address[1]}/api/webhooks/broken"
+    webhook = DiscordWebhook(url="", content="Hello")
+
+    assert add_to_outbox(reader, entry, "group/text", webhook, [url]) == 1
+    assert wait_for(lambda: get_outbox_state(reader)["failed"] == 1)
+    assert len(server.payloads) == 2  # type: ignore  # noqa: PGH003
+
+    # Adding a message we gave up on sends it again, adding a message that is waiting does nothing
+    assert add_to_outbox(reader, entry, "group/text", webhook, [url]) == 1
+    assert add_to_outbox(reader, entry, "group/text", webhook, [url]) == 0
+
+
+def test_embeds_are_combined(
+    server: ThreadingHTTPServer,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that embeds sent at about the same time are sent with as few requests as Discord allows, in order."""
+    monkeypatch.setattr(outbox, "BATCH_WINDOW", 0.5)
+    reader, entry = make_entry(tmp_path)
+    url: str = f"http://127.0.0.1:{server.server_address[1]}/api/webhooks/ok"
+
+    for number in range(15):
+        webhook = DiscordWebhook(url="", embeds=[DiscordEmbed(description=str(number))])
+        assert add_to_outbox(reader, entry, f"group/embed/{number}", webhook, [url], batch=True) == 1
+
+    assert wait_for(lambda: get_outbox_state(reader)["waiting"] == 0)
+    payloads: list[dict] = [payload for _, payload in server.payloads]  # type: ignore  # noqa: PGH003
+    assert [len(payload["embeds"]) for payload in payloads] == [10, 5]
+    descriptions: list[str] = [embed["description"] for payload in payloads for embed in payload["embeds"]]
+    assert descriptions == [str(number) for number in range(15)]
+
+
+def test_rejected_embeds_are_sent_alone(
+    server: ThreadingHTTPServer,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that one embed Discord rejects doesn't make us give up on the embeds it was combined with."""
+    monkeypatch.setattr(outbox, "BATCH_WINDOW", 0.5)
+    monkeypatch.setattr(outbox, "MAX_REJECTED_ATTEMPTS", 1)
+    reader, entry = make_entry(tmp_path)
+    url: str = f"http://127.0.0.1:{server.server_address[1]}/api/webhooks/ok"
+
+    for number, description in enumerate(["first", "bad", "last"]):
+        webhook = DiscordWebhook(url="", embeds=[DiscordEmbed(description=description)])
+        assert add_to_outbox(reader, entry, f"group/embed/{number}", webhook, [url], batch=True) == 1
+
+    assert wait_for(lambda: (state := get_outbox_state(reader))["waiting"] == 0 and state["failed"] == 1)
+    payloads: list[dict] = [payload for _, payload in server.payloads]  # type: ignore  # noqa: PGH003
+    assert [[embed["description"] for embed in payload["embeds"]] for payload in payloads] == [
+        ["first", "bad", "last"],
+        ["first"],
+        ["bad"],
+        ["last"],
+    ]
+
+
+def test_failed_conversions_are_linked(
+    server: ThreadingHTTPServer,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that a video that couldn't be converted is linked to instead of holding up the webhook."""
+    conversions: list[Future] = []
+
+    def convert_video(video_url: str) -> Future:  # noqa: ARG001
+        future: Future = Future()
+        conversions.append(future)
+        threading.Timer(0.2, future.set_result, (None,)).start()
+        return future
+
+    monkeypatch.setattr(outbox, "convert_video", convert_video)
+    reader, entry = make_entry(tmp_path)
+    url: str = f"http://127.0.0.1:{server.server_address[1]}/api/webhooks/ok"
+
+    video_webhook = DiscordWebhook(url="", embeds=[DiscordEmbed(description="Look")])
+    attachments: dict[str, str] = {"video.gif": "https://video.example/1.mp4"}
+    assert add_to_outbox(reader, entry, "group/embed", video_webhook, [url], attachments) == 1
+    assert add_to_outbox(reader, entry, "group/text", DiscordWebhook(url="", content="Next"), [url]) == 1
+
+    assert wait_for(lambda: get_outbox_state(reader)["waiting"] == 0)
+    payloads: list[dict] = [payload for _, payload in server.payloads]  # type: ignore  # noqa: PGH003
+    assert payloads[0]["embeds"][0]["description"] == "Look\n\n[Video](https://video.example/1.mp4)"
+    assert payloads[1]["content"] == "Next"
+    assert len(conversions) == 1
+
+
+def test_messages_are_claimed(
+    server: ThreadingHTTPServer,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that a message another process is sending isn't sent again, and neither are the messages after it."""
+    reader, entry = make_entry(tmp_path)
+    url: str = f"http://127.0.0.1:{server.server_address[1]}/api/webhooks/ok"
+
+    # Keep the worker from sending the messages before the other process has claimed the first one
+    worker = outbox.get_outbox_worker(reader)
+    monkeypatch.setattr(worker, "active", False)
+    add_to_outbox(reader, entry, "group/text/1", DiscordWebhook(url="", content="First"), [url])
+    add_to_outbox(reader, entry, "group/text/2", DiscordWebhook(url="", content="Second"), [url])
+
+    first, second = get_due_messages(reader, time.time())
+    assert claim_messages(reader, [first], time.time()) == [first]
+    assert claim_messages(reader, [first, second], time.time()) == [second]
+
+    # The other process gave up on the second message and is still sending the first one
+    with get_db(reader) as db:
+        db.execute("UPDATE outbox SET claimed_until = NULL WHERE id = ?;", (second.id,))
+    monkeypatch.setattr(worker, "active", True)
+    timeout: float | None = worker.drain()
+
+    assert server.payloads == []  # type: ignore  # noqa: PGH003
+    assert timeout is not None
+    assert timeout > outbox.CLAIM_TTL - 60
+
+
+def test_batch_limits() -> None:
+    """Test that combined messages stay under Discord's limits and keep their own GIFs."""
+
+    def make_message(message_id: int, description: str) -> OutboxMessage:
+        payload: dict = {"embeds": [{"description": description, "image": {"url": "attachment://video.gif"}}]}
+        return OutboxMessage(message_id, "feed", "entry", "webhook", payload, {}, 0, batch=True)
+
+    batch = Batch("webhook")
+    batch.add(make_message(1, "a" * 3000), {"_video.gif": ("video.gif", b"1")})
+    assert batch.fits(make_message(2, "b" * 3000), {"_video.gif": ("video.gif", b"2")})
+    assert not batch.fits(make_message(3, "c" * 3001), {})
+
+    batch.add(make_message(2, "b" * 3000), {"_video.gif": ("video.gif", b"2")})
+    payload, files = batch.get_message()
+    assert [embed["image"]["url"] for embed in payload["embeds"]] == [
+        "attachment://0_video.gif",
+        "attachment://1_video.gif",
+    ]
+    assert files == {"_0_video.gif": ("0_video.gif", b"1"), "_1_video.gif": ("1_video.gif", b"2")}
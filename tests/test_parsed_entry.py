@@ -0,0 +1,48 @@
+from discord_twitter_webhooks.parsed_entry import Link, ParsedEntry, parse_html
+
+html: str = (
+    '<p>Hello <a href="https://nitter.example/search?q=%23world">#world</a>'
+    ' from <a href="https://nitter.example/TheLovinator1">@TheLovinator1</a></p>\n'
+    '<p><a href="https://example.com/">example.com</a><a href="https://example.com/empty"></a></p>\n'
+    '<img src="https://nitter.example/pic/media%2Fimage.jpg" style="max-width:250px;" />\n'
+    '<video poster="https://nitter.example/pic/thumb.jpg">'
+    '<source src="https://video.twimg.com/tweet_video/video.mp4" type="video/mp4"></video>'
+)
+
+
+def test_parse_html() -> None:
+    """Test that links, images and videos are found in one parse."""
+    parsed: ParsedEntry = parse_html(html)
+
+    assert parsed.images == ["https://nitter.example/pic/media%2Fimage.jpg"]
+    assert parsed.videos == ["https://video.twimg.com/tweet_video/video.mp4"]
+    assert parsed.has_media
+    assert parsed.hashtags == [Link(text="#world", href="https://nitter.example/search?q=%23world")]
+    assert parsed.mentions == [Link(text="@TheLovinator1", href="https://nitter.example/TheLovinator1")]
+
+    # Links without text are removed
+    assert [link.href for link in parsed.links] == [
+        "https://nitter.example/search?q=%23world",
+        "https://nitter.example/TheLovinator1",
+        "https://example.com/",
+    ]
+
+
+def test_to_markdown() -> None:
+    """Test that the tweet is converted to markdown with hashtags and mentions pointing to the right place."""
+    parsed: ParsedEntry = parse_html(html)
+
+    assert parsed.to_markdown("Twitter") == (
+        "Hello [#world](<https://twitter.com/hashtag/world>) from"
+        " [@TheLovinator1](<https://twitter.com/TheLovinator1>)\n[example.com](<https://example.com/>)"
+    )
+    assert parsed.to_markdown("Nitter") == (
+        "Hello [#world](<https://nitter.example/search?q=%23world>) from"
+        " [@TheLovinator1](<https://nitter.example/TheLovinator1>)\n[example.com](<https://example.com/>)"
+    )
+
+
+def test_no_media() -> None:
+    """Test that text-only tweets have no media."""
+    assert not parse_html("<p>Just text</p>").has_media
+    assert not parse_html("").has_media
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks.polling import MAX_UPDATE_INTERVAL, get_due_feeds, get_update_interval
+
+
+def add_tweets(reader: Reader, feed_url: str, now: datetime, every: timedelta) -> None:
+    """Add 10 tweets to a feed, one every `every`."""
+    reader.add_feed(feed_url)
+    for i in range(10):
+        reader.add_entry({"feed_url": feed_url, "id": str(i), "published": now - every * i})
+
+
+def test_get_update_interval() -> None:
+    """Test that accounts that tweet a lot are checked more often than quiet ones."""
+    reader: Reader = make_reader(":memory:")
+    now: datetime = datetime.now(tz=timezone.utc)
+    min_interval = timedelta(minutes=10)
+
+    add_tweets(reader, "https://nitter.example.com/busy/rss", now, timedelta(minutes=1))
+    add_tweets(reader, "https://nitter.example.com/normal/rss", now, timedelta(hours=1))
+    add_tweets(reader, "https://nitter.example.com/quiet/rss", now, timedelta(days=7))
+    reader.add_feed("https://nitter.example.com/empty/rss")
+
+    assert get_update_interval(reader, "https://nitter.example.com/busy/rss", now, min_interval) == min_interval
+    assert get_update_interval(reader, "https://nitter.example.com/normal/rss", now, min_interval) == timedelta(
+        minutes=27,
+    )
+    assert get_update_interval(reader, "https://nitter.example.com/quiet/rss", now, min_interval) == MAX_UPDATE_INTERVAL
+    assert get_update_interval(reader, "https://nitter.example.com/empty/rss", now, min_interval) == min_interval
+
+
+def test_get_due_feeds() -> None:
+    """Test that only feeds without a next update or with one in the past are due."""
+    reader: Reader = make_reader(":memory:")
+    now: datetime = datetime.now(tz=timezone.utc)
+
+    for name in ["new", "due", "later"]:
+        reader.add_feed(f"https://nitter.example.com/{name}/rss")
+    reader.set_tag("https://nitter.example.com/due/rss", "next_update", (now - timedelta(minutes=1)).isoformat())
+    reader.set_tag("https://nitter.example.com/later/rss", "next_update", (now + timedelta(hours=1)).isoformat())
+
+    assert sorted(get_due_feeds(reader, now)) == [
+        "https://nitter.example.com/due/rss",
+        "https://nitter.example.com/new/rss",
+    ]
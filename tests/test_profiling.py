@@ -0,0 +1,69 @@
+import threading
+import time
+from pathlib import Path
+
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks.profiling import (
+    Profile,
+    get_profile,
+    get_profile_stats,
+    get_profiles,
+    profile_cycle,
+    request_profiles,
+)
+
+
+def busy(seconds: float) -> int:
+    """Keep the CPU busy, so the profilers have something to see."""
+    total: int = 0
+    end: float = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+def busy_in_thread(seconds: float) -> None:
+    thread = threading.Thread(target=busy, args=(seconds,))
+    thread.start()
+    thread.join()
+
+
+def test_cprofile(tmp_path: Path) -> None:
+    reader: Reader = make_reader(str(tmp_path / "db.sqlite"))
+
+    # Nothing is profiled until it is requested
+    assert profile_cycle(reader, busy, 0.01) > 0
+    assert get_profiles(reader) == []
+
+    request_profiles(reader, "cprofile", 1)
+    profile_cycle(reader, busy, 0.1)
+    profile_cycle(reader, busy, 0.01)
+
+    profiles: list[Profile] = get_profiles(reader)
+    assert len(profiles) == 1
+    assert profiles[0].mode == "cprofile"
+    assert profiles[0].seconds >= 0.1
+
+    profile: Profile | None = get_profile(reader, profiles[0].id)
+    assert profile is not None
+    assert profile.functions[0].cumulative >= profile.functions[-1].cumulative
+    assert any(function.function.startswith("busy (") and function.calls == 1 for function in profile.functions)
+    assert get_profile_stats(reader, profile.id)
+
+
+def test_sampling_sees_other_threads(tmp_path: Path) -> None:
+    reader: Reader = make_reader(str(tmp_path / "db.sqlite"))
+
+    request_profiles(reader, "sampling", 1)
+    profile_cycle(reader, busy_in_thread, 0.3)
+
+    profile: Profile | None = get_profile(reader, get_profiles(reader)[0].id)
+    assert profile is not None
+    assert profile.mode == "sampling"
+    busy_stats = next(function for function in profile.functions if function.function.startswith("busy ("))
+    assert busy_stats.cumulative > 0.1
+    assert profile.packages
+
+    # Sampling profiles can't be opened with pstats
+    assert get_profile_stats(reader, profile.id) is None
@@ -0,0 +1,21 @@
+from discord_twitter_webhooks._dataclasses import Group
+from discord_twitter_webhooks.send_to_discord import get_groups_by_feed
+
+
+def test_get_groups_by_feed() -> None:
+    """Test that each feed only points to the groups subscribed to it."""
+    first = Group(uuid="first", rss_feeds=["https://nitter.example/a/rss", "https://nitter.example/b/rss"])
+    second = Group(uuid="second", rss_feeds=["https://nitter.example/b/rss"])
+
+    groups_by_feed: dict[str, list[Group]] = get_groups_by_feed([first, second])
+
+    assert groups_by_feed["https://nitter.example/a/rss"] == [first]
+    assert groups_by_feed["https://nitter.example/b/rss"] == [first, second]
+    assert "https://nitter.example/c/rss" not in groups_by_feed
+
+
+def test_get_groups_by_feed_duplicate_feeds() -> None:
+    """Test that a group listing the same feed twice is only indexed once."""
+    group = Group(uuid="group", rss_feeds=["https://nitter.example/a/rss", "https://nitter.example/a/rss"])
+
+    assert get_groups_by_feed([group]) == {"https://nitter.example/a/rss": [group]}
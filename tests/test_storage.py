@@ -0,0 +1,81 @@
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks.storage import (
+    get_db,
+    get_feed_groups,
+    remove_group_feeds,
+    set_entries_read,
+    set_feed_read,
+    set_group_feeds,
+)
+
+
+def test_set_entries_read() -> None:
+    """Test that entries are marked as read and unread like reader does it."""
+    reader: Reader = make_reader(":memory:")
+    reader.add_feed("https://nitter.example.com/Steam/rss")
+    for i in range(3):
+        reader.add_entry({"feed_url": "https://nitter.example.com/Steam/rss", "id": str(i)})
+
+    entries = [entry for entry in reader.get_entries() if entry.id in {"0", "1"}]
+    assert set_entries_read(reader, entries, read=True) == 2  # noqa: PLR2004
+    assert sorted(entry.id for entry in reader.get_entries(read=True)) == ["0", "1"]
+    assert all(entry.read_modified for entry in reader.get_entries(read=True))
+
+    assert set_feed_read(reader, "https://nitter.example.com/Steam/rss", read=True) == 1
+    assert not list(reader.get_entries(read=False))
+
+    assert set_feed_read(reader, "https://nitter.example.com/Steam/rss", read=False) == 3  # noqa: PLR2004
+    assert set_entries_read(reader, [], read=True) == 0
+
+
+def test_reader_entries_schema() -> None:
+    """Test that reader stores entries the way set_entries_read() and set_feed_read() expect.
+
+    The entries table is private to reader, so this fails when a new version of reader changes it. Check that the
+    functions still work and update the schema version here before allowing that version of reader in pyproject.toml.
+    """
+    reader: Reader = make_reader(":memory:")
+    db = get_db(reader)
+    assert db.execute("PRAGMA user_version;").fetchone() == (44,)
+
+    columns: dict[str, str] = {row[1]: row[2] for row in db.execute("PRAGMA table_info(entries);")}
+    assert {name: columns.get(name) for name in ("id", "feed", "read", "read_modified")} == {
+        "id": "TEXT",
+        "feed": "TEXT",
+        "read": "INTEGER",
+        "read_modified": "TIMESTAMP",
+    }
+
+    # Entries we mark look the same to reader as the entries it marks itself
+    reader.add_feed("https://nitter.example.com/Steam/rss")
+    for i in range(2):
+        reader.add_entry({"feed_url": "https://nitter.example.com/Steam/rss", "id": str(i)})
+    reader.set_entry_read(("https://nitter.example.com/Steam/rss", "0"), True)  # noqa: FBT003
+    set_entries_read(reader, [reader.get_entry(("https://nitter.example.com/Steam/rss", "1"))], read=True)
+
+    theirs, ours = sorted(reader.get_entries(read=True), key=lambda entry: entry.id)
+    assert ours.read == theirs.read
+    assert type(ours.read_modified) is type(theirs.read_modified)
+    assert ours.read_modified.tzinfo == theirs.read_modified.tzinfo
+
+
+def test_group_feeds() -> None:
+    """Test that removing a group only returns the feeds no other group uses."""
+    reader: Reader = make_reader(":memory:")
+    set_group_feeds(reader, "a", ["https://nitter.example.com/1/rss", "https://nitter.example.com/2/rss"])
+    set_group_feeds(reader, "b", ["https://nitter.example.com/2/rss", "https://nitter.example.com/3/rss"])
+
+    assert sorted(get_feed_groups(reader, "https://nitter.example.com/2/rss")) == ["a", "b"]
+    assert remove_group_feeds(reader, "a") == ["https://nitter.example.com/1/rss"]
+    assert get_feed_groups(reader, "https://nitter.example.com/1/rss") == []
+    assert get_feed_groups(reader, "https://nitter.example.com/2/rss") == ["b"]
+
+
+def test_group_feeds_migration() -> None:
+    """Test that the groups tags of existing feeds are moved to the group_feeds table."""
+    reader: Reader = make_reader(":memory:")
+    reader.add_feed("https://nitter.example.com/1/rss")
+    reader.set_tag("https://nitter.example.com/1/rss", "groups", ["a", "b"])  # type: ignore  # noqa: PGH003
+
+    assert sorted(get_feed_groups(reader, "https://nitter.example.com/1/rss")) == ["a", "b"]
@@ -0,0 +1,42 @@
+import pytest
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks import _dataclasses
+from discord_twitter_webhooks._dataclasses import ApplicationSettings
+from discord_twitter_webhooks.translate import (
+    TRANSLATE_SECONDS,
+    cache_translations,
+    get_cached_translations,
+    get_translation_key,
+    translate_many,
+)
+
+
+def get_translated_count() -> float:
+    """Get how many texts TRANSLATE_SECONDS has observed."""
+    return sum(sum(counts[:-1]) for _, counts in TRANSLATE_SECONDS.get_snapshot())
+
+
+def test_translation_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that cached translations are used instead of asking DeepL."""
+    # Don't replace the settings of the other tests or call the listeners they registered
+    monkeypatch.setattr(_dataclasses, "_app_settings_snapshot", None)
+    monkeypatch.setattr(_dataclasses, "_app_settings_listeners", [])
+
+    reader: Reader = make_reader(":memory:")
+    reader.set_tag((), "app_settings", ApplicationSettings().__dict__)
+    key: str = get_translation_key("<p>Hej</p>", "sv", "en-GB")
+
+    assert get_cached_translations(reader, [key]) == {}
+    cache_translations(reader, {key: "<p>Hello</p>"})
+    assert get_cached_translations(reader, [key]) == {key: "<p>Hello</p>"}
+
+    # No DeepL auth key is set, so only the cached text is translated
+    translated_before: float = get_translated_count()
+    assert translate_many([("<p>Hej</p>", "sv", "en-GB"), ("<p>Hallo</p>", "de", "en-GB")], reader) == [
+        "<p>Hello</p>",
+        "<p>Hallo</p>",
+    ]
+
+    # Every text is observed, not the batch
+    assert get_translated_count() == translated_before + 2
@@ -0,0 +1,56 @@
+from typing import Any
+
+from discord_twitter_webhooks._dataclasses import Group
+from discord_twitter_webhooks.tweet_text import clear_render_cache, get_render_key, get_tweet_text
+
+
+class FakeEntry:
+    feed_url: str = "https://nitter.example/TheLovinator1/rss"
+    id: str = "https://nitter.example/TheLovinator1/status/1#m"
+    link: str = "https://nitter.example/TheLovinator1/status/1#m"
+    title: str = "Hello #world"
+    summary: str = '<p>Hello <a href="https://nitter.example/search?q=%23world">#world</a></p>'
+
+
+entry: Any = FakeEntry()
+
+
+def test_render_key_ignores_unrelated_settings() -> None:
+    """Test that groups that only differ in settings that don't change the text share the rendered text."""
+    first = Group(uuid="first", webhooks=["https://discord.example/1"], send_as_embed=True)
+    second = Group(uuid="second", webhooks=["https://discord.example/2"], send_as_text=True, send_replies=True)
+
+    assert get_render_key(entry, first) == get_render_key(entry, second)
+    assert get_render_key(entry, first) != get_render_key(entry, Group(link_destination="Nitter"))
+
+    # The languages only matter if we translate
+    assert get_render_key(entry, first) == get_render_key(entry, Group(translate_to="de"))
+    assert get_render_key(entry, first) != get_render_key(entry, Group(translate=True))
+
+
+def test_get_tweet_text() -> None:
+    """Test that the tweet text is rendered once and that links follow the link destination setting."""
+    clear_render_cache()
+
+    twitter: str = get_tweet_text(entry, Group(link_destination="Twitter"))
+    nitter: str = get_tweet_text(entry, Group(link_destination="Nitter"))
+
+    assert twitter == "Hello [#world](<https://twitter.com/hashtag/world>)"
+    assert nitter == "Hello [#world](<https://nitter.example/search?q=%23world>)"
+    assert get_tweet_text(entry, Group(link_destination="Twitter")) is twitter
+
+
+def test_clear_render_cache_for_feed() -> None:
+    """Test that only the tweets of the feed that is sent again are rendered again."""
+    clear_render_cache()
+
+    class OtherEntry(FakeEntry):
+        feed_url: str = "https://nitter.example/Steam/rss"
+
+    other_entry: Any = OtherEntry()
+    text: str = get_tweet_text(entry, Group())
+    other_text: str = get_tweet_text(other_entry, Group())
+
+    clear_render_cache(entry.feed_url)
+    assert get_tweet_text(entry, Group()) is not text
+    assert get_tweet_text(other_entry, Group()) is other_text
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from discord_twitter_webhooks import video
+from discord_twitter_webhooks.benchmark import make_video
+from discord_twitter_webhooks.video import convert_video, download_video, evict_gif_cache
+
+
+class VideoHandler(BaseHTTPRequestHandler):
+    """Serve 1000 bytes of "video"."""
+
+    def do_GET(self: "VideoHandler") -> None:  # noqa: N802
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"0" * 1000)
+
+    def log_message(self: "VideoHandler", *args: object) -> None:
+        """Don't spam the test output."""
+
+
+@pytest.fixture()
+def video_url() -> Iterator[str]:
+    """Start a server that serves a video."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), VideoHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/video.mp4"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_video(video_url: str, tmp_path: Path) -> None:
+    """Test that videos are downloaded to disk unless they are too big."""
+    assert download_video(video_url, tmp_path / "video.mp4")
+    assert (tmp_path / "video.mp4").stat().st_size == 1000  # noqa: PLR2004
+
+    assert not download_video(video_url, tmp_path / "big.mp4", max_size=500)
+
+
+def test_evict_gif_cache(tmp_path: Path) -> None:
+    """Test that the least recently used GIFs are removed first."""
+    for i in range(3):
+        gif: Path = tmp_path / f"{i}.gif"
+        gif.write_bytes(b"0" * 100)
+        os.utime(gif, (i, i))
+
+    # GIFs that are still being written are never removed, no matter how old they are
+    temp_gif: Path = tmp_path / "3.1234.tmp.gif"
+    temp_gif.write_bytes(b"0" * 100)
+    os.utime(temp_gif, (0, 0))
+
+    evict_gif_cache(tmp_path, max_size=250)
+
+    assert sorted(gif.name for gif in tmp_path.glob("*.gif")) == ["1.gif", "2.gif", "3.1234.tmp.gif"]
+
+
+def test_failed_conversions_are_remembered(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a video that couldn't be converted isn't downloaded and converted again."""
+    video_path: Path = tmp_path / "video.mp4"
+    make_video(video_path, seconds=1, width=32, height=32)
+
+    class LongVideoHandler(BaseHTTPRequestHandler):
+        def do_GET(self: "LongVideoHandler") -> None:  # noqa: N802
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(video_path.read_bytes())
+
+        def log_message(self: "LongVideoHandler", *args: object) -> None:
+            """Don't spam the test output."""
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), LongVideoHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    # Convert in this process, so the conversions can be counted
+    make_gif = video.make_gif
+    calls: list[str] = []
+
+    def counting_make_gif(video_url: str, gif_path: Path) -> Path | None:
+        calls.append(video_url)
+        return make_gif(video_url, gif_path)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(video, "get_process_pool", lambda: executor)
+    monkeypatch.setattr(video, "make_gif", counting_make_gif)
+    monkeypatch.setattr(video, "MAX_VIDEO_DURATION", 0.5)
+    monkeypatch.setattr(video, "_failed_conversions", {})
+
+    try:
+        video_url: str = f"http://127.0.0.1:{httpd.server_address[1]}/long.mp4"
+        assert convert_video(video_url).result(timeout=60) is None
+
+        # The future is done before its callbacks have run
+        deadline: float = time.monotonic() + 10
+        while video_url in video._conversions and time.monotonic() < deadline:  # noqa: SLF001
+            time.sleep(0.01)
+
+        assert convert_video(video_url).result(timeout=60) is None
+        assert len(calls) == 1
+    finally:
+        executor.shutdown()
+        httpd.shutdown()
+        httpd.server_close()
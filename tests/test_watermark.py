@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from reader import make_reader
+
+from discord_twitter_webhooks.watermark import get_watermark, is_older_than_watermark, set_watermark
+
+if TYPE_CHECKING:
+    from reader import Reader
+
+feed_url: str = "https://nitter.example/TheLovinator1/rss"
+
+
+class FakeEntry:
+    def __init__(
+        self: "FakeEntry",
+        published: datetime | None,
+        updated: datetime | None = None,
+        added: datetime | None = None,
+    ) -> None:
+        self.published: datetime | None = published
+        self.updated: datetime | None = updated
+        self.added: datetime | None = added
+
+
+def test_set_and_get_watermark() -> None:
+    """Test that the watermark is the publish date of the oldest entry."""
+    reader: Reader = make_reader(":memory:")
+    reader.add_feed(feed_url)
+
+    assert get_watermark(reader, feed_url) is None
+
+    oldest = datetime(2023, 7, 1, tzinfo=timezone.utc)
+    newest = datetime(2023, 7, 20, tzinfo=timezone.utc)
+    watermark = set_watermark(reader, feed_url, [FakeEntry(newest), FakeEntry(None), FakeEntry(oldest)])
+
+    assert watermark == oldest
+    assert get_watermark(reader, feed_url) == oldest
+
+
+def test_set_watermark_without_publish_dates() -> None:
+    """Test that feeds without publish dates get a watermark from when their entries were updated or added."""
+    reader: Reader = make_reader(":memory:")
+    reader.add_feed(feed_url)
+
+    assert set_watermark(reader, feed_url, []) is None
+    assert get_watermark(reader, feed_url) is None
+
+    updated = datetime(2023, 7, 1, tzinfo=timezone.utc)
+    added = datetime(2023, 7, 20, tzinfo=timezone.utc)
+    assert set_watermark(reader, feed_url, [FakeEntry(None, added=added), FakeEntry(None, updated, added)]) == updated
+    assert get_watermark(reader, feed_url) == updated
+
+    # Entries from a real feed always have the date we first saw them
+    reader.add_entry({"feed_url": feed_url, "id": "1"})
+    entry = reader.get_entry((feed_url, "1"))
+    assert set_watermark(reader, feed_url, [entry]) == entry.added
+
+
+def test_is_older_than_watermark() -> None:
+    """Test that only entries published before the watermark are old."""
+    watermark = datetime(2023, 7, 1, tzinfo=timezone.utc)
+
+    assert is_older_than_watermark(FakeEntry(datetime(2023, 6, 1, tzinfo=timezone.utc)), watermark)
+    assert not is_older_than_watermark(FakeEntry(watermark), watermark)
+    assert not is_older_than_watermark(FakeEntry(None), watermark)
+    assert is_older_than_watermark(FakeEntry(None, added=datetime(2023, 6, 1, tzinfo=timezone.utc)), watermark)
+    assert not is_older_than_watermark(FakeEntry(datetime(2023, 6, 1, tzinfo=timezone.utc)), None)
@@ -0,0 +1,53 @@
+from discord_twitter_webhooks.whitelist import FilterMatcher, compile_filter
+
+
+def test_keywords() -> None:
+    """Test that words match anywhere in the string, case-insensitive."""
+    matcher: FilterMatcher = compile_filter(("Steam", "sale"), ())
+
+    assert matcher.matches("New steam game")
+    assert matcher.matches("SUMMER SALE")
+    assert not matcher.matches("Nothing to see here")
+
+
+def test_keywords_are_not_regex() -> None:
+    """Test that words with regex characters are matched literally."""
+    matcher: FilterMatcher = compile_filter(("c++", "a.b"), ())
+
+    assert matcher.matches("I like C++")
+    assert not matcher.matches("axb")
+
+
+def test_regex() -> None:
+    """Test that regular expressions are combined and still match like before."""
+    matcher: FilterMatcher = compile_filter((), (r"^RT by", r"\bdeal\b", r"(\w)\1"))
+
+    assert len(matcher.patterns) == 2  # noqa: PLR2004
+    assert matcher.matches("rt by @user: hello")
+    assert matcher.matches("What a DEAL")
+    assert not matcher.matches("dealer")
+
+    # The backreference still points to its own group
+    assert matcher.matches("hello")
+    assert not matcher.matches("abc")
+
+
+def test_invalid_regex_is_skipped() -> None:
+    """Test that an invalid regular expression doesn't break the other ones."""
+    matcher: FilterMatcher = compile_filter((), ("(unclosed", "valid"))
+
+    assert matcher.matches("this is valid")
+    assert not matcher.matches("(unclosed")
+
+
+def test_inline_flags() -> None:
+    """Test that patterns with inline flags still work when they can't be combined."""
+    matcher: FilterMatcher = compile_filter((), ("(?s)a.b", "c"))
+
+    assert matcher.matches("a\nb")
+    assert matcher.matches("C")
+
+
+def test_compile_filter_is_cached() -> None:
+    """Test that the same filter is only compiled once."""
+    assert compile_filter(("a",), ("b",)) is compile_filter(("a",), ("b",))
@@ -0,0 +1,62 @@
+from reader import Reader, make_reader
+
+from discord_twitter_webhooks.workers import (
+    LEASE_TTL,
+    OUTBOX_LEASE,
+    SHARDS,
+    get_shard,
+    get_shard_lease,
+    release_leases,
+    renew_leases,
+)
+
+
+def get_shards(leases: set[str]) -> set[str]:
+    return {name for name in leases if name != OUTBOX_LEASE}
+
+
+def test_get_shard() -> None:
+    """Test that a feed is always in the same shard."""
+    feed_url: str = "https://nitter.example/user/rss"
+    assert get_shard(feed_url) == get_shard(feed_url)
+    assert 0 <= get_shard(feed_url) < SHARDS
+    assert len({get_shard(f"https://nitter.example/user{i}/rss") for i in range(1000)}) == SHARDS
+
+
+def test_leases_are_shared() -> None:
+    """Test that the shards are split between the workers and taken over when a worker stops."""
+    reader: Reader = make_reader(":memory:")
+    every_shard: set[str] = {get_shard_lease(shard) for shard in range(SHARDS)}
+
+    # The first worker takes every shard and the outbox
+    first: set[str] = renew_leases(reader, "first", now=0)
+    assert first == {*every_shard, OUTBOX_LEASE}
+
+    # The second worker has to wait for the first one to give back half of its shards
+    assert renew_leases(reader, "second", now=1) == set()
+    first = renew_leases(reader, "first", now=2)
+    second: set[str] = renew_leases(reader, "second", now=3)
+    assert len(get_shards(first)) == len(second) == SHARDS // 2
+    assert get_shards(first) | second == every_shard
+    assert OUTBOX_LEASE in first
+
+    # The first worker stops renewing its leases, so the second worker takes over everything
+    assert renew_leases(reader, "second", now=3 + LEASE_TTL + 1) == {*every_shard, OUTBOX_LEASE}
+
+    # Leases that are given back can be taken right away
+    release_leases(reader, "second")
+    assert renew_leases(reader, "third", now=5 + LEASE_TTL) == {*every_shard, OUTBOX_LEASE}
+
+
+def test_shards_are_kept_during_a_check() -> None:
+    """Test that a worker that is checking for new tweets keeps its shards until the check is done."""
+    reader: Reader = make_reader(":memory:")
+    renew_leases(reader, "first", now=0)
+    renew_leases(reader, "second", now=1)
+
+    first: set[str] = renew_leases(reader, "first", now=2, give_back=False)
+    assert len(get_shards(first)) == SHARDS
+    assert renew_leases(reader, "second", now=3) == set()
+
+    first = renew_leases(reader, "first", now=4)
+    assert len(get_shards(first)) == len(renew_leases(reader, "second", now=5)) == SHARDS // 2